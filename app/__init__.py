@@ -13,9 +13,18 @@ from .api.comment_routes import comment_routes
 from .api.tweet_like_routes import tweet_like_routes
 from .api.follows_routes import follows_routes
 from .api.image_routes import image_routes
+from .api.metrics import metrics_routes
+from .api.viewer_routes import viewer_routes
+from .api.search_routes import search_routes
+from .api.trend_routes import trend_routes
+from .api.likes import like_buffer
+from .api.uploads import upload_verifier
+from .api.image_pipeline import image_pipeline
+from .api.deletions import deletion_queue
 
 
 from .seeds import seed_commands
+from .commands import timeline_commands, counter_commands, index_commands, search_commands, tag_commands, image_commands
 
 from .config import Config
 
@@ -33,6 +42,12 @@ def load_user(id):
 
 # Tell flask about our seed commands
 app.cli.add_command(seed_commands)
+app.cli.add_command(timeline_commands)
+app.cli.add_command(counter_commands)
+app.cli.add_command(index_commands)
+app.cli.add_command(search_commands)
+app.cli.add_command(tag_commands)
+app.cli.add_command(image_commands)
 
 app.config.from_object(Config)
 app.register_blueprint(user_routes, url_prefix='/api/users')
@@ -42,10 +57,18 @@ app.register_blueprint(comment_routes, url_prefix='/api/comments')
 app.register_blueprint(tweet_like_routes, url_prefix='/api/likes')
 app.register_blueprint(follows_routes, url_prefix='/api/follows')
 app.register_blueprint(image_routes, url_prefix='/api/images')
+app.register_blueprint(metrics_routes, url_prefix='/api/metrics')
+app.register_blueprint(viewer_routes, url_prefix='/api/viewer')
+app.register_blueprint(search_routes, url_prefix='/api/search')
+app.register_blueprint(trend_routes, url_prefix='/api')
 
 
 db.init_app(app)
 Migrate(app, db)
+like_buffer.init_app(app)
+upload_verifier.init_app(app)
+image_pipeline.init_app(app)
+deletion_queue.init_app(app)
 
 # Application Security
 CORS(app)
@@ -3,6 +3,8 @@ from app.models import User, db
 from app.forms import LoginForm
 from app.forms import SignUpForm
 from flask_login import current_user, login_user, logout_user, login_required
+from .feed_queries import serialize_profile
+from .search import index_user
 
 auth_routes = Blueprint('auth', __name__)
 
@@ -24,7 +26,7 @@ def authenticate():
     Authenticates a user.
     """
     if current_user.is_authenticated:
-        return current_user.to_dict()
+        return serialize_profile(current_user.id, current_user.id)
     return {'errors': ['Unauthorized']}
 
 
@@ -41,7 +43,7 @@ def login():
         # Add the user to the session, we are logged in!
         user = User.query.filter(User.email == form.data['email']).first()
         login_user(user)
-        return user.to_dict()
+        return serialize_profile(user.id, user.id)
     return {'errors': validation_errors_to_error_messages(form.errors)}, 401
 
 
@@ -73,9 +75,11 @@ def sign_up():
             profile_image=profile_image
         )
         db.session.add(user)
+        db.session.flush()
+        index_user(user)
         db.session.commit()
         login_user(user)
-        return user.to_dict()
+        return serialize_profile(user.id, user.id)
     return {'errors': validation_errors_to_error_messages(form.errors)}, 401
 
 
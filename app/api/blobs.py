@@ -0,0 +1,94 @@
+from sqlalchemy import exists, func, select, update
+
+from app.models import db, Image, ImageBlob, IMAGE_READY
+from .likes import INSERT_BY_DIALECT
+from .metrics import Counters, register_metrics
+
+# Images are stored once per distinct content. Each ImageBlob row is an
+# object in storage with the number of ready images pointing at it: an
+# upload whose digest is already stored takes a reference instead of a new
+# copy, and deleting an image only queues the object for deletion with its
+# last reference, see app/api/deletions.py.
+
+image_blobs = ImageBlob.__table__
+
+blob_metrics = Counters('stored', 'deduplicated', 'released')
+
+register_metrics('image_blobs', blob_metrics.snapshot)
+
+
+def acquire_blob(digest, key, size):
+    """
+    Takes a reference to the stored content with this digest, recording it
+    under `key` if it isn't stored yet. Returns the key the content is
+    stored under and whether the caller has to store it there.
+
+    The blob row stays locked until the caller commits, so an upload of the
+    same content waits for this one's, and the deletion queue can't delete
+    the object while the new reference is being counted.
+    """
+    insert = INSERT_BY_DIALECT[db.engine.dialect.name]
+    db.session.execute(
+        insert(image_blobs)
+        .values(key=key, digest=digest, size=size, ref_count=1)
+        .on_conflict_do_update(index_elements=['digest'], set_={'ref_count': image_blobs.c.ref_count + 1})
+    )
+    # Served by ix_image_blobs_digest
+    stored_key, ref_count = db.session.execute(
+        select(image_blobs.c.key, image_blobs.c.ref_count).where(image_blobs.c.digest == digest)
+    ).one()
+    # A count of one means nothing else holds the content, so make sure it
+    # is stored even if a blob row was left over with no references
+    created = ref_count == 1
+    blob_metrics.incr('stored' if created else 'deduplicated')
+    return stored_key, created
+
+
+def release_blob(key):
+    """
+    Drops a reference to the object stored under `key`, once the image
+    holding it has been deleted and flushed. Returns whether that was the
+    last one. The blob row is left at zero references for the deletion
+    queue, which only deletes the object if it is still unreferenced then.
+    """
+    blob_metrics.incr('released')
+    updated = db.session.execute(
+        update(image_blobs).where(image_blobs.c.key == key).values(ref_count=image_blobs.c.ref_count - 1)
+    ).rowcount
+    if not updated:
+        # Stored before blobs were tracked, e.g. by the seeders; served by
+        # ix_images_key
+        return not db.session.execute(select(exists().where(Image.key == key))).scalar()
+    return db.session.execute(select(image_blobs.c.ref_count).where(image_blobs.c.key == key)).scalar() <= 0
+
+
+def release_images(images):
+    """
+    Releases the stored objects of images that have been deleted and
+    flushed, and returns the groups of keys to hand to the deletion queue
+    once committed: an object followed by its resized variants.
+    """
+    groups = []
+    for image in images:
+        if image.status != IMAGE_READY:
+            # A pending upload's object isn't shared with any other image
+            groups.append((image.key,))
+        elif release_blob(image.key):
+            groups.append((image.key, *(variant['key'] for variant in image.variants or [])))
+    return groups
+
+
+def reconcile_blob_refs():
+    """
+    Recounts every blob's references from the images table and repairs the
+    rows that drifted. Returns how many were fixed.
+    """
+    ref_count = select(func.count(Image.id)) \
+        .where(Image.key == image_blobs.c.key, Image.status == IMAGE_READY).scalar_subquery()
+    result = db.session.execute(
+        update(image_blobs)
+        .where(image_blobs.c.ref_count != ref_count)
+        .values(ref_count=ref_count)
+    )
+    db.session.commit()
+    return result.rowcount
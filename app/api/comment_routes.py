@@ -3,6 +3,14 @@ from flask_login import login_required, current_user
 from app.models import Tweet, db, User, Comment
 from app.forms import CommentForm
 from .auth_routes import validation_errors_to_error_messages
+from .blobs import release_images
+from .counters import adjust_tweet_counters, bump_tweet_version
+from .deletions import deletion_queue
+from .feed_queries import fetch_comment_page, serialize_comments, stream_comments
+from .search import index_comment, unindex_comment
+from .pagination import InvalidCursor, get_page_size
+from .streaming import ndjson_response, wants_ndjson
+from .tweet_cache import tweet_cache
 
 
 comment_routes = Blueprint('comments', __name__)
@@ -12,9 +20,28 @@ comment_routes = Blueprint('comments', __name__)
 @comment_routes.route('')
 @login_required
 def get_all_comments():
-    comments = Comment.query.all()
-    result = [comment.to_dict() for comment in comments]
-    return {"comments": result}
+    """
+    Comments newest first, one page at a time, optionally filtered by
+    ?tweet_id= and ?user_id=. ?format=ndjson streams every match instead.
+    """
+    tweet_id = request.args.get('tweet_id', type=int)
+    user_id = request.args.get('user_id', type=int)
+    if wants_ndjson(request.args):
+        return ndjson_response(stream_comments(tweet_id, user_id))
+
+    per_page = get_page_size(request.args)
+    try:
+        comments, next_cursor = fetch_comment_page(
+            tweet_id, request.args.get('cursor'), per_page, user_id=user_id)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    return {
+        'comments': serialize_comments(comments),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
 
 
 #id is for tweet
@@ -31,7 +58,11 @@ def post_new_comment(id):
             tweet_id=int(id)
         )
         db.session.add(new_comment)
+        db.session.flush()
+        index_comment(new_comment.id, new_comment.content)
+        adjust_tweet_counters(int(id), comment_count=1)
         db.session.commit()
+        tweet_cache.invalidate(int(id))
         return new_comment.to_dict()
     return {'errors': validation_errors_to_error_messages(form.errors)}, 400
 
@@ -52,9 +83,12 @@ def update_comment(id):
             form['csrf_token'].data = request.cookies['csrf_token']
             if form.validate_on_submit():
                 comment.content = form.data["content"]
+                index_comment(comment.id, comment.content)
                 result = comment.to_dict()
                 # result["user"] = user.to_dict()
+                bump_tweet_version(comment_dict['tweet_id'])
                 db.session.commit()
+                tweet_cache.invalidate(comment_dict['tweet_id'])
                 return result
             return {'errors': validation_errors_to_error_messages(form.errors)}, 400
     else:
@@ -73,7 +107,14 @@ def delete_comment(id):
         else:
             form = CommentForm()
             form['csrf_token'].data = request.cookies['csrf_token']
+            unindex_comment(comment.id)
+            images = list(comment.comment_images)
             db.session.delete(comment)
+            adjust_tweet_counters(comment_dict['tweet_id'], comment_count=-1)
+            db.session.flush()
+            released = release_images(images)
             db.session.commit()
+            deletion_queue.put(released)
+            tweet_cache.invalidate(comment_dict['tweet_id'])
             return {"message": "Comment successfully deleted"}
     return {'errors': 'Tweet not found'}, 404
@@ -0,0 +1,107 @@
+from sqlalchemy import func, or_, select, update
+
+from app.models import db, Tweet, Like, Comment, Image, IMAGE_READY, User
+from app.models.user import follows
+
+tweets = Tweet.__table__
+users = User.__table__
+
+
+def adjust_tweet_counters(tweet_id, **deltas):
+    """
+    Applies relative changes such as like_count=1 to a tweet's denormalized
+    counters and bumps its version. The arithmetic happens in SQL so
+    concurrent requests can't lose each other's updates.
+    """
+    if tweet_id is None:
+        return
+    values = {name: tweets.c[name] + delta for name, delta in deltas.items()}
+    values['version'] = tweets.c.version + 1
+    # created_at has onupdate=now(), so pin it or every like would bump the
+    # tweet to the top of the feed
+    values['created_at'] = tweets.c.created_at
+    db.session.execute(update(tweets).where(tweets.c.id == tweet_id).values(**values))
+
+
+def bump_tweet_version(tweet_id):
+    """
+    Marks a tweet's payload as changed for writes that don't move a counter,
+    such as edits to the tweet or one of its comments
+    """
+    adjust_tweet_counters(tweet_id)
+
+
+def bump_user_versions(*user_ids):
+    """
+    Marks profiles as changed, e.g. a new profile image
+    """
+    db.session.execute(
+        update(users).where(users.c.id.in_(user_ids)).values(version=users.c.version + 1)
+    )
+
+
+def adjust_user_counters(user_id, **deltas):
+    """
+    Applies relative changes such as follower_count=1 to a user's follow
+    counters in SQL and bumps their version
+    """
+    values = {name: users.c[name] + delta for name, delta in deltas.items()}
+    values['version'] = users.c.version + 1
+    db.session.execute(update(users).where(users.c.id == user_id).values(**values))
+
+
+def reconcile_tweet_counters():
+    """
+    Recomputes every tweet's counters from the likes, comments and images
+    tables and repairs the rows that drifted. Returns how many were fixed.
+    """
+    like_count = select(func.count(Like.id)) \
+        .where(Like.tweet_id == tweets.c.id).scalar_subquery()
+    comment_count = select(func.count(Comment.id)) \
+        .where(Comment.tweet_id == tweets.c.id).scalar_subquery()
+    image_count = select(func.count(Image.id)) \
+        .where(Image.tweet_id == tweets.c.id, Image.status == IMAGE_READY).scalar_subquery()
+
+    result = db.session.execute(
+        update(tweets)
+        .where(or_(
+            tweets.c.like_count != like_count,
+            tweets.c.comment_count != comment_count,
+            tweets.c.image_count != image_count
+        ))
+        .values(
+            like_count=like_count,
+            comment_count=comment_count,
+            image_count=image_count,
+            version=tweets.c.version + 1,
+            created_at=tweets.c.created_at
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def reconcile_user_counters():
+    """
+    Recomputes every user's follower and following counts from the follows
+    table and repairs the rows that drifted. Returns how many were fixed.
+    """
+    follower_count = select(func.count()).select_from(follows) \
+        .where(follows.c.following_id == users.c.id).scalar_subquery()
+    following_count = select(func.count()).select_from(follows) \
+        .where(follows.c.follower_id == users.c.id).scalar_subquery()
+
+    result = db.session.execute(
+        update(users)
+        .where(or_(
+            users.c.follower_count != follower_count,
+            users.c.following_count != following_count
+        ))
+        .values(
+            follower_count=follower_count,
+            following_count=following_count,
+            version=users.c.version + 1
+        )
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,260 @@
+import atexit
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+
+from flask import has_app_context
+from sqlalchemy import delete, select
+
+from app.models import db, Image, ImageBlob
+from .metrics import Counters, register_metrics
+from .s3_image_upload import ALLOWED_EXTENSIONS
+from .storage import storage
+
+# Stored objects are deleted in the background, in batches, rather than on
+# the request that deleted their image. Routes queue an object with its
+# resized variants once their transaction has committed; the queue deletes
+# whatever is still unreferenced when it flushes. Objects a process never
+# got to delete, or that nothing ever referenced, are reclaimed by
+# `flask images sweep`.
+
+# How often queued objects are deleted; 0 deletes them on the calling
+# thread straight away
+STORAGE_DELETE_INTERVAL_SECONDS = float(os.environ.get('STORAGE_DELETE_INTERVAL_SECONDS', 5))
+# Keys per DeleteObjects call, which takes at most 1000
+STORAGE_DELETE_BATCH_SIZE = min(int(os.environ.get('STORAGE_DELETE_BATCH_SIZE', 1000)), 1000)
+# Objects younger than this are never swept, so an upload whose image row
+# hasn't been committed yet isn't mistaken for an orphan
+ORPHAN_GRACE_SECONDS = int(os.environ.get('ORPHAN_GRACE_SECONDS', 24 * 60 * 60))
+
+# Resized variants are stored as <stem>_<width>w.webp next to <stem>.<ext>
+VARIANT_KEY = re.compile(r'^(.+)_\d+w\.webp$')
+
+# Keeps IN lists under SQLite's bound parameter limit
+_IN_CHUNK = 500
+
+logger = logging.getLogger(__name__)
+
+image_blobs = ImageBlob.__table__
+
+
+def _chunks(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _referenced(keys):
+    """
+    The keys among `keys` that an image points at, or that a blob holding
+    references is stored under. Served by ix_images_key and the blobs'
+    primary key.
+    """
+    referenced = set()
+    for chunk in _chunks(keys, _IN_CHUNK):
+        referenced.update(db.session.execute(select(Image.key).where(Image.key.in_(chunk))).scalars())
+        referenced.update(db.session.execute(
+            select(image_blobs.c.key).where(image_blobs.c.key.in_(chunk), image_blobs.c.ref_count > 0)
+        ).scalars())
+    return referenced
+
+
+def delete_unreferenced(groups):
+    """
+    Deletes the objects of each (key, *variant keys) group whose key nothing
+    references, with their blob rows. Returns the keys it deleted and those
+    among them storage failed to delete. Commits.
+
+    A blob row is only deleted at zero references, and its object before
+    the transaction commits: an upload of the same content either counted
+    its reference first, and the group is skipped, or waits on the row and
+    then stores the content again.
+    """
+    candidates = {group[0]: group for group in groups}
+    try:
+        # One statement per key, as the row counts tell which rows were
+        # still unreferenced; the first also takes SQLite's write lock
+        for key in candidates:
+            db.session.execute(delete(image_blobs).where(image_blobs.c.key == key, image_blobs.c.ref_count <= 0))
+        referenced = _referenced(candidates)
+        keys = [key for base, group in candidates.items() if base not in referenced for key in group]
+        failed = []
+        for chunk in _chunks(keys, STORAGE_DELETE_BATCH_SIZE):
+            failed.extend(storage.delete_many(chunk))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return keys, failed
+
+
+class DeletionQueue:
+    """
+    Collects groups of stored objects to delete and hands them to
+    delete_unreferenced from a background thread every `interval` seconds,
+    or as soon as `batch_size` keys are queued. Keys storage failed to
+    delete are queued again.
+
+    Like the like write buffer the queue is per process and close() flushes
+    what's left at interpreter exit; what a killed process loses is picked
+    up by the orphan sweep.
+    """
+
+    def __init__(self, interval=STORAGE_DELETE_INTERVAL_SECONDS, batch_size=STORAGE_DELETE_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.app = None
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = []
+        self._pending_keys = 0
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+        self._counters = Counters('queued', 'flushes', 'deleted', 'skipped', 'failed', 'failed_flushes')
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.close)
+
+    def put(self, groups):
+        """
+        Queues (key, *variant keys) groups, once the transaction that
+        released them has committed
+        """
+        groups = [tuple(group) for group in groups if group]
+        if not groups:
+            return
+        with self._lock:
+            self._pending.extend(groups)
+            self._pending_keys += sum(len(group) for group in groups)
+            full = self._pending_keys >= self.batch_size
+            if self.interval and self._thread is None:
+                self._thread = Thread(target=self._run, name='storage-deletions', daemon=True)
+                self._thread.start()
+        self._counters.incr('queued', len(groups))
+        if not self.interval:
+            self.flush()
+        elif full:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Deletes everything queued and returns how many objects that was
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending, self._pending_keys = self._pending, [], 0
+            if not batch:
+                return 0
+            deleted = 0
+            for groups in self._batches(batch):
+                try:
+                    keys, failed = self._delete(groups)
+                except Exception:
+                    logger.exception("Deleting %d stored objects failed", len(groups))
+                    self._counters.incr('failed_flushes')
+                    self._requeue(groups)
+                    continue
+                if failed:
+                    logger.warning("Storage failed to delete %d objects", len(failed))
+                    self._counters.incr('failed', len(failed))
+                    self._requeue([(key,) for key in failed])
+                deleted += len(keys) - len(failed)
+                self._counters.incr('skipped', sum(len(group) for group in groups) - len(keys))
+            self._counters.incr('flushes')
+            self._counters.incr('deleted', deleted)
+            return deleted
+
+    def _delete(self, groups):
+        # Flushing inline runs on the request's own session, which a
+        # nested app context would tear down
+        if has_app_context():
+            return delete_unreferenced(groups)
+        with self.app.app_context():
+            try:
+                return delete_unreferenced(groups)
+            finally:
+                db.session.remove()
+
+    def _batches(self, groups):
+        batch, size = [], 0
+        for group in groups:
+            if batch and size + len(group) > self.batch_size:
+                yield batch
+                batch, size = [], 0
+            batch.append(group)
+            size += len(group)
+        if batch:
+            yield batch
+
+    def _requeue(self, groups):
+        with self._lock:
+            self._pending.extend(groups)
+            self._pending_keys += sum(len(group) for group in groups)
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.app is not None:
+            self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stats(self):
+        stats = self._counters.snapshot()
+        with self._lock:
+            stats['pending'] = self._pending_keys
+        return stats
+
+
+deletion_queue = DeletionQueue()
+
+register_metrics('storage_deletions', deletion_queue.stats)
+
+
+def _owner_keys(key):
+    """
+    The keys the image an object belongs to may be stored under: the key
+    itself, or for a resized variant its original's, whose extension the
+    variant's name doesn't carry
+    """
+    match = VARIANT_KEY.match(key)
+    if match is None:
+        return [key]
+    return [f'{match.group(1)}.{ext}' for ext in sorted(ALLOWED_EXTENSIONS)]
+
+
+def sweep_orphans(start_after='', limit=1000, now=None):
+    """
+    Reclaims the stored objects nothing references, one page of the bucket
+    listing at a time: the page's keys, and the originals of its variants,
+    are looked up in the images and blobs tables in a few IN queries. Returns
+    how many objects the page held, how many were deleted, and the key to
+    continue after, None once the listing is exhausted.
+    """
+    objects = storage.list(start_after, limit)
+    if not objects:
+        return {'listed': 0, 'deleted': 0, 'next': None}
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(seconds=ORPHAN_GRACE_SECONDS)
+    settled = [item['key'] for item in objects if item['last_modified'] < cutoff]
+    owners = {key: _owner_keys(key) for key in settled}
+    referenced = _referenced({owner for keys in owners.values() for owner in keys})
+    orphans = [key for key, keys in owners.items() if referenced.isdisjoint(keys)]
+    deleted = 0
+    if orphans:
+        keys, failed = delete_unreferenced([(key,) for key in orphans])
+        deleted = len(keys) - len(failed)
+    return {
+        'listed': len(objects),
+        'deleted': deleted,
+        'next': objects[-1]['key'] if len(objects) == limit else None
+    }
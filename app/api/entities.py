@@ -0,0 +1,96 @@
+import re
+
+from sqlalchemy import delete, func, insert, select
+
+from app.models import db, Tweet, TweetHashtag, TweetMention, User
+
+# A hashtag is '#' followed by word characters, at least one of them not a
+# digit, and not glued to a preceding word ("a#b", "&#39;" aren't tags)
+HASHTAG = re.compile(r'(?<![\w&#])#(\w*[^\W\d]\w*)')
+MENTION = re.compile(r'(?<![\w@])@(\w+)')
+TAG_MAX_LENGTH = 100
+USERNAME_MAX_LENGTH = 40
+
+tweet_hashtags = TweetHashtag.__table__
+tweet_mentions = TweetMention.__table__
+
+
+def extract_hashtags(content):
+    """
+    The distinct hashtags in `content`, lowercased and without the '#', in
+    order of first appearance
+    """
+    tags = (tag.lower() for tag in HASHTAG.findall(content or ''))
+    return list(dict.fromkeys(tag for tag in tags if len(tag) <= TAG_MAX_LENGTH))
+
+
+def extract_mentions(content):
+    """
+    The distinct usernames @mentioned in `content`, lowercased
+    """
+    names = (name.lower() for name in MENTION.findall(content or ''))
+    return list(dict.fromkeys(name for name in names if len(name) <= USERNAME_MAX_LENGTH))
+
+
+def save_tweet_entities(tweet_id, content):
+    """
+    Brings the tweet's stored hashtags and mentions in line with `content`,
+    keeping the rows of entities an edit didn't touch, and returns the tags
+    that are new to the tweet. Mentions of unknown usernames are dropped.
+    """
+    tags = extract_hashtags(content)
+    existing = set(db.session.execute(
+        select(tweet_hashtags.c.tag).where(tweet_hashtags.c.tweet_id == tweet_id)
+    ).scalars())
+    removed = existing.difference(tags)
+    if removed:
+        db.session.execute(delete(tweet_hashtags).where(
+            tweet_hashtags.c.tweet_id == tweet_id, tweet_hashtags.c.tag.in_(removed)
+        ))
+    added = [tag for tag in tags if tag not in existing]
+    if added:
+        db.session.execute(insert(tweet_hashtags), [{'tweet_id': tweet_id, 'tag': tag} for tag in added])
+
+    names = extract_mentions(content)
+    # Served by ix_users_lower_username
+    user_ids = set(db.session.execute(
+        select(User.id).where(func.lower(User.username).in_(names))
+    ).scalars()) if names else set()
+    existing = set(db.session.execute(
+        select(tweet_mentions.c.user_id).where(tweet_mentions.c.tweet_id == tweet_id)
+    ).scalars())
+    if existing - user_ids:
+        db.session.execute(delete(tweet_mentions).where(
+            tweet_mentions.c.tweet_id == tweet_id, tweet_mentions.c.user_id.in_(existing - user_ids)
+        ))
+    if user_ids - existing:
+        db.session.execute(insert(tweet_mentions), [
+            {'tweet_id': tweet_id, 'user_id': user_id} for user_id in sorted(user_ids - existing)
+        ])
+    return added
+
+
+def remove_tweet_entities(tweet_id):
+    db.session.execute(delete(tweet_hashtags).where(tweet_hashtags.c.tweet_id == tweet_id))
+    db.session.execute(delete(tweet_mentions).where(tweet_mentions.c.tweet_id == tweet_id))
+
+
+def backfill_entities(batch_size=1000):
+    """
+    Extracts the hashtags and mentions of every existing tweet, committing
+    every `batch_size` tweets, and returns how many tweets were read
+    """
+    count = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Tweet.id, Tweet.content).where(Tweet.id > last_id).order_by(Tweet.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        for tweet_id, content in rows:
+            save_tweet_entities(tweet_id, content)
+        db.session.commit()
+        count += len(rows)
+        last_id = rows[-1].id
+    return count
@@ -0,0 +1,85 @@
+import hashlib
+import json
+
+from flask import current_app, jsonify, request
+from sqlalchemy import func, select
+
+from app.models import db, Tweet, Comment, Image, IMAGE_READY, User
+from .feed_queries import fetch_viewer_likes
+
+# Conditional GET support. Each fingerprint below reads only row versions,
+# counts and max ids, which is enough to tell whether the matching payload
+# changed without loading or serializing it. The tweets.version and
+# users.version columns are bumped by the write routes via app/api/counters.py.
+
+
+def make_etag(*parts):
+    raw = json.dumps(parts, default=str, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _tag(response, etag):
+    response.set_etag(etag)
+    # Let browsers keep the payload but always revalidate it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag):
+    """
+    A 304 response if the client's If-None-Match already holds `etag`,
+    otherwise None
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    return _tag(current_app.response_class(status=304), etag)
+
+
+def with_etag(payload, etag):
+    return _tag(jsonify(payload), etag)
+
+
+def tweets_fingerprint(tweet_ids, viewer_id):
+    """
+    Versions of `tweet_ids`, of every user who wrote them or replied to them,
+    and the viewer's likes on them
+    """
+    if not tweet_ids:
+        return []
+    versions = db.session.execute(
+        select(Tweet.id, Tweet.version).where(Tweet.id.in_(tweet_ids)).order_by(Tweet.id)
+    ).all()
+
+    authors = select(Tweet.user_id).where(Tweet.id.in_(tweet_ids)) \
+        .union(select(Comment.user_id).where(Comment.tweet_id.in_(tweet_ids))) \
+        .subquery()
+    # The set of authors only changes along with a tweet version, so a count
+    # and a sum of their versions is enough to notice profile edits
+    author_versions = db.session.execute(
+        select(func.count(User.id), func.sum(User.version))
+        .where(User.id.in_(select(authors.c.user_id)))
+    ).one()
+
+    viewer_likes = sorted(fetch_viewer_likes(viewer_id, tweet_ids).items())
+    return [[list(row) for row in versions], list(author_versions), viewer_likes]
+
+
+def profile_fingerprint(user_id):
+    """
+    Fingerprint of the profile of `user_id`, in either its summary or its full
+    form, or None if there's no such user. New and deleted tweets show up in
+    the count and max id, changes to existing ones in the sum of their
+    versions.
+    """
+    version = db.session.execute(select(User.version).where(User.id == user_id)).scalar()
+    if version is None:
+        return None
+    tweets = db.session.execute(
+        select(func.count(Tweet.id), func.max(Tweet.id), func.sum(Tweet.version))
+        .where(Tweet.user_id == user_id)
+    ).one()
+    banners = db.session.execute(
+        select(func.count(Image.id), func.max(Image.id))
+        .where(Image.user_id == user_id, Image.type == 'user_header', Image.status == IMAGE_READY)
+    ).one()
+    return [user_id, version, list(tweets), list(banners)]
@@ -0,0 +1,516 @@
+import os
+from collections import namedtuple
+
+from sqlalchemy import and_, exists, func, select, union
+
+from app.models import db, Tweet, Comment, Image, IMAGE_READY, Like, TweetHashtag, TweetMention, User
+from app.models.user import follows
+from .likes import like_buffer
+from .pagination import DEFAULT_PAGE_SIZE, InvalidCursor, decode_cursor, encode_cursor, keyset_paginate
+from .streaming import EXPORT_BATCH_SIZE
+from .tweet_cache import tweet_cache
+
+# Read-only query layer for the feed, detail and profile endpoints. It selects
+# just the columns those payloads need with SQLAlchemy Core and keeps them in
+# namedtuples, so nothing is hydrated into ORM instances or the identity map.
+
+# How many of the newest replies are embedded with each tweet in a feed
+COMMENT_PREVIEW_LIMIT = int(os.environ.get('COMMENT_PREVIEW_LIMIT', 3))
+
+TweetRow = namedtuple('TweetRow', [
+    'id', 'content', 'user_id', 'created_at', 'like_count', 'comment_count', 'image_count'
+])
+UserRow = namedtuple('UserRow', ['id', 'username', 'first_name', 'last_name', 'profile_image'])
+CommentRow = namedtuple('CommentRow', ['id', 'content', 'user_id', 'tweet_id', 'created_at'])
+ImageRow = namedtuple('ImageRow', [
+    'id', 'url', 'key', 'user_id', 'tweet_id', 'comment_id', 'status', 'width', 'height', 'placeholder',
+    'variants'
+])
+
+
+def _select(row_type, model):
+    return select(*[getattr(model, field) for field in row_type._fields])
+
+
+def fetch_tweets(tweet_ids):
+    if not tweet_ids:
+        return {}
+    rows = db.session.execute(_select(TweetRow, Tweet).where(Tweet.id.in_(tweet_ids)))
+    return {row.id: TweetRow._make(row) for row in rows}
+
+
+def fetch_tweet_versions(tweet_ids):
+    """
+    Maps tweet id -> tweets.version, the tweet cache's key, for the ids that
+    exist
+    """
+    if not tweet_ids:
+        return {}
+    rows = db.session.execute(select(Tweet.id, Tweet.version).where(Tweet.id.in_(tweet_ids)))
+    return dict(rows.all())
+
+
+def fetch_users(user_ids):
+    if not user_ids:
+        return {}
+    rows = db.session.execute(_select(UserRow, User).where(User.id.in_(user_ids)))
+    return {row.id: UserRow._make(row) for row in rows}
+
+
+def fetch_images(column, owner_ids):
+    """
+    Groups the images attached to `owner_ids` by `column`, which is either
+    Image.tweet_id or Image.comment_id
+    """
+    if not owner_ids:
+        return {}
+    rows = db.session.execute(
+        _select(ImageRow, Image)
+        .where(column.in_(owner_ids), Image.status == IMAGE_READY)
+        .order_by(Image.id)
+    )
+    images = {}
+    for row in rows:
+        image = ImageRow._make(row)
+        images.setdefault(getattr(image, column.key), []).append(image)
+    return images
+
+
+def fetch_viewer_likes(viewer_id, tweet_ids):
+    """
+    Maps tweet id -> like id for the tweets the viewer has liked. Likes still
+    in the write buffer map to None until they're flushed.
+    """
+    if not tweet_ids:
+        return {}
+    rows = db.session.execute(
+        select(Like.tweet_id, Like.id).where(Like.user_id == viewer_id, Like.tweet_id.in_(tweet_ids))
+    )
+    viewer_likes = {tweet_id: like_id for tweet_id, like_id in rows}
+    for tweet_id, liked in like_buffer.pending(viewer_id, tweet_ids).items():
+        if liked:
+            viewer_likes.setdefault(tweet_id, None)
+        else:
+            viewer_likes.pop(tweet_id, None)
+    return viewer_likes
+
+
+def fetch_viewer_comments(viewer_id, tweet_ids):
+    """
+    The subset of `tweet_ids` the viewer has replied to
+    """
+    if not tweet_ids:
+        return set()
+    rows = db.session.execute(
+        select(Comment.tweet_id).distinct()
+        .where(Comment.user_id == viewer_id, Comment.tweet_id.in_(tweet_ids))
+    )
+    return set(rows.scalars())
+
+
+def fetch_viewer_following(viewer_id, user_ids):
+    """
+    The subset of `user_ids` the viewer follows
+    """
+    if not user_ids:
+        return set()
+    rows = db.session.execute(
+        select(follows.c.following_id)
+        .where(follows.c.follower_id == viewer_id, follows.c.following_id.in_(user_ids))
+    )
+    return set(rows.scalars())
+
+
+def fetch_comment_previews(tweet_ids, limit=COMMENT_PREVIEW_LIMIT):
+    """
+    Maps tweet id -> that tweet's `limit` newest comments, fetched for every
+    tweet at once with a ROW_NUMBER() window instead of loading all comments
+    """
+    if not tweet_ids:
+        return {}
+    ranked = select(
+        *[getattr(Comment, field) for field in CommentRow._fields],
+        func.row_number().over(
+            partition_by=Comment.tweet_id,
+            order_by=(Comment.created_at.desc(), Comment.id.desc())
+        ).label('position')
+    ).where(Comment.tweet_id.in_(tweet_ids)).subquery()
+
+    rows = db.session.execute(
+        select(*[ranked.c[field] for field in CommentRow._fields])
+        .where(ranked.c.position <= limit)
+        .order_by(ranked.c.tweet_id, ranked.c.position)
+    )
+    previews = {}
+    for row in rows:
+        comment = CommentRow._make(row)
+        previews.setdefault(comment.tweet_id, []).append(comment)
+    return previews
+
+
+def fetch_user_tweet_page(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the ids of `user_id`'s tweets, newest first, and the next
+    page's cursor
+    """
+    rows, next_cursor = keyset_paginate(
+        select(Tweet.created_at, Tweet.id).where(Tweet.user_id == user_id),
+        Tweet.created_at,
+        Tweet.id,
+        cursor=cursor,
+        limit=limit
+    )
+    return [row.id for row in rows], next_cursor
+
+
+def fetch_tag_page(tag, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the ids of the tweets tagged #`tag`, most recently tagged
+    first, and the next page's cursor. A range scan on
+    ix_tweet_hashtags_tag_created_at.
+    """
+    rows, next_cursor = keyset_paginate(
+        select(TweetHashtag.created_at, TweetHashtag.tweet_id).where(TweetHashtag.tag == tag.lower()),
+        TweetHashtag.created_at,
+        TweetHashtag.tweet_id,
+        cursor=cursor,
+        limit=limit
+    )
+    return [row.tweet_id for row in rows], next_cursor
+
+
+def fetch_mention_page(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the ids of the tweets mentioning `user_id`, newest mention
+    first, and the next page's cursor
+    """
+    rows, next_cursor = keyset_paginate(
+        select(TweetMention.created_at, TweetMention.tweet_id).where(TweetMention.user_id == user_id),
+        TweetMention.created_at,
+        TweetMention.tweet_id,
+        cursor=cursor,
+        limit=limit
+    )
+    return [row.tweet_id for row in rows], next_cursor
+
+def stream_user_tweets(user_id, viewer_id, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields every tweet `user_id` has posted, serialized, newest first, off a
+    server side cursor `batch_size` at a time. Bypasses the tweet cache so
+    an export doesn't evict the tweets feeds are actually reading.
+    """
+    result = db.session.execute(
+        select(Tweet.id)
+        .where(Tweet.user_id == user_id)
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for rows in result.partitions(batch_size):
+        yield from serialize_tweets([row.id for row in rows], viewer_id, use_cache=False)
+
+
+def select_comments(tweet_id=None, user_id=None):
+    query = _select(CommentRow, Comment)
+    if tweet_id is not None:
+        query = query.where(Comment.tweet_id == tweet_id)
+    if user_id is not None:
+        query = query.where(Comment.user_id == user_id)
+    return query
+
+
+def fetch_comment_page(tweet_id=None, cursor=None, limit=DEFAULT_PAGE_SIZE, user_id=None):
+    """
+    One page of comments, newest first, and the next page's cursor,
+    optionally only those on `tweet_id` and/or by `user_id`
+    """
+    rows, next_cursor = keyset_paginate(
+        select_comments(tweet_id, user_id),
+        Comment.created_at,
+        Comment.id,
+        cursor=cursor,
+        limit=limit
+    )
+    return [CommentRow._make(row) for row in rows], next_cursor
+
+
+def stream_comments(tweet_id=None, user_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields every matching comment, serialized, in id order. Rows come off a
+    server side cursor `batch_size` at a time and each batch's images and
+    authors are fetched together, so memory stays flat however many
+    comments there are.
+    """
+    result = db.session.execute(
+        select_comments(tweet_id, user_id)
+        .order_by(Comment.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for rows in result.partitions(batch_size):
+        yield from serialize_comments([CommentRow._make(row) for row in rows])
+
+
+def serialize_user(user):
+    if not user:
+        return None
+    return {
+        'id': user.id,
+        'username': user.username,
+        'firstName': user.first_name,
+        'lastName': user.last_name,
+        'profileImage': user.profile_image
+    }
+
+
+def fetch_profile_summaries(user_ids, viewer_id=None):
+    """
+    Maps user id -> profile summary. Follow counts are read from the
+    denormalized columns and the tweet count is computed in SQL, so the cost
+    doesn't grow with the user's history or audience. `viewer_is_following`
+    says whether `viewer_id` follows that user.
+    """
+    if not user_ids:
+        return {}
+    tweet_count = select(func.count(Tweet.id)).where(Tweet.user_id == User.id).scalar_subquery()
+    banner_image = select(Image.url) \
+        .where(Image.user_id == User.id, Image.type == 'user_header', Image.status == IMAGE_READY) \
+        .order_by(Image.id).limit(1).scalar_subquery()
+    viewer_is_following = exists().where(
+        and_(follows.c.follower_id == viewer_id, follows.c.following_id == User.id)
+    )
+
+    rows = db.session.execute(
+        select(
+            User.id, User.username, User.first_name, User.last_name, User.email, User.profile_image,
+            banner_image, User.follower_count, User.following_count, tweet_count, viewer_is_following
+        ).where(User.id.in_(user_ids))
+    )
+    return {
+        row[0]: {
+            'id': row[0],
+            'username': row[1],
+            'firstName': row[2],
+            'lastName': row[3],
+            'email': row[4],
+            'profileImage': row[5],
+            'profileBannerImage': row[6],
+            'follower_count': row[7],
+            'following_count': row[8],
+            'tweet_count': row[9],
+            'viewer_is_following': bool(row[10])
+        }
+        for row in rows
+    }
+
+
+def serialize_profile(user_id, viewer_id=None):
+    """
+    The profile summary of one user, or None if there's no such user
+    """
+    return fetch_profile_summaries([user_id], viewer_id).get(user_id)
+
+
+def _lower_starts_with(column, prefix):
+    lowered = func.lower(column)
+    if db.engine.dialect.name == 'postgresql':
+        # Answered from the text_pattern_ops index
+        return lowered.startswith(prefix, autoescape=True)
+    # SQLite only runs LIKE off an index on a bare NOCASE column, so the
+    # prefix is spelled out as the range of strings that start with it
+    return and_(lowered >= prefix, lowered < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def user_prefix_statement(prefix):
+    """
+    The ids of the users whose username, first or last name starts with the
+    lowercase `prefix`: a union of one range scan per lower() index declared
+    on User
+    """
+    return union(*[
+        select(User.id).where(_lower_starts_with(column, prefix))
+        for column in (User.username, User.first_name, User.last_name)
+    ])
+
+
+def fetch_user_directory(viewer_id, prefix=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of user cards ordered by username and the next page's cursor.
+    With a `prefix`, only users whose username, first or last name starts
+    with it, case insensitively, found by user_prefix_statement.
+    """
+    viewer_is_following = exists().where(
+        and_(follows.c.follower_id == viewer_id, follows.c.following_id == User.id)
+    ).label('viewer_is_following')
+    query = _select(UserRow, User).add_columns(viewer_is_following)
+    if prefix:
+        query = query.where(User.id.in_(user_prefix_statement(prefix.lower())))
+
+    rows, next_cursor = keyset_paginate(
+        query, User.username, User.id, cursor=cursor, limit=limit, parse=str, descending=False
+    )
+    cards = [
+        {**serialize_user(UserRow._make(row[:-1])), 'viewer_is_following': bool(row[-1])}
+        for row in rows
+    ]
+    return cards, next_cursor
+
+
+def fetch_follow_page(user_id, direction, viewer_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of user cards for the accounts following `user_id`
+    (direction='followers') or followed by it (direction='following'),
+    newest account first, and the next page's cursor. Each page is a range
+    scan on ix_follows_following_id or the follows primary key, so it costs
+    the same for an account with ten followers or ten million.
+    """
+    # Aliased so the viewer's EXISTS below correlates with the listed edge
+    # instead of scanning the same table reference
+    edge = follows.alias('edge')
+    if direction == 'followers':
+        owner, other = edge.c.following_id, edge.c.follower_id
+    else:
+        owner, other = edge.c.follower_id, edge.c.following_id
+    viewer_is_following = exists().where(
+        and_(follows.c.follower_id == viewer_id, follows.c.following_id == other)
+    ).label('viewer_is_following')
+    query = select(*[getattr(User, field) for field in UserRow._fields], viewer_is_following) \
+        .select_from(edge) \
+        .join(User, other == User.id) \
+        .where(owner == user_id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, size=1)
+        if not isinstance(last_id, int):
+            raise InvalidCursor(cursor)
+        query = query.where(other < last_id)
+
+    rows = db.session.execute(query.order_by(other.desc()).limit(limit + 1)).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
+    cards = [
+        {**serialize_user(UserRow._make(row[:-1])), 'viewer_is_following': bool(row[-1])}
+        for row in rows[:limit]
+    ]
+    return cards, next_cursor
+
+
+def serialize_image(image):
+    return {
+        'id': image.id,
+        'url': image.url,
+        'key': image.key,
+        'user_id': image.user_id,
+        'status': image.status,
+        'width': image.width,
+        'height': image.height,
+        'placeholder': image.placeholder,
+        # Narrowest first, so clients can take the first one wide enough
+        'variants': [
+            {name: variant[name] for name in ('url', 'width', 'height', 'content_type')}
+            for variant in image.variants or []
+        ]
+    }
+
+
+def _comment_fragments(comments):
+    images = fetch_images(Image.comment_id, [comment.id for comment in comments])
+    return [
+        {
+            'id': comment.id,
+            'content': comment.content,
+            'user_id': comment.user_id,
+            'tweet_id': comment.tweet_id,
+            'created_at': comment.created_at,
+            'comment_images': [serialize_image(image) for image in images.get(comment.id, [])]
+        }
+        for comment in comments
+    ]
+
+
+def _attach_users(comment_fragments, users):
+    return [
+        {**comment, 'user': serialize_user(users.get(comment['user_id']))}
+        for comment in comment_fragments
+    ]
+
+
+def serialize_comments(comments):
+    """
+    Serializes CommentRows with their images and authors
+    """
+    users = fetch_users({comment.user_id for comment in comments})
+    return _attach_users(_comment_fragments(comments), users)
+
+
+def build_tweet_fragments(tweet_ids, comments=None):
+    """
+    Maps tweet id -> the parts of its payload that are the same for every
+    viewer. Authors are left out so profile changes never go stale in the
+    tweet cache. `comments` maps tweet id -> CommentRows to embed and
+    defaults to the newest COMMENT_PREVIEW_LIMIT of each tweet.
+    """
+    tweets = fetch_tweets(tweet_ids)
+    tweet_ids = [tweet_id for tweet_id in tweet_ids if tweet_id in tweets]
+    if comments is None:
+        comments = fetch_comment_previews(tweet_ids)
+    images = fetch_images(Image.tweet_id, tweet_ids)
+
+    all_comments = [comment for tweet_id in tweet_ids for comment in comments.get(tweet_id, [])]
+    comment_fragments = iter(_comment_fragments(all_comments))
+
+    fragments = {}
+    for tweet_id in tweet_ids:
+        tweet = tweets[tweet_id]
+        fragments[tweet_id] = {
+            'id': tweet.id,
+            'content': tweet.content,
+            'user_id': tweet.user_id,
+            'created_at': tweet.created_at,
+            'like_count': tweet.like_count,
+            'comment_count': tweet.comment_count,
+            'image_count': tweet.image_count,
+            'tweet_images': [serialize_image(image) for image in images.get(tweet_id, [])],
+            'tweet_comments': [next(comment_fragments) for _ in comments.get(tweet_id, [])]
+        }
+    return fragments
+
+
+def serialize_tweets(tweet_ids, viewer_id, comments=None, use_cache=True):
+    """
+    Builds feed payloads for `tweet_ids`, keeping their order and skipping
+    ids that no longer exist. Feed fragments come from the tweet cache and
+    only the misses are read from the database; payloads with a custom
+    `comments` selection bypass the cache.
+    """
+    if comments is None and use_cache:
+        fragments = tweet_cache.get_many(fetch_tweet_versions(tweet_ids), build_tweet_fragments)
+    else:
+        fragments = build_tweet_fragments(tweet_ids, comments)
+    tweet_ids = [tweet_id for tweet_id in tweet_ids if tweet_id in fragments]
+
+    users = fetch_users(
+        {fragments[tweet_id]['user_id'] for tweet_id in tweet_ids}
+        | {comment['user_id'] for tweet_id in tweet_ids for comment in fragments[tweet_id]['tweet_comments']}
+    )
+    viewer_likes = fetch_viewer_likes(viewer_id, tweet_ids)
+
+    return [
+        {
+            **fragments[tweet_id],
+            'viewer_has_liked': tweet_id in viewer_likes,
+            'viewer_like_id': viewer_likes.get(tweet_id),
+            'user': serialize_user(users.get(fragments[tweet_id]['user_id'])),
+            'tweet_comments': _attach_users(fragments[tweet_id]['tweet_comments'], users)
+        }
+        for tweet_id in tweet_ids
+    ]
+
+
+def serialize_tweet_detail(tweet_id, viewer_id):
+    """
+    A single tweet with the first page of its replies, or None if it doesn't
+    exist
+    """
+    page, next_cursor = fetch_comment_page(tweet_id)
+    payloads = serialize_tweets([tweet_id], viewer_id, comments={tweet_id: page})
+    if not payloads:
+        return None
+    payloads[0]['comments_next_cursor'] = next_cursor
+    return payloads[0]
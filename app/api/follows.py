@@ -0,0 +1,51 @@
+from sqlalchemy import delete, exists, literal, select
+
+from app.models import db, User
+from app.models.user import follows
+from .counters import adjust_user_counters
+from .likes import INSERT_BY_DIALECT
+
+
+def is_following(follower_id, following_id):
+    """
+    Whether `follower_id` follows `following_id`, as one primary key lookup
+    """
+    return db.session.execute(
+        select(exists().where(follows.c.follower_id == follower_id, follows.c.following_id == following_id))
+    ).scalar()
+
+
+def add_follow(follower_id, following_id):
+    """
+    Adds the follow edge unless it exists and returns whether it was added.
+    The insert skips a duplicate edge through the primary key, so concurrent
+    requests can't both count it.
+    """
+    insert = INSERT_BY_DIALECT[db.engine.dialect.name]
+    result = db.session.execute(
+        insert(follows)
+        .from_select(
+            ['follower_id', 'following_id'],
+            select(literal(follower_id), User.id).where(User.id == following_id)
+        )
+        .on_conflict_do_nothing(index_elements=['follower_id', 'following_id'])
+    )
+    if not result.rowcount:
+        return False
+    adjust_user_counters(following_id, follower_count=1)
+    adjust_user_counters(follower_id, following_count=1)
+    return True
+
+
+def remove_follow(follower_id, following_id):
+    """
+    Removes the follow edge if it exists and returns whether it did
+    """
+    result = db.session.execute(
+        delete(follows).where(follows.c.follower_id == follower_id, follows.c.following_id == following_id)
+    )
+    if not result.rowcount:
+        return False
+    adjust_user_counters(following_id, follower_count=-1)
+    adjust_user_counters(follower_id, following_count=-1)
+    return True
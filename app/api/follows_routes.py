@@ -3,6 +3,10 @@ from flask import Blueprint, jsonify, session, request
 from flask_login import login_required, current_user
 from app.models import db, User
 from .auth_routes import validation_errors_to_error_messages
+from .feed_queries import serialize_profile
+from .follows import add_follow, remove_follow
+from .suggestions import suggestion_engine
+from .timelines import rebuild_timeline
 
 follows_routes = Blueprint('follows', __name__)
 
@@ -17,10 +21,11 @@ def follow_user(id):
         if user.id == current_user.id:
           return {'message': 'Cannot follow yourself'}, 400
 
-        if current_user not in user.followers:
-            user.followers.append(current_user)
+        if add_follow(current_user.id, user.id):
+            rebuild_timeline(current_user.id)
             db.session.commit()
-            return {'user': user.to_dict()}
+            suggestion_engine.follow(current_user.id, user.id)
+            return {'user': serialize_profile(user.id, current_user.id)}
         else:
           return {"message": "You already follow this user"}
     else:
@@ -37,10 +42,11 @@ def unfollow_user(id):
       if user.id == current_user.id:
           return {'message': 'Cannot unfollow yourself'}, 400
 
-      if current_user in user.followers:
-        user.followers.remove(current_user)
+      if remove_follow(current_user.id, user.id):
+        rebuild_timeline(current_user.id)
         db.session.commit()
-        return {'user': user.to_dict()}
+        suggestion_engine.unfollow(current_user.id, user.id)
+        return {'user': serialize_profile(user.id, current_user.id)}
       else:
           return {'message': 'You were not following this user'}, 400
     else:
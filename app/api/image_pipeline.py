@@ -0,0 +1,357 @@
+import atexit
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+from PIL import Image as PILImage, ImageOps
+from sqlalchemy import select, update
+
+from app.models import db, Comment, Image
+from .counters import bump_tweet_version
+from .metrics import Counters, register_metrics
+from .storage import storage
+from .tweet_cache import tweet_cache
+
+# Every upload is rendered as a WebP at each of these widths narrower than
+# itself, plus one at full size
+IMAGE_VARIANT_WIDTHS = tuple(
+    int(width) for width in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',')
+)
+# Size of the process pool the images are decoded and resized in. 0 renders
+# inline on the uploading request's thread, e.g. for tests.
+IMAGE_PIPELINE_WORKERS = int(os.environ.get('IMAGE_PIPELINE_WORKERS', 1))
+WEBP_QUALITY = 80
+ORIGINAL_QUALITY = 90
+
+logger = logging.getLogger(__name__)
+
+_BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def _base83(value, length):
+    return ''.join(_BASE83[value // 83 ** (length - i) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(srgb):
+    value = srgb / 255
+    return np.where(value <= 0.04045, value / 12.92, ((value + 0.055) / 1.055) ** 2.4)
+
+
+def _to_srgb(linear):
+    value = min(max(linear, 0.0), 1.0)
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def blurhash(pixels, x_components=4, y_components=3):
+    """
+    BlurHash (https://blurha.sh) of an (height, width, 3) array of sRGB
+    pixels: a ~30 character string clients decode into a blurred preview to
+    show while the image loads. Pass a small thumbnail, the cost is per pixel.
+    """
+    height, width = pixels.shape[:2]
+    linear = _to_linear(pixels[:, :, :3].astype(np.float64))
+    basis_x = np.cos(np.pi * np.outer(np.arange(x_components), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(y_components), np.arange(height)) / height)
+    # factors[j, i] is the weight of the cosine with i horizontal and j
+    # vertical half periods, per channel
+    factors = np.einsum('jy,ix,yxc->jic', basis_y, basis_x, linear) / (width * height)
+    factors[1:, :] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)
+    dc, ac = factors[0], factors[1:]
+
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if len(ac):
+        quantised_maximum = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_maximum + 1) / 166
+        result += _base83(quantised_maximum, 1)
+    else:
+        maximum = 1
+        result += _base83(0, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    scaled = np.sign(ac) * np.abs(ac / maximum) ** 0.5
+    quantised = np.clip(np.floor(scaled * 9 + 9.5), 0, 18).astype(int)
+    for r, g, b in quantised.tolist():
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _placeholder(image):
+    thumbnail = image.convert('RGB')
+    thumbnail.thumbnail((32, 32))
+    x_components, y_components = (4, 3) if image.width >= image.height else (3, 4)
+    return blurhash(np.asarray(thumbnail), x_components, y_components)
+
+
+def _encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def _has_metadata(source):
+    return bool(source.getexif()) or 'exif' in source.info or 'xmp' in source.info
+
+
+def strip_metadata(data):
+    """
+    Returns an upload re-encoded without its EXIF and XMP metadata, which can
+    hold the camera's GPS position, or `data` itself if it carries none.
+    Runs before the upload is first stored, so the metadata is never served.
+    Raises OSError or ValueError if the image can't be decoded.
+    """
+    with PILImage.open(io.BytesIO(data)) as source:
+        source_format = source.format
+        if not _has_metadata(source):
+            return data
+        # The color profile isn't personal and dropping it shifts colors
+        icc_profile = source.info.get('icc_profile')
+        if getattr(source, 'is_animated', False):
+            return _encode(source, source_format, save_all=True, icc_profile=icc_profile)
+        # Bakes the EXIF orientation into the pixels, as it goes with the rest
+        image = ImageOps.exif_transpose(source)
+
+    if source_format == 'JPEG':
+        return _encode(image.convert('RGB') if image.mode not in ('RGB', 'L') else image, 'JPEG',
+                       quality=ORIGINAL_QUALITY, optimize=True, icc_profile=icc_profile)
+    if source_format == 'WEBP':
+        return _encode(image, 'WEBP', quality=ORIGINAL_QUALITY, icc_profile=icc_profile)
+    return _encode(image, source_format, icc_profile=icc_profile)
+
+
+def render_derivatives(data, widths=IMAGE_VARIANT_WIDTHS):
+    """
+    Decodes an uploaded image and returns its displayed width and height,
+    placeholder and WebP variants. Pure CPU work on bytes, so it can run in
+    a worker process.
+    """
+    with PILImage.open(io.BytesIO(data)) as source:
+        source_format = source.format
+        if getattr(source, 'is_animated', False):
+            # Resizing would keep only the first frame, so animations are
+            # served as uploaded
+            return {
+                'width': source.width,
+                'height': source.height,
+                'placeholder': _placeholder(source),
+                'variants': []
+            }
+        icc_profile = source.info.get('icc_profile')
+        # Applies the EXIF orientation, so the dimensions are the ones shown
+        image = ImageOps.exif_transpose(source)
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    base = image.convert('RGBA' if has_alpha else 'RGB')
+    variants = []
+    for width in sorted(set(widths)) + [image.width]:
+        if width > image.width or (variants and width == variants[-1]['width']):
+            continue
+        if width == image.width and source_format == 'WEBP':
+            # The original already is one
+            continue
+        height = max(1, round(image.height * width / image.width))
+        resized = base if width == image.width else base.resize((width, height), PILImage.LANCZOS)
+        variants.append({
+            'width': width,
+            'height': height,
+            'data': _encode(resized, 'WEBP', quality=WEBP_QUALITY, method=4, icc_profile=icc_profile)
+        })
+    return {
+        'width': image.width,
+        'height': image.height,
+        'placeholder': _placeholder(image),
+        'variants': variants
+    }
+
+
+def _tweet_id_of(image_id):
+    """
+    The tweet whose payload includes the image, directly or through a comment
+    """
+    tweet_id, comment_id = db.session.execute(
+        select(Image.tweet_id, Image.comment_id).where(Image.id == image_id)
+    ).one()
+    if tweet_id is None and comment_id is not None:
+        tweet_id = db.session.execute(select(Comment.tweet_id).where(Comment.id == comment_id)).scalar()
+    return tweet_id
+
+
+def store_derivatives(image_id, key, rendered):
+    """
+    Uploads what render_derivatives produced next to the original and
+    records it on the image row. Returns False if the image was deleted in
+    the meantime, in which case the uploads are removed again. The original
+    itself is left as stored, as its key is the digest of its content.
+    """
+    stem = key.rsplit('.', 1)[0]
+    variants = []
+    for variant in rendered['variants']:
+        variant_key = f"{stem}_{variant['width']}w.webp"
+        storage.put(variant_key, variant['data'], 'image/webp')
+        variants.append({
+            'key': variant_key,
+            'url': storage.url(variant_key),
+            'width': variant['width'],
+            'height': variant['height'],
+            'content_type': 'image/webp'
+        })
+
+    recorded = _record(image_id, {
+        'width': rendered['width'],
+        'height': rendered['height'],
+        'placeholder': rendered['placeholder'],
+        'variants': variants
+    })
+    if not recorded:
+        for variant in variants:
+            storage.delete(variant['key'])
+    return recorded
+
+
+def copy_derivatives(image_id, key):
+    """
+    Records the derivatives already rendered for another image of the same
+    stored object, as uploads are deduplicated by content. Returns False if
+    there are none yet, or the image was deleted.
+    """
+    # Served by ix_images_key
+    rendered = db.session.execute(
+        select(Image.width, Image.height, Image.placeholder, Image.variants)
+        .where(Image.key == key, Image.id != image_id, Image.placeholder.isnot(None))
+        .limit(1)
+    ).first()
+    return rendered is not None and _record(image_id, dict(rendered._mapping))
+
+
+def _record(image_id, values):
+    updated = db.session.execute(
+        update(Image).where(Image.id == image_id).values(**values, created_at=Image.created_at)
+    ).rowcount
+    if not updated:
+        db.session.rollback()
+        return False
+    tweet_id = _tweet_id_of(image_id)
+    bump_tweet_version(tweet_id)
+    db.session.commit()
+    tweet_cache.invalidate(tweet_id)
+    return True
+
+
+class ImagePipeline:
+    """
+    Renders the derivatives of uploaded images off the request thread.
+    Decoding and resizing run in a pool of `workers` processes, so they
+    don't hold the GIL the request threads need; reading the upload and
+    storing the results run on as many threads in this process. Images are
+    served as uploaded until their derivatives are recorded.
+    """
+
+    def __init__(self, workers=IMAGE_PIPELINE_WORKERS):
+        self.workers = workers
+        self.app = None
+        self._lock = Lock()
+        self._processes = None
+        self._threads = None
+        self._counters = Counters(
+            'queued', 'processed', 'reused', 'failed', 'variants', 'render_microseconds', 'stripped'
+        )
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.close)
+
+    def submit(self, image_id, data=None):
+        """
+        Queues an image for processing. `data` is its original bytes if the
+        caller has them; otherwise they're read back from storage.
+        """
+        self._counters.incr('queued')
+        if not self.workers:
+            self._process(image_id, data, render_derivatives)
+            return
+        with self._lock:
+            self._start_pools()
+            # Queued jobs keep their pool, which close() drains before
+            # shutting it down
+            self._threads.submit(self._process_in_app, self._processes, image_id, data)
+
+    def strip(self, data):
+        """
+        Returns an upload without its metadata, see strip_metadata. Only the
+        header is read on the calling thread: uploads that carry metadata are
+        re-encoded in the worker processes, and the caller waits for them, so
+        request threads don't decode photos while holding the GIL.
+        """
+        with PILImage.open(io.BytesIO(data)) as source:
+            if not _has_metadata(source):
+                return data
+        if not self.workers:
+            return strip_metadata(data)
+        with self._lock:
+            self._start_pools()
+            stripped = self._processes.submit(strip_metadata, data)
+        self._counters.incr('stripped')
+        return stripped.result()
+
+    def _start_pools(self):
+        # Called with self._lock held
+        if self._processes is None:
+            # Created from a request thread, so the workers are spawned: a
+            # fork would copy whatever locks other threads hold
+            self._processes = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self._threads = ThreadPoolExecutor(self.workers, thread_name_prefix='image-pipeline')
+
+    def _process_in_app(self, processes, image_id, data):
+        with self.app.app_context():
+            try:
+                self._process(image_id, data, lambda data: processes.submit(render_derivatives, data).result())
+            finally:
+                db.session.remove()
+
+    def _process(self, image_id, data, render):
+        try:
+            key = db.session.execute(select(Image.key).where(Image.id == image_id)).scalar()
+            if key is None:
+                return
+            if copy_derivatives(image_id, key):
+                self._counters.incr('reused')
+                return
+            if data is None:
+                data = storage.read(key)
+            started = time.perf_counter()
+            rendered = render(data)
+            self._counters.incr('render_microseconds', int((time.perf_counter() - started) * 1e6))
+            if store_derivatives(image_id, key, rendered):
+                self._counters.incr('processed')
+                self._counters.incr('variants', len(rendered['variants']))
+        except Exception:
+            # The image still works without derivatives, so this is logged
+            # rather than surfaced
+            db.session.rollback()
+            logger.exception("Rendering derivatives of image %s failed", image_id)
+            self._counters.incr('failed')
+
+    def close(self):
+        with self._lock:
+            threads, processes = self._threads, self._processes
+            self._threads = self._processes = None
+        if threads is not None:
+            threads.shutdown(wait=True)
+            processes.shutdown(wait=True)
+
+    def stats(self):
+        stats = self._counters.snapshot()
+        stats['workers'] = self.workers
+        return stats
+
+
+image_pipeline = ImagePipeline()
+
+register_metrics('image_pipeline', image_pipeline.stats)
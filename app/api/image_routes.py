@@ -1,14 +1,20 @@
-from flask import Blueprint, request
-from app.models import db, Image, User
+from flask import Blueprint, request, send_from_directory
+from app.models import db, Image, IMAGE_READY
 from flask_login import current_user, login_required
-from .s3_image_upload import (
-    upload_file_to_s3,
-    get_unique_filename,
-    validate_image_file,
+from .blobs import release_images
+from .counters import adjust_tweet_counters, bump_tweet_version
+from .deletions import deletion_queue
+from .tweet_cache import tweet_cache
+from .storage import LocalStorage, storage
+from .uploads import (
+    UploadError,
+    attach_image,
+    create_pending_image,
+    finalize_upload,
+    read_image_file,
+    store_image_files,
 )
-
-import boto3
-import os
+from .image_pipeline import image_pipeline
 
 image_routes = Blueprint("images", __name__)
 
@@ -24,23 +30,11 @@ def upload_image():
     form_type = request.form.get('type')
     user_id = request.form.get('user_id')
 
-    is_valid, validation_result = validate_image_file(image)
-    if not is_valid:
-        return {"errors": validation_result}, 400
-
-    sanitized_name = validation_result
-
-    image.filename = get_unique_filename(sanitized_name)
-
-    upload = upload_file_to_s3(image)
-
-    if "url" not in upload:
-        # if the dictionary doesn't have a url key
-        # it means that there was an error when we tried to upload
-        # so we send back that error message
-        return upload, 400
+    try:
+        upload = read_image_file(image)
+    except UploadError as error:
+        return {"errors": error.message}, error.status
 
-    url = upload["url"]
     # flask_login allows us to get the current user from the request
     if user_id:
         try:
@@ -57,47 +51,41 @@ def upload_image():
         tweet_id = int(request.form.get('tweet_id'))
       except (TypeError, ValueError):
         return {"errors": "tweet id required"}, 400
-      new_image = Image(user_id=user_id_int, url=url, type=form_type, tweet_id=tweet_id, key=image.filename)
-      db.session.add(new_image)
-      db.session.commit()
-      return {"url": url}
-    if form_type == 'comment':
+      new_image = Image(user_id=user_id_int, type=form_type, tweet_id=tweet_id)
+    elif form_type == 'comment':
       try:
         comment_id = int(request.form.get('comment_id'))
       except (TypeError, ValueError):
         return {"errors": "comment id required"}, 400
-      new_image = Image(user_id=user_id_int, url=url, type=form_type, comment_id=comment_id, key=image.filename)
-      db.session.add(new_image)
-      db.session.commit()
-      return {"url": url}
-    if form_type == 'user':
-      new_image = Image(user_id=user_id_int, url=url, type=form_type, key=image.filename)
-      db.session.add(new_image)
-      # Update user's profile_image field
-      user = User.query.get(user_id_int)
-      if user:
-        user.profile_image = url
-      db.session.commit()
-      return {"url": url}
-
-    return {"errors": "invalid form type"}, 400
+      new_image = Image(user_id=user_id_int, type=form_type, comment_id=comment_id)
+    elif form_type == 'user':
+      # attach_image also points the user's profile_image at it
+      new_image = Image(user_id=user_id_int, type=form_type)
+    else:
+      return {"errors": "invalid form type"}, 400
+
+    # Identical content is stored once, so a repost of an image already
+    # stored skips the upload
+    try:
+        key, = store_image_files([upload])
+    except UploadError as error:
+        return {"errors": error.message}, error.status
+
+    new_image.key = key
+    new_image.url = storage.url(key)
+    db.session.add(new_image)
+    db.session.flush()
+    tweet_id = attach_image(new_image)
+    db.session.commit()
+    tweet_cache.invalidate(tweet_id)
+    image_pipeline.submit(new_image.id, upload.data)
+    return {"url": new_image.url}
 
 
 @image_routes.route("/", methods=["DELETE"])
 @image_routes.route("", methods=["DELETE"])
 @login_required
 def delete_image_from_bucket():
-  key = request.form.get('key')
-  bucket_name = os.environ.get("S3_BUCKET")
-  s3_recource=boto3.client(
-    's3',
-    aws_access_key_id=os.environ.get("S3_KEY"),
-    aws_secret_access_key=os.environ.get("S3_SECRET")
-  )
-  s3_recource.delete_object(
-    Bucket=bucket_name,
-    Key=key
-  )
   id = request.form.get('id')
   image = Image.query.get(id)
   if image is not None:
@@ -105,7 +93,99 @@ def delete_image_from_bucket():
         if image_dict['user_id'] != int(current_user.get_id()):
             return {'errors': 'You are unauthorized to delete this tweet'}, 403
         else:
+            tweet_id = image.tweet_id
+            if tweet_id is None and image.comment:
+                tweet_id = image.comment.tweet_id
             db.session.delete(image)
+            db.session.flush()
+            if image.status != IMAGE_READY:
+                # A pending image was never counted or shown
+                tweet_id = None
+            elif image.tweet_id is not None:
+                adjust_tweet_counters(image.tweet_id, image_count=-1)
+            else:
+                bump_tweet_version(tweet_id)
+            # Other images may share the object, which is only deleted,
+            # in the background, with its last reference
+            released = release_images([image])
             db.session.commit()
+            deletion_queue.put(released)
+            tweet_cache.invalidate(tweet_id)
             return {"message": "item successfully deleted from s3 bucket"}
   return {"error": "Image not found"}
+
+
+@image_routes.route("/uploads/", methods=["POST"])
+@image_routes.route("/uploads", methods=["POST"])
+@login_required
+def create_upload():
+    """
+    Starts a direct upload: records a pending image and returns a presigned
+    POST for the browser to send the file straight to storage, so the file
+    never passes through an API worker. Takes the image's type, tweet_id or
+    comment_id, filename, content_type and size in bytes.
+    """
+    data = request.get_json(silent=True) or request.form
+    image_type = data.get('type')
+    try:
+        owner_id = int(data[f'{image_type}_id']) if image_type in ('tweet', 'comment') else None
+        size = int(data.get('size'))
+    except (KeyError, TypeError, ValueError):
+        return {"errors": f"{image_type} id and size required"}, 400
+    try:
+        image, upload = create_pending_image(
+            current_user.id, image_type, owner_id, data.get('filename'), data.get('content_type'), size
+        )
+    except UploadError as error:
+        db.session.rollback()
+        return {"errors": error.message}, error.status
+    db.session.commit()
+    return {"image": image.to_dict(), "upload": upload}
+
+
+@image_routes.route("/uploads/<int:id>/complete/", methods=["POST"])
+@image_routes.route("/uploads/<int:id>/complete", methods=["POST"])
+@login_required
+def complete_upload(id):
+    """
+    Called once the browser's upload finished. The stored object is checked
+    before the image goes live.
+    """
+    image = Image.query.get(id)
+    if image is None:
+        return {"errors": "Image not found"}, 404
+    if image.user_id != current_user.id:
+        return {"errors": "You are unauthorized to complete this upload"}, 403
+    result = finalize_upload(image)
+    if result == 'missing':
+        return {"errors": "Upload not received yet"}, 409
+    if result == 'invalid':
+        return {"errors": "file content not recognized as an image"}, 400
+    return image.to_dict()
+
+
+# The LocalStorage stand-in for S3. Uploads are authorized by the signed
+# token in their form, like a presigned S3 POST, not by the session.
+@image_routes.route("/local", methods=["POST"])
+def receive_local_upload():
+    if not isinstance(storage, LocalStorage):
+        return {"errors": "Not found"}, 404
+    upload = storage.verify_upload(request.form.get('token', ''))
+    if upload is None or upload['key'] != request.form.get('key'):
+        return {"errors": "Invalid or expired upload token"}, 403
+    file = request.files.get('file')
+    if file is None:
+        return {"errors": "file required"}, 400
+    if request.form.get('Content-Type') != upload['content_type']:
+        return {"errors": "mimetype not permitted"}, 400
+    if request.content_length and request.content_length > upload['max_size'] + 64 * 1024:
+        return {"errors": "file too large"}, 413
+    storage.save(upload['key'], file.stream)
+    return "", 204
+
+
+@image_routes.route("/local/<key>", methods=["GET"])
+def serve_local_upload(key):
+    if not isinstance(storage, LocalStorage):
+        return {"errors": "Not found"}, 404
+    return send_from_directory(storage.root, key)
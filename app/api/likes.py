@@ -0,0 +1,334 @@
+import atexit
+import logging
+import os
+import time
+from threading import Event, Lock, Thread
+
+from sqlalchemy import delete, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import db, Like, Tweet, User
+from .counters import adjust_tweet_counters
+from .metrics import Counters, register_metrics
+from .tweet_cache import tweet_cache
+
+logger = logging.getLogger(__name__)
+
+likes = Like.__table__
+
+# insert() constructs that support on_conflict_do_nothing(), by dialect name
+INSERT_BY_DIALECT = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+# Set LIKE_WRITE_BUFFER=1 to queue like and unlike intents in memory and
+# write them in batches instead of committing one transaction per click
+LIKE_WRITE_BUFFER = os.environ.get('LIKE_WRITE_BUFFER', '').lower() in ('1', 'true', 'yes')
+LIKE_FLUSH_INTERVAL_MS = int(os.environ.get('LIKE_FLUSH_INTERVAL_MS', 5))
+LIKE_FLUSH_BATCH_SIZE = int(os.environ.get('LIKE_FLUSH_BATCH_SIZE', 500))
+# A failed flush is retried after LIKE_FLUSH_RETRY_MS, doubling on each
+# failure in a row, up to LIKE_FLUSH_MAX_RETRIES times
+LIKE_FLUSH_RETRY_MS = int(os.environ.get('LIKE_FLUSH_RETRY_MS', 100))
+LIKE_FLUSH_MAX_RETRIES = int(os.environ.get('LIKE_FLUSH_MAX_RETRIES', 8))
+
+
+def insert_likes(tweet_id, user_ids):
+    """
+    Adds likes from `user_ids` to a tweet in one statement and returns how
+    many were new. Duplicates are skipped through the unique
+    (user_id, tweet_id) index rather than raising, and nothing is inserted
+    if the tweet doesn't exist.
+    """
+    insert = INSERT_BY_DIALECT[db.engine.dialect.name]
+    tweet_exists = select(Tweet.id).where(Tweet.id == tweet_id).exists()
+    result = db.session.execute(
+        insert(likes)
+        .from_select(
+            ['user_id', 'tweet_id'],
+            select(User.id, literal(tweet_id)).where(User.id.in_(user_ids), tweet_exists)
+        )
+        .on_conflict_do_nothing(index_elements=['user_id', 'tweet_id'])
+    )
+    return result.rowcount
+
+
+def delete_likes(tweet_id, user_ids):
+    """
+    Removes likes from `user_ids` on a tweet and returns how many existed
+    """
+    result = db.session.execute(
+        delete(likes).where(likes.c.tweet_id == tweet_id, likes.c.user_id.in_(user_ids))
+    )
+    return result.rowcount
+
+
+def add_like(user_id, tweet_id):
+    """
+    Likes a tweet unless the user already has. Returns True if a like was
+    added, False if it already existed, and None if the tweet doesn't exist.
+
+    Two concurrent requests can't both insert, and neither sees an
+    IntegrityError; only the one whose row landed moves the counter.
+    """
+    if insert_likes(tweet_id, [user_id]):
+        adjust_tweet_counters(tweet_id, like_count=1)
+        return True
+    if db.session.execute(select(Tweet.id).where(Tweet.id == tweet_id)).scalar() is None:
+        return None
+    return False
+
+
+def remove_like(user_id, tweet_id):
+    """
+    Removes the user's like from a tweet if there is one. Returns whether a
+    like was removed; the row count of the delete tells concurrent requests
+    apart, so the counter is only decremented once.
+    """
+    if delete_likes(tweet_id, [user_id]):
+        adjust_tweet_counters(tweet_id, like_count=-1)
+        return True
+    return False
+
+
+def write_like_batch(intents):
+    """
+    Applies {(user_id, tweet_id): liked} in one transaction with one insert
+    and one delete per tweet, and one counter update per tweet whose likes
+    changed. Returns the ids of those tweets.
+    """
+    by_tweet = {}
+    for (user_id, tweet_id), liked in intents.items():
+        likers, unlikers = by_tweet.setdefault(tweet_id, ([], []))
+        (likers if liked else unlikers).append(user_id)
+
+    changed = []
+    for tweet_id, (likers, unlikers) in by_tweet.items():
+        added = insert_likes(tweet_id, likers) if likers else 0
+        removed = delete_likes(tweet_id, unlikers) if unlikers else 0
+        if added or removed:
+            adjust_tweet_counters(tweet_id, like_count=added - removed)
+            changed.append(tweet_id)
+    db.session.commit()
+    return changed
+
+
+class LikeWriteBuffer:
+    """
+    Write-behind buffer for like and unlike intents.
+
+    A viral tweet takes thousands of likes a second, and committing each one
+    serializes them all on the same tweet row. The buffer keeps the latest
+    intent per (user, tweet), so repeated clicks collapse into one write, and
+    a background thread hands everything pending to `write` every
+    `interval_ms` milliseconds, or as soon as `batch_size` intents are queued.
+
+    Reads go through pending() so the acting user sees their own intent
+    before it's flushed. Like the tweet cache this is per process: another
+    gunicorn worker sees the like once it has been flushed. close() flushes
+    what's left and runs at interpreter exit, so graceful shutdowns don't lose
+    intents; a killed process loses at most the last interval's worth.
+
+    A batch that fails to write is retried with exponential backoff. After
+    `max_retries` failures in a row it's written one intent at a time, and
+    the intents that still fail on their own are dropped, so one bad intent
+    can't hold up the rest forever.
+    """
+
+    def __init__(self, write, interval_ms=LIKE_FLUSH_INTERVAL_MS, batch_size=LIKE_FLUSH_BATCH_SIZE,
+                 enabled=LIKE_WRITE_BUFFER, retry_ms=LIKE_FLUSH_RETRY_MS, max_retries=LIKE_FLUSH_MAX_RETRIES):
+        self.write = write
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.enabled = enabled
+        self.retry_delay = retry_ms / 1000
+        self.max_retries = max_retries
+        self.app = None
+        self._lock = Lock()
+        # Serializes flushes so a batch is never written twice
+        self._flush_lock = Lock()
+        self._pending = {}
+        # The batch being written right now, still visible to readers
+        self._flushing = {}
+        self._wake = Event()
+        self._stopped = Event()
+        self._thread = None
+        # Failed flushes in a row, and when the next one may run
+        self._failures = 0
+        self._retry_at = 0
+        self._counters = Counters('queued', 'coalesced', 'flushes', 'flushed', 'failed_flushes', 'dropped')
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.close)
+
+    def put(self, user_id, tweet_id, liked):
+        with self._lock:
+            key = (user_id, tweet_id)
+            if key in self._pending:
+                self._counters.incr('coalesced')
+            self._pending[key] = liked
+            full = len(self._pending) >= self.batch_size
+            if self._thread is None:
+                self._start()
+        self._counters.incr('queued')
+        if full:
+            self._wake.set()
+
+    def pending(self, user_id, tweet_ids):
+        """
+        Maps tweet id -> liked for the intents of `user_id` that haven't been
+        committed yet
+        """
+        with self._lock:
+            if not self._pending and not self._flushing:
+                return {}
+            found = {}
+            for tweet_id in tweet_ids:
+                key = (user_id, tweet_id)
+                if key in self._pending:
+                    found[tweet_id] = self._pending[key]
+                elif key in self._flushing:
+                    found[tweet_id] = self._flushing[key]
+            return found
+
+    def flush(self):
+        """
+        Writes everything pending and returns how many intents that was
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending or time.monotonic() < self._retry_at:
+                    return 0
+                self._flushing, self._pending = self._pending, {}
+            batch = self._flushing
+            if self._failures >= self.max_retries:
+                return self._flush_one_by_one(batch)
+            try:
+                changed = self._write(batch)
+            except Exception:
+                self._failures += 1
+                delay = self.retry_delay * 2 ** (self._failures - 1)
+                self._retry_at = time.monotonic() + delay
+                # The retries would log the same traceback over and over
+                logger.error("Flushing %d like intents failed, retry %d of %d in %.2fs",
+                             len(batch), self._failures, self.max_retries, delay, exc_info=self._failures == 1)
+                self._counters.incr('failed_flushes')
+                # Put the batch back behind anything queued since, so the
+                # next flush retries it without undoing newer intents
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                    self._flushing = {}
+                return 0
+            self._flushed(len(batch), changed)
+            return len(batch)
+
+    def _flush_one_by_one(self, batch):
+        # Isolates the intents that keep the batch from committing
+        changed = []
+        dropped = 0
+        for (user_id, tweet_id), liked in batch.items():
+            try:
+                changed.extend(self._write({(user_id, tweet_id): liked}))
+            except Exception:
+                logger.exception("Dropping the %s of tweet %d by user %d",
+                                 'like' if liked else 'unlike', tweet_id, user_id)
+                dropped += 1
+        self._counters.incr('dropped', dropped)
+        self._flushed(len(batch) - dropped, changed)
+        return len(batch) - dropped
+
+    def _write(self, batch):
+        with self.app.app_context():
+            try:
+                return self.write(batch)
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                db.session.remove()
+
+    def _flushed(self, written, changed):
+        self._failures = 0
+        self._retry_at = 0
+        for tweet_id in changed:
+            tweet_cache.invalidate(tweet_id)
+        with self._lock:
+            self._flushing = {}
+        self._counters.incr('flushes')
+        self._counters.incr('flushed', written)
+
+    def close(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.app is not None:
+            # Last chance, so it doesn't wait out a backoff
+            self._retry_at = 0
+            self.flush()
+
+    def _start(self):
+        self._thread = Thread(target=self._run, name='like-write-buffer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stats(self):
+        stats = self._counters.snapshot()
+        with self._lock:
+            stats['pending'] = len(self._pending) + len(self._flushing)
+        stats['enabled'] = self.enabled
+        return stats
+
+
+like_buffer = LikeWriteBuffer(write_like_batch)
+
+register_metrics('like_buffer', like_buffer.stats)
+
+
+def set_like(user_id, tweet_id, liked):
+    """
+    Records that the user likes, or no longer likes, a tweet and returns the
+    resulting like_state(), or None if the tweet doesn't exist. Commits
+    straight away unless the write buffer is enabled.
+    """
+    if like_buffer.enabled:
+        if db.session.execute(select(Tweet.id).where(Tweet.id == tweet_id)).scalar() is None:
+            return None
+        like_buffer.put(user_id, tweet_id, liked)
+    else:
+        changed = add_like(user_id, tweet_id) if liked else remove_like(user_id, tweet_id)
+        db.session.commit()
+        if changed:
+            tweet_cache.invalidate(tweet_id)
+    return like_state(user_id, tweet_id)
+
+
+def like_state(user_id, tweet_id):
+    """
+    The payload the like endpoints return: whether the user likes the tweet
+    and its current like count, or None if the tweet doesn't exist. An intent
+    still in the write buffer wins over the table, and the count includes it.
+    """
+    like_count = db.session.execute(select(Tweet.like_count).where(Tweet.id == tweet_id)).scalar()
+    if like_count is None:
+        return None
+    like_id = db.session.execute(
+        select(likes.c.id).where(likes.c.user_id == user_id, likes.c.tweet_id == tweet_id)
+    ).scalar()
+    liked = like_id is not None
+    pending = like_buffer.pending(user_id, [tweet_id]).get(tweet_id)
+    if pending is not None and pending != liked:
+        like_count += 1 if pending else -1
+        liked = pending
+    return {
+        'tweet_id': tweet_id,
+        'viewer_has_liked': liked,
+        'viewer_like_id': like_id if liked else None,
+        'like_count': like_count
+    }
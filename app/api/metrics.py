@@ -0,0 +1,38 @@
+from threading import Lock
+
+from flask import Blueprint
+from flask_login import login_required
+
+metrics_routes = Blueprint('metrics', __name__)
+
+# name -> zero argument callable returning a JSON serializable dict
+_providers = {}
+
+
+class Counters:
+    """
+    Thread safe bag of named counters for in-process instrumentation
+    """
+
+    def __init__(self, *names):
+        self._lock = Lock()
+        self._values = {name: 0 for name in names}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+def register_metrics(name, provider):
+    _providers[name] = provider
+
+
+@metrics_routes.route('/')
+@metrics_routes.route('')
+@login_required
+def get_metrics():
+    return {name: provider() for name, provider in _providers.items()}
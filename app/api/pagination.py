@@ -0,0 +1,110 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import DateTime, String, and_, or_, type_coerce
+from sqlalchemy.sql import Select
+
+from app.models import db
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_page_size(args, default=DEFAULT_PAGE_SIZE):
+    """
+    Reads `per_page` from the query string and clamps it to a sane range
+    """
+    per_page = args.get('per_page', default, type=int)
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+def encode_cursor(*values):
+    """
+    Packs the sort key of the last row on a page into an opaque, url safe token
+    """
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, size=2):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def keyset_condition(sort_column, id_column, cursor, dialect_name, parse=datetime.fromisoformat,
+                     descending=True):
+    """
+    Builds the "strictly after the cursor" predicate for a page ordered by
+    (sort_column, id_column), descending unless `descending` is False
+    """
+    sort_value, last_id = decode_cursor(cursor)
+    try:
+        parsed_value = parse(sort_value)
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+    sort_key = sort_column
+    if isinstance(sort_column.type, DateTime) and dialect_name == 'sqlite':
+        # SQLite keeps datetimes as text and rows written by the server
+        # default have no fractional seconds, so compare against the text
+        # the row was stored as instead of a re-rendered datetime
+        sort_key = type_coerce(sort_column, String)
+        parsed_value = sort_value.replace('T', ' ')
+
+    if not descending:
+        return or_(
+            sort_key > parsed_value,
+            and_(sort_key == parsed_value, id_column > last_id)
+        )
+    return or_(
+        sort_key < parsed_value,
+        and_(sort_key == parsed_value, id_column < last_id)
+    )
+
+
+def keyset_paginate(query, sort_column, id_column, cursor=None, limit=DEFAULT_PAGE_SIZE,
+                    parse=datetime.fromisoformat, descending=True):
+    """
+    Returns one page of `query` ordered by (sort_column, id_column),
+    descending unless `descending` is False.
+
+    Rows are located with a range predicate on the sort key rather than an
+    OFFSET, so every page costs the same no matter how deep the client has
+    scrolled, and no COUNT(*) is issued. Fetches one extra row to find out
+    whether another page exists.
+    """
+    # Accepts an ORM Query or a Core select(), which is run on db.session
+    is_core = isinstance(query, Select)
+    if cursor:
+        dialect_name = db.engine.dialect.name
+        condition = keyset_condition(sort_column, id_column, cursor, dialect_name, parse, descending)
+        query = query.where(condition) if is_core else query.filter(condition)
+
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    query = query.limit(limit + 1)
+    rows = db.session.execute(query).all() if is_core else query.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,188 @@
+from sqlalchemy import exists, func, select, text
+
+from app.models import db, Tweet, Comment, Like, Image, ImageBlob, IMAGE_PENDING, TimelineEntry, TweetHashtag, TweetMention
+from app.models.user import follows
+from .feed_queries import user_prefix_statement
+from .search import search_statement
+
+# The hot read paths and the indexes their plans are expected to use. Each
+# statement has the same shape as the one the routes run, with literal ids.
+# `flask indexes check` runs EXPLAIN on every one of them against the
+# configured database and fails if a plan doesn't use one of its indexes.
+# SQLite names the index behind a composite primary key
+# sqlite_autoindex_<table>_<n>, Postgres <table>_pkey.
+FOLLOWS_PRIMARY_KEY = ('follows_pkey', 'sqlite_autoindex_follows_1')
+
+HOT_QUERIES = [
+    (
+        'home timeline page',
+        lambda: select(TimelineEntry.created_at, TimelineEntry.tweet_id)
+        .where(TimelineEntry.user_id == 1)
+        .order_by(TimelineEntry.created_at.desc(), TimelineEntry.tweet_id.desc())
+        .limit(21),
+        ('ix_timeline_entries_user_id_created_at',)
+    ),
+    (
+        'pulled tweets page',
+        lambda: select(Tweet.created_at, Tweet.id)
+        .where(Tweet.user_id == 1, Tweet.pulled.is_(True))
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .limit(21),
+        ('ix_tweets_pulled_user_id_created_at',)
+    ),
+    (
+        'followed pulled accounts',
+        lambda: select(follows.c.following_id).where(
+            follows.c.follower_id == 1,
+            exists().where(Tweet.user_id == follows.c.following_id).where(Tweet.pulled.is_(True))
+        ),
+        ('ix_tweets_pulled_user_id_created_at',)
+    ),
+    (
+        'user tweets page',
+        lambda: select(Tweet.created_at, Tweet.id)
+        .where(Tweet.user_id == 1)
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .limit(21),
+        ('ix_tweets_user_id_created_at',)
+    ),
+    (
+        'tweet comments page',
+        lambda: select(Comment.id)
+        .where(Comment.tweet_id == 1)
+        .order_by(Comment.created_at.desc(), Comment.id.desc())
+        .limit(21),
+        ('ix_comments_tweet_id_created_at',)
+    ),
+    (
+        'user comments page',
+        lambda: select(Comment.id)
+        .where(Comment.user_id == 1)
+        .order_by(Comment.created_at.desc(), Comment.id.desc())
+        .limit(21),
+        ('ix_comments_user_id_created_at',)
+    ),
+    (
+        'viewer likes',
+        lambda: select(Like.tweet_id, Like.id).where(Like.user_id == 1, Like.tweet_id.in_([1, 2, 3])),
+        ('uq_likes_user_id_tweet_id',)
+    ),
+    (
+        'viewer replies',
+        lambda: select(Comment.tweet_id).distinct().where(Comment.user_id == 1, Comment.tweet_id.in_([1, 2, 3])),
+        ('ix_comments_tweet_id_created_at', 'ix_comments_user_id_created_at')
+    ),
+    (
+        'likes of a tweet',
+        lambda: select(func.count(Like.id)).where(Like.tweet_id == 1),
+        ('ix_likes_tweet_id',)
+    ),
+    (
+        'tweet images',
+        lambda: select(Image.id).where(Image.tweet_id.in_([1, 2, 3])),
+        ('ix_images_tweet_id',)
+    ),
+    (
+        'comment images',
+        lambda: select(Image.id).where(Image.comment_id.in_([1, 2, 3])),
+        ('ix_images_comment_id',)
+    ),
+    (
+        'profile banner',
+        lambda: select(Image.url).where(Image.user_id == 1, Image.type == 'user_header'),
+        ('ix_images_user_id_type',)
+    ),
+    (
+        'pending uploads',
+        lambda: select(Image.id)
+        .where(Image.status == IMAGE_PENDING, Image.created_at < '2026-01-01')
+        .order_by(Image.created_at),
+        ('ix_images_status_created_at',)
+    ),
+    (
+        'image blob by digest',
+        lambda: select(ImageBlob.key, ImageBlob.ref_count).where(ImageBlob.digest == 'f' * 64),
+        ('ix_image_blobs_digest',)
+    ),
+    (
+        'images by key',
+        lambda: select(exists().where(Image.key == 'cat.png')),
+        ('ix_images_key',)
+    ),
+    (
+        'follow check',
+        lambda: select(exists().where(follows.c.follower_id == 1).where(follows.c.following_id == 2)),
+        FOLLOWS_PRIMARY_KEY
+    ),
+    (
+        'following list',
+        lambda: select(follows.c.following_id).where(follows.c.follower_id == 1),
+        FOLLOWS_PRIMARY_KEY
+    ),
+    (
+        'viewer following',
+        lambda: select(follows.c.following_id).where(follows.c.follower_id == 1, follows.c.following_id.in_([2, 3])),
+        FOLLOWS_PRIMARY_KEY
+    ),
+    (
+        'followers list',
+        lambda: select(follows.c.follower_id).where(follows.c.following_id == 1),
+        ('ix_follows_following_id',)
+    ),
+    (
+        'tagged tweets page',
+        lambda: select(TweetHashtag.created_at, TweetHashtag.tweet_id)
+        .where(TweetHashtag.tag == 'litter')
+        .order_by(TweetHashtag.created_at.desc(), TweetHashtag.tweet_id.desc())
+        .limit(21),
+        ('ix_tweet_hashtags_tag_created_at',)
+    ),
+    (
+        'mentions page',
+        lambda: select(TweetMention.created_at, TweetMention.tweet_id)
+        .where(TweetMention.user_id == 1)
+        .order_by(TweetMention.created_at.desc(), TweetMention.tweet_id.desc())
+        .limit(21),
+        ('ix_tweet_mentions_user_id_created_at',)
+    ),
+    (
+        'user directory prefix',
+        lambda: user_prefix_statement('ab'),
+        ('ix_users_lower_username', 'ix_users_lower_first_name', 'ix_users_lower_last_name')
+    ),
+    (
+        'tweet search',
+        lambda: search_statement('tweets', ['litter']),
+        ('ix_tweets_content_search', 'tweets_fts')
+    ),
+]
+
+
+def explain(statement):
+    """
+    The query plan the configured database picks for `statement`, as text
+    """
+    dialect = db.engine.dialect
+    sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'postgresql':
+        # Empty or tiny tables are cheapest to scan, which says nothing about
+        # the plan at production size. Ask for the best non sequential plan.
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        rows = db.session.execute(text(f'EXPLAIN {sql}'))
+        return '\n'.join(row[0] for row in rows)
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def check_query_plans():
+    """
+    Returns (name, expected indexes, plan, ok) for every hot query
+    """
+    results = []
+    try:
+        for name, build, indexes in HOT_QUERIES:
+            plan = explain(build())
+            results.append((name, indexes, plan, any(index in plan for index in indexes)))
+    finally:
+        db.session.rollback()
+    return results
@@ -47,6 +47,15 @@ def get_unique_filename(filename: str) -> str:
     return f"{unique_filename}.{ext}"
 
 
+def get_content_filename(filename: str, digest: str) -> str:
+    """
+    Storage key for content with this sha256 digest, so identical uploads
+    share one object
+    """
+    ext = filename.rsplit(".", 1)[1].lower()
+    return f"{digest}.{ext}"
+
+
 def validate_image_file(file):
     if not file or not file.filename:
         return False, "image required"
@@ -0,0 +1,166 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import DDL, column, delete, func, insert, literal_column, select, table
+
+from app.models import db, Tweet, Comment, User
+from app.models.search import (
+    COMMENT_DOCUMENT,
+    POSTGRES_INDEXES,
+    SQLITE_FTS_TABLES,
+    TWEET_DOCUMENT,
+    USER_DOCUMENT,
+)
+from .pagination import DEFAULT_PAGE_SIZE, keyset_paginate
+
+# Full-text search over tweets, comments and users. Postgres answers from
+# the GIN expression indexes declared in app/models/search.py and keeps them
+# current itself. On SQLite the write routes call the index_* and unindex_*
+# helpers below, in the same transaction as the write, to keep the FTS5
+# tables in step; on Postgres those helpers do nothing.
+
+SEARCH_TYPES = ('tweets', 'comments', 'users')
+SEARCH_SORTS = ('relevance', 'recent')
+# Longer queries are cut to this many words
+MAX_SEARCH_TERMS = 16
+
+_WORD = re.compile(r'\w+')
+
+tweets_fts = table('tweets_fts', column('rowid'), column('content'))
+comments_fts = table('comments_fts', column('rowid'), column('content'))
+users_fts = table('users_fts', column('rowid'), column('username'), column('first_name'), column('last_name'))
+
+# type -> (model, Postgres text search config, indexed document, FTS5 table)
+_TARGETS = {
+    'tweets': (Tweet, 'english', TWEET_DOCUMENT, tweets_fts),
+    'comments': (Comment, 'english', COMMENT_DOCUMENT, comments_fts),
+    'users': (User, 'simple', USER_DOCUMENT, users_fts),
+}
+
+
+def search_terms(q):
+    """
+    The words of a user supplied query. Everything else is dropped, so the
+    terms are safe to hand to either engine's query parser.
+    """
+    return _WORD.findall(q or '')[:MAX_SEARCH_TERMS]
+
+
+def _is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _replace(fts, rowid, **values):
+    db.session.execute(delete(fts).where(fts.c.rowid == rowid))
+    db.session.execute(insert(fts).values(rowid=rowid, **values))
+
+
+def index_tweet(tweet_id, content):
+    if _is_sqlite():
+        _replace(tweets_fts, tweet_id, content=content)
+
+
+def index_comment(comment_id, content):
+    if _is_sqlite():
+        _replace(comments_fts, comment_id, content=content)
+
+
+def index_user(user):
+    if _is_sqlite():
+        _replace(users_fts, user.id, username=user.username, first_name=user.first_name,
+                 last_name=user.last_name)
+
+
+def unindex_comment(comment_id):
+    if _is_sqlite():
+        db.session.execute(delete(comments_fts).where(comments_fts.c.rowid == comment_id))
+
+
+def unindex_tweet(tweet_id):
+    """
+    Drops a tweet and its comments, which are deleted along with it
+    """
+    if _is_sqlite():
+        db.session.execute(delete(tweets_fts).where(tweets_fts.c.rowid == tweet_id))
+        db.session.execute(delete(comments_fts).where(
+            comments_fts.c.rowid.in_(select(Comment.id).where(Comment.tweet_id == tweet_id))
+        ))
+
+
+def reindex():
+    """
+    Rebuilds every search index from its table and returns how many rows
+    each one covers. Creates the FTS5 tables or GIN indexes if missing.
+    """
+    if _is_sqlite():
+        for _, name, columns in SQLITE_FTS_TABLES:
+            db.session.execute(DDL(f'CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({columns})'))
+        for fts, rows in (
+            (tweets_fts, select(Tweet.id, Tweet.content)),
+            (comments_fts, select(Comment.id, Comment.content)),
+            (users_fts, select(User.id, User.username, User.first_name, User.last_name)),
+        ):
+            db.session.execute(delete(fts))
+            db.session.execute(insert(fts).from_select([c.name for c in fts.columns], rows))
+    else:
+        for source_table, name, document in POSTGRES_INDEXES:
+            db.session.execute(DDL(
+                f'CREATE INDEX IF NOT EXISTS {name} ON {source_table.name} USING gin ({document})'
+            ))
+            db.session.execute(DDL(f'REINDEX INDEX {name}'))
+    db.session.commit()
+    return {
+        search_type: db.session.execute(select(func.count()).select_from(model)).scalar()
+        for search_type, (model, _, _, _) in _TARGETS.items()
+    }
+
+
+def search_statement(search_type, terms):
+    """
+    SELECT id, rank, sort_key for the rows matching every term, where a
+    higher rank is a better match and sort_key orders by recency. Users have
+    no creation date, so theirs is the id.
+    """
+    model, config, document, fts_table = _TARGETS[search_type]
+    sort_key = model.id if search_type == 'users' else model.created_at
+    if _is_sqlite():
+        # FTS5 functions and MATCH take the table itself as their argument
+        fts = literal_column(fts_table.name)
+        match = ' '.join(f'"{term}"' for term in terms)
+        return select(
+            model.id.label('id'),
+            # bm25() is lower for better matches
+            (-func.bm25(fts)).label('rank'),
+            sort_key.label('sort_key')
+        ).select_from(fts_table) \
+            .join(model, model.id == fts_table.c.rowid) \
+            .where(fts.op('MATCH')(match))
+
+    query = func.plainto_tsquery(config, ' '.join(terms))
+    vector = literal_column(document)
+    return select(
+        model.id.label('id'),
+        func.ts_rank_cd(vector, query).label('rank'),
+        sort_key.label('sort_key')
+    ).where(vector.op('@@')(query))
+
+
+def search_page(search_type, terms, sort='relevance', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of the ids of the rows matching `terms`, best match (BM25 on
+    SQLite, ts_rank_cd on Postgres) or newest first, and the next page's
+    cursor
+    """
+    # The ranked matches are wrapped in a subquery so the cursor predicate
+    # can compare against the rank like any other column
+    matches = search_statement(search_type, terms).subquery('matches')
+    if sort == 'recent':
+        sort_column = matches.c.sort_key
+        parse = int if search_type == 'users' else datetime.fromisoformat
+    else:
+        sort_column, parse = matches.c.rank, float
+    rows, next_cursor = keyset_paginate(
+        select(matches.c.id, matches.c.rank, matches.c.sort_key),
+        sort_column, matches.c.id, cursor=cursor, limit=limit, parse=parse
+    )
+    return [row.id for row in rows], next_cursor
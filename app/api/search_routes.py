@@ -0,0 +1,73 @@
+from flask import Blueprint, request
+from flask_login import login_required, current_user
+from app.models import db, Comment
+from .feed_queries import (
+    CommentRow,
+    fetch_users,
+    fetch_viewer_following,
+    select_comments,
+    serialize_comments,
+    serialize_tweets,
+    serialize_user,
+)
+from .pagination import InvalidCursor, get_page_size
+from .search import SEARCH_SORTS, SEARCH_TYPES, search_page, search_terms
+
+search_routes = Blueprint('search', __name__)
+
+
+def _serialize_comments(comment_ids):
+    rows = db.session.execute(select_comments().where(Comment.id.in_(comment_ids)))
+    by_id = {row.id: CommentRow._make(row) for row in rows}
+    return serialize_comments([by_id[id] for id in comment_ids if id in by_id])
+
+
+def _serialize_users(user_ids, viewer_id):
+    users = fetch_users(user_ids)
+    following = fetch_viewer_following(viewer_id, user_ids)
+    return [
+        {**serialize_user(users[id]), 'viewer_is_following': id in following}
+        for id in user_ids
+        if id in users
+    ]
+
+
+@search_routes.route('/')
+@search_routes.route('')
+@login_required
+def search():
+    """
+    Full-text search. ?q= is matched against tweets, comments or users
+    (?type=, tweets by default) and results come best match first, or
+    newest first with ?sort=recent, one cursor page at a time.
+    """
+    terms = search_terms(request.args.get('q'))
+    if not terms:
+        return {'errors': 'q must contain at least one word'}, 400
+    search_type = request.args.get('type', 'tweets')
+    if search_type not in SEARCH_TYPES:
+        return {'errors': f"type must be one of {', '.join(SEARCH_TYPES)}"}, 400
+    sort = request.args.get('sort', 'relevance')
+    if sort not in SEARCH_SORTS:
+        return {'errors': f"sort must be one of {', '.join(SEARCH_SORTS)}"}, 400
+
+    per_page = get_page_size(request.args)
+    try:
+        ids, next_cursor = search_page(
+            search_type, terms, sort=sort, cursor=request.args.get('cursor'), limit=per_page
+        )
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    if search_type == 'tweets':
+        results = serialize_tweets(ids, current_user.id)
+    elif search_type == 'comments':
+        results = _serialize_comments(ids)
+    else:
+        results = _serialize_users(ids, current_user.id)
+    return {
+        search_type: results,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
@@ -0,0 +1,187 @@
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.utils import secure_filename
+
+from .s3_image_upload import BUCKET_NAME, S3_LOCATION, s3
+
+# Where presigned uploads go: 's3', or 'local' to keep them on this machine's
+# disk and accept them through /api/images/local, so the whole direct upload
+# flow runs offline in development and tests
+IMAGE_STORAGE = os.environ.get('IMAGE_STORAGE', 's3')
+LOCAL_STORAGE_DIR = os.environ.get('LOCAL_STORAGE_DIR')
+
+
+class S3Storage:
+    """
+    The S3 bucket the synchronous upload route writes to
+    """
+
+    def presign_upload(self, key, content_type, max_size, expires):
+        """
+        A presigned POST the browser can send the file to directly. S3 itself
+        rejects anything over `max_size` bytes or of another content type.
+        """
+        post = s3.generate_presigned_post(
+            BUCKET_NAME,
+            key,
+            Fields={'Content-Type': content_type},
+            Conditions=[{'Content-Type': content_type}, ['content-length-range', 1, max_size]],
+            ExpiresIn=expires
+        )
+        return {'method': 'POST', 'url': post['url'], 'fields': post['fields']}
+
+    def head(self, key):
+        """
+        {'size', 'content_type'} of a stored object, or None if it doesn't exist
+        """
+        try:
+            head = s3.head_object(Bucket=BUCKET_NAME, Key=key)
+        except ClientError as error:
+            if error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'size': head['ContentLength'], 'content_type': head.get('ContentType')}
+
+    def read_prefix(self, key, length):
+        return s3.get_object(Bucket=BUCKET_NAME, Key=key, Range=f'bytes=0-{length - 1}')['Body'].read()
+
+    def read(self, key):
+        return s3.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+
+    def put(self, key, data, content_type):
+        s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data, ContentType=content_type)
+
+    def url(self, key):
+        return f'{S3_LOCATION}{key}'
+
+    def delete(self, key):
+        s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+
+    def delete_many(self, keys):
+        """
+        Deletes up to 1000 objects in one DeleteObjects call and returns the
+        keys that couldn't be deleted
+        """
+        response = s3.delete_objects(
+            Bucket=BUCKET_NAME,
+            Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+        )
+        return [error['Key'] for error in response.get('Errors', [])]
+
+    def list(self, start_after='', limit=1000):
+        """
+        Up to `limit` {'key', 'size', 'last_modified'} of the stored objects,
+        in key order, starting after `start_after`
+        """
+        response = s3.list_objects_v2(Bucket=BUCKET_NAME, StartAfter=start_after, MaxKeys=limit)
+        return [
+            {'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified']}
+            for item in response.get('Contents', [])
+        ]
+
+
+class LocalStorage:
+    """
+    Stand-in for S3 that keeps objects under a local directory. Its presigned
+    uploads are form POSTs to /api/images/local carrying a token signed with
+    the app's secret key, the same shape as an S3 presigned POST.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+
+    @property
+    def root(self):
+        root = self._root or os.path.join(current_app.instance_path, 'uploads')
+        os.makedirs(root, exist_ok=True)
+        return root
+
+    def _serializer(self):
+        return URLSafeSerializer(current_app.secret_key, salt='local-image-upload')
+
+    def _path(self, key):
+        # Keys are generated server side, but never trust one for a path
+        if not key or secure_filename(key) != key:
+            raise ValueError(f'invalid key {key!r}')
+        return os.path.join(self.root, key)
+
+    def presign_upload(self, key, content_type, max_size, expires):
+        token = self._serializer().dumps({
+            'key': key,
+            'content_type': content_type,
+            'max_size': max_size,
+            'expires_at': time.time() + expires
+        })
+        return {
+            'method': 'POST',
+            'url': '/api/images/local',
+            'fields': {'key': key, 'Content-Type': content_type, 'token': token}
+        }
+
+    def verify_upload(self, token):
+        """
+        The upload a token was issued for, or None if it is forged or expired
+        """
+        try:
+            upload = self._serializer().loads(token)
+        except BadSignature:
+            return None
+        return upload if upload['expires_at'] > time.time() else None
+
+    def save(self, key, stream):
+        with open(self._path(key), 'wb') as file:
+            shutil.copyfileobj(stream, file)
+
+    def head(self, key):
+        try:
+            size = os.path.getsize(self._path(key))
+        except OSError:
+            return None
+        return {'size': size, 'content_type': None}
+
+    def read_prefix(self, key, length):
+        with open(self._path(key), 'rb') as file:
+            return file.read(length)
+
+    def read(self, key):
+        with open(self._path(key), 'rb') as file:
+            return file.read()
+
+    def put(self, key, data, content_type):
+        with open(self._path(key), 'wb') as file:
+            file.write(data)
+
+    def url(self, key):
+        return f'/api/images/local/{key}'
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+        return []
+
+    def list(self, start_after='', limit=1000):
+        keys = sorted(key for key in os.listdir(self.root) if key > start_after)[:limit]
+        objects = []
+        for key in keys:
+            stat = os.stat(self._path(key))
+            objects.append({
+                'key': key,
+                'size': stat.st_size,
+                'last_modified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+            })
+        return objects
+
+
+storage = LocalStorage(LOCAL_STORAGE_DIR) if IMAGE_STORAGE == 'local' else S3Storage()
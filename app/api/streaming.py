@@ -0,0 +1,21 @@
+from flask import Response, json, stream_with_context
+
+# Rows are pulled from the database in chunks of this size when exporting
+EXPORT_BATCH_SIZE = 500
+
+
+def wants_ndjson(args):
+    return args.get('format') == 'ndjson'
+
+
+def ndjson_response(payloads):
+    """
+    Streams an iterable of JSON serializable dicts as newline delimited JSON.
+    The request context stays open until the last line is sent, so the
+    iterable can keep reading from db.session while the response streams.
+    """
+    def generate():
+        for payload in payloads:
+            yield json.dumps(payload) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
@@ -0,0 +1,283 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock, Thread
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models import db
+from app.models.user import follows
+from .metrics import Counters, register_metrics
+
+# How many suggestions are ranked and cached per user; requests ask for a prefix
+SUGGESTIONS_MAX = int(os.environ.get('SUGGESTIONS_MAX', 50))
+SUGGESTIONS_CACHE_SIZE = int(os.environ.get('SUGGESTIONS_CACHE_SIZE', 10000))
+SUGGESTIONS_CACHE_SECONDS = int(os.environ.get('SUGGESTIONS_CACHE_SECONDS', 300))
+# The graph is reloaded from the follows table this often, in the background,
+# to pick up follows made through other worker processes
+FOLLOW_GRAPH_REFRESH_SECONDS = int(os.environ.get('FOLLOW_GRAPH_REFRESH_SECONDS', 600))
+# Only this many of each followed account's own follows count towards
+# suggestions, so following an account that follows everyone stays cheap
+FOLLOW_GRAPH_MAX_FANOUT = int(os.environ.get('FOLLOW_GRAPH_MAX_FANOUT', 2000))
+FOLLOW_GRAPH_LOAD_BATCH = 100000
+
+ID_DTYPE = np.int32
+
+
+class FollowGraph:
+    """
+    Immutable snapshot of the follow graph in CSR form: the accounts user u
+    follows are targets[offsets[u]:offsets[u + 1]], sorted, and indexed by
+    user id directly. `in_degree` holds follower counts for ranking.
+    """
+
+    def __init__(self, offsets, targets, in_degree):
+        self.offsets = offsets
+        self.targets = targets
+        self.in_degree = in_degree
+        # Most followed accounts first, for users with nothing to go on yet
+        popular = np.argsort(-in_degree, kind='stable')[:SUGGESTIONS_MAX * 2]
+        self.popular = popular[in_degree[popular] > 0].astype(ID_DTYPE)
+
+    @classmethod
+    def from_edges(cls, followers, followings):
+        size = int(max(followers.max(initial=0), followings.max(initial=0))) + 1
+        order = np.lexsort((followings, followers))
+        targets = followings[order].astype(ID_DTYPE)
+        offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(followers, minlength=size), out=offsets[1:])
+        in_degree = np.bincount(followings, minlength=size).astype(ID_DTYPE)
+        return cls(offsets, targets, in_degree)
+
+    @classmethod
+    def load(cls, batch_size=FOLLOW_GRAPH_LOAD_BATCH):
+        """
+        Reads every follow edge into arrays, `batch_size` rows at a time.
+        Goes through the DBAPI cursor because building a SQLAlchemy Row per
+        edge is ten times slower than the fetch itself; on Postgres the
+        cursor is a named, server side one so the result isn't buffered.
+        """
+        statement = select(follows.c.follower_id, follows.c.following_id)
+        sql = str(statement.compile(dialect=db.engine.dialect))
+        connection = db.session.connection().connection
+        if db.engine.dialect.name == 'postgresql':
+            cursor = connection.cursor('follow_graph')
+        else:
+            cursor = connection.cursor()
+        chunks = []
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchmany(batch_size)
+            while rows:
+                chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 2))
+                rows = cursor.fetchmany(batch_size)
+        finally:
+            cursor.close()
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        return cls.from_edges(edges[:, 0], edges[:, 1])
+
+    @property
+    def size(self):
+        return len(self.offsets) - 1
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    def row(self, user_id):
+        if user_id >= self.size:
+            return self.targets[:0]
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def gather(self, user_ids, fanout):
+        """
+        The concatenated rows of `user_ids`, each cut at `fanout` entries,
+        without a Python level loop
+        """
+        user_ids = user_ids[user_ids < self.size]
+        starts = self.offsets[user_ids]
+        lengths = np.minimum(self.offsets[user_ids + 1] - starts, fanout)
+        if not lengths.sum():
+            return self.targets[:0]
+        # Position of every wanted entry: each row's start, repeated once per
+        # entry, plus the entry's offset within its row
+        row_starts = np.repeat(starts, lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return self.targets[row_starts + within]
+
+
+class SuggestionEngine:
+    """
+    "Who to follow" ranked by friends of friends: accounts followed by the
+    accounts a user follows, ordered by how many of those follow them, then
+    by follower count.
+
+    Follows and unfollows made through this process are applied straight
+    away as an overlay on the loaded snapshot, and the snapshot is rebuilt
+    from the database every FOLLOW_GRAPH_REFRESH_SECONDS. Like the tweet
+    cache the graph is per process.
+    """
+
+    def __init__(self, max_fanout=FOLLOW_GRAPH_MAX_FANOUT, refresh_seconds=FOLLOW_GRAPH_REFRESH_SECONDS,
+                 cache_size=SUGGESTIONS_CACHE_SIZE, cache_seconds=SUGGESTIONS_CACHE_SECONDS):
+        self.max_fanout = max_fanout
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = cache_size
+        self.cache_seconds = cache_seconds
+        self._lock = Lock()
+        self._graph = None
+        self._loaded_at = 0
+        self._refreshing = False
+        # follower id -> {following id: True for a follow, False for an
+        # unfollow}. The inner dicts are replaced, never mutated, so readers
+        # can work off a shallow copy.
+        self._overlay = {}
+        # Overlay edges recorded while a reload is running, replayed onto it
+        self._replay = None
+        self._cache = OrderedDict()
+        self._counters = Counters('cache_hits', 'cache_misses', 'loads', 'events')
+        self._load_seconds = 0.0
+
+    def follow(self, follower_id, following_id):
+        self._record(follower_id, following_id, True)
+
+    def unfollow(self, follower_id, following_id):
+        self._record(follower_id, following_id, False)
+
+    def _record(self, follower_id, following_id, followed):
+        with self._lock:
+            self._overlay[follower_id] = {**self._overlay.get(follower_id, {}), following_id: followed}
+            if self._replay is not None:
+                self._replay.append((follower_id, following_id, followed))
+            self._cache.pop(follower_id, None)
+        self._counters.incr('events')
+
+    def suggest(self, user_id, limit=SUGGESTIONS_MAX):
+        """
+        Up to `limit` (user id, mutual count) pairs for `user_id`
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(user_id)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(user_id)
+                self._counters.incr('cache_hits')
+                return cached[1][:limit]
+        self._counters.incr('cache_misses')
+
+        graph, overlay = self._snapshot()
+        suggestions = self._rank(graph, overlay, user_id)
+        with self._lock:
+            self._cache[user_id] = (now + self.cache_seconds, suggestions)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return suggestions[:limit]
+
+    def _snapshot(self):
+        """
+        The current graph and a copy of its overlay, loading the graph on
+        first use and starting a background reload once it's stale
+        """
+        with self._lock:
+            graph = self._graph
+            stale = time.monotonic() - self._loaded_at > self.refresh_seconds
+            if graph is not None and stale and not self._refreshing:
+                self._refreshing = True
+                Thread(target=self._reload, args=(db.get_app(),), daemon=True).start()
+        if graph is None:
+            self.reload()
+        with self._lock:
+            return self._graph, dict(self._overlay)
+
+    def reload(self):
+        """
+        Rebuilds the graph from the follows table. Overlay edges recorded
+        while it loads are replayed on top; the rest are in the new snapshot.
+        """
+        with self._lock:
+            self._replay = []
+        started = time.perf_counter()
+        try:
+            graph = FollowGraph.load()
+        except Exception:
+            with self._lock:
+                self._replay = None
+                self._refreshing = False
+            raise
+        with self._lock:
+            overlay = {}
+            for follower_id, following_id, followed in self._replay:
+                overlay.setdefault(follower_id, {})[following_id] = followed
+            self._graph = graph
+            self._overlay = overlay
+            self._replay = None
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+            self._cache.clear()
+        self._load_seconds = time.perf_counter() - started
+        self._counters.incr('loads')
+        return graph
+
+    def _reload(self, app):
+        with app.app_context():
+            try:
+                self.reload()
+            finally:
+                db.session.remove()
+
+    def following(self, graph, overlay, user_id):
+        """
+        Sorted ids `user_id` follows: the snapshot's row with the overlay applied
+        """
+        row = graph.row(user_id)
+        edges = overlay.get(user_id)
+        if not edges:
+            return row
+        added = np.fromiter((id for id, followed in edges.items() if followed), dtype=ID_DTYPE)
+        removed = np.fromiter((id for id, followed in edges.items() if not followed), dtype=ID_DTYPE)
+        return np.setdiff1d(np.union1d(row, added), removed)
+
+    def _rank(self, graph, overlay, user_id):
+        following = self.following(graph, overlay, user_id)
+        candidates = graph.gather(following, self.max_fanout)
+
+        # Followed accounts whose own follows changed since the snapshot are
+        # corrected with their overlay rather than their stale row
+        changed = [id for id in following.tolist() if id in overlay]
+        if changed:
+            stale = graph.gather(np.array(changed, dtype=ID_DTYPE), self.max_fanout)
+            fresh = [self.following(graph, overlay, id)[:self.max_fanout] for id in changed]
+            candidates = np.concatenate([candidates, *fresh])
+            # Drop one occurrence of every stale entry by counting both sides
+            ids, counts = np.unique(candidates, return_counts=True)
+            stale_ids, stale_counts = np.unique(stale, return_counts=True)
+            counts[np.searchsorted(ids, stale_ids)] -= stale_counts
+        else:
+            ids, counts = np.unique(candidates, return_counts=True)
+
+        keep = (counts > 0) & (ids != user_id) & ~np.isin(ids, following, assume_unique=True)
+        ids, counts = ids[keep], counts[keep]
+        if not len(ids):
+            ids = graph.popular[(graph.popular != user_id) & ~np.isin(graph.popular, following)]
+            counts = np.zeros(len(ids), dtype=np.int64)
+        in_degree = np.where(ids < graph.size, graph.in_degree[np.minimum(ids, graph.size - 1)], 0)
+        order = np.lexsort((ids, -in_degree, -counts))[:SUGGESTIONS_MAX]
+        return list(zip(ids[order].tolist(), counts[order].tolist()))
+
+    def stats(self):
+        stats = self._counters.snapshot()
+        with self._lock:
+            graph = self._graph
+            stats['cache_size'] = len(self._cache)
+            stats['overlay_edges'] = sum(len(edges) for edges in self._overlay.values())
+        stats['nodes'] = graph.size if graph is not None else 0
+        stats['edges'] = graph.edge_count if graph is not None else 0
+        stats['load_seconds'] = self._load_seconds
+        return stats
+
+
+suggestion_engine = SuggestionEngine()
+
+register_metrics('suggestions', suggestion_engine.stats)
@@ -0,0 +1,260 @@
+import heapq
+import os
+import time
+
+from sqlalchemy import and_, delete, exists, func, insert, literal, or_, select, update
+
+from app.models import db, Tweet, TimelineEntry, User
+from app.models.user import follows
+from .metrics import Counters, register_metrics
+from .pagination import DEFAULT_PAGE_SIZE, encode_cursor, keyset_condition
+
+# Follower timelines are cut back to this length by `flask timelines trim`,
+# e.g. from cron, rather than on every fan-out
+TIMELINE_MAX_LENGTH = int(os.environ.get('TIMELINE_MAX_LENGTH', 800))
+TIMELINE_TRIM_SLACK = int(os.environ.get('TIMELINE_TRIM_SLACK', 50))
+# Tweets from accounts with at least this many followers are not fanned out
+# on write; they're marked pulled and merged into follower timelines at read
+# time instead
+FANOUT_FOLLOWER_THRESHOLD = int(os.environ.get('FANOUT_FOLLOWER_THRESHOLD', 10000))
+
+timeline_metrics = Counters(
+    'tweets_pushed',
+    'tweets_pulled',
+    'timeline_rows_written',
+    'merges',
+    'merge_sources',
+    'merge_rows_scanned',
+    'merge_microseconds',
+)
+
+timeline_entries = TimelineEntry.__table__
+TIMELINE_COLUMNS = ['user_id', 'tweet_id', 'author_id', 'created_at']
+
+
+def is_high_follower_account(user_id):
+    """
+    Whether `user_id` has at least FANOUT_FOLLOWER_THRESHOLD followers, read
+    from the denormalized follower count
+    """
+    count = db.session.execute(select(User.follower_count).where(User.id == user_id)).scalar()
+    return (count or 0) >= FANOUT_FOLLOWER_THRESHOLD
+
+
+def fan_out_tweet(tweet_id):
+    """
+    Pushes a tweet into its author's home timeline and, unless the author is
+    a high-follower account, into the home timeline of every follower. Tweets
+    from high-follower accounts are marked pulled, and read_home_timeline
+    merges them in instead. Either way the decision is stored with the tweet,
+    so an account crossing the threshold doesn't lose the tweets it posted on
+    the other side. The tweet must already be flushed so it can be selected
+    by id.
+    """
+    author_id = db.session.execute(select(Tweet.user_id).where(Tweet.id == tweet_id)).scalar()
+
+    to_author = select(
+        Tweet.user_id.label('user_id'),
+        Tweet.id,
+        Tweet.user_id.label('author_id'),
+        Tweet.created_at
+    ).where(Tweet.id == tweet_id)
+    result = db.session.execute(insert(timeline_entries).from_select(TIMELINE_COLUMNS, to_author))
+    rows_written = result.rowcount
+
+    if is_high_follower_account(author_id):
+        db.session.execute(
+            update(Tweet).where(Tweet.id == tweet_id).values(pulled=True, created_at=Tweet.created_at)
+        )
+        timeline_metrics.incr('tweets_pulled')
+    else:
+        to_followers = select(
+            follows.c.follower_id.label('user_id'),
+            Tweet.id,
+            Tweet.user_id.label('author_id'),
+            Tweet.created_at
+        ).join(follows, follows.c.following_id == Tweet.user_id) \
+            .where(Tweet.id == tweet_id) \
+            .distinct()
+        result = db.session.execute(insert(timeline_entries).from_select(TIMELINE_COLUMNS, to_followers))
+        rows_written += result.rowcount
+        timeline_metrics.incr('tweets_pushed')
+
+    timeline_metrics.incr('timeline_rows_written', rows_written)
+    # Only the author's own timeline is trimmed here, which is one index
+    # range; counting every follower's would cost as much as the fan-out
+    trim_timelines(timeline_entries.c.user_id == author_id)
+
+
+def trim_timelines(which_users):
+    """
+    Cuts the timelines matched by `which_users` back to the newest
+    TIMELINE_MAX_LENGTH entries. A timeline is only trimmed once it has grown
+    TIMELINE_TRIM_SLACK entries past the limit, so the delete runs once per
+    batch of new tweets instead of on every single fan-out. Returns how many
+    timelines were trimmed.
+    """
+    overflowing = select(timeline_entries.c.user_id) \
+        .where(which_users) \
+        .group_by(timeline_entries.c.user_id) \
+        .having(func.count() > TIMELINE_MAX_LENGTH + TIMELINE_TRIM_SLACK)
+
+    user_ids = db.session.execute(overflowing).scalars().all()
+    for user_id in user_ids:
+        keep = select(timeline_entries.c.tweet_id) \
+            .where(timeline_entries.c.user_id == user_id) \
+            .order_by(timeline_entries.c.created_at.desc(), timeline_entries.c.tweet_id.desc()) \
+            .limit(TIMELINE_MAX_LENGTH)
+        db.session.execute(
+            delete(timeline_entries).where(
+                timeline_entries.c.user_id == user_id,
+                timeline_entries.c.tweet_id.notin_(keep)
+            )
+        )
+    return len(user_ids)
+
+
+def trim_all_timelines(batch_size=500):
+    """
+    Trims every home timeline that outgrew TIMELINE_MAX_LENGTH, `batch_size`
+    users at a time with a commit after each batch. Returns how many were
+    trimmed.
+    """
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    trimmed = 0
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        trimmed += trim_timelines(timeline_entries.c.user_id.between(batch[0], batch[-1]))
+        db.session.commit()
+    return trimmed
+
+
+def remove_tweet_from_timelines(tweet_id):
+    db.session.execute(delete(timeline_entries).where(timeline_entries.c.tweet_id == tweet_id))
+
+
+def retime_tweet_in_timelines(tweet_id):
+    """
+    Copies a tweet's created_at onto its timeline entries, which are sorted
+    by it. Editing a tweet moves its created_at, so this is called on edit.
+    """
+    # The edit only moves created_at once the ORM flushes it
+    db.session.flush()
+    created_at = select(Tweet.created_at).where(Tweet.id == tweet_id).scalar_subquery()
+    # Served by ix_timeline_entries_tweet_id
+    db.session.execute(
+        update(timeline_entries).where(timeline_entries.c.tweet_id == tweet_id).values(created_at=created_at)
+    )
+
+
+def rebuild_timeline(user_id):
+    """
+    Recomputes one user's home timeline from scratch out of their own tweets
+    and the tweets of the accounts they follow, leaving out pulled tweets
+    since those are merged in at read time
+    """
+    db.session.execute(delete(timeline_entries).where(timeline_entries.c.user_id == user_id))
+
+    following_ids = select(follows.c.following_id).where(follows.c.follower_id == user_id)
+    newest_tweets = select(
+        literal(user_id).label('user_id'),
+        Tweet.id,
+        Tweet.user_id.label('author_id'),
+        Tweet.created_at
+    ).where(or_(
+        Tweet.user_id == user_id,
+        and_(Tweet.user_id.in_(following_ids), Tweet.pulled.is_(False))
+    )) \
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc()) \
+        .limit(TIMELINE_MAX_LENGTH)
+
+    db.session.execute(insert(timeline_entries).from_select(TIMELINE_COLUMNS, newest_tweets))
+
+
+def backfill_timelines(batch_size=500):
+    """
+    Rebuilds every user's home timeline from the existing follow edges,
+    committing every `batch_size` users
+    """
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+    for i, user_id in enumerate(user_ids, start=1):
+        rebuild_timeline(user_id)
+        if i % batch_size == 0:
+            db.session.commit()
+    db.session.commit()
+    return len(user_ids)
+
+
+def read_home_timeline(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns one page of (created_at, tweet_id) pairs for `user_id`'s home
+    timeline and the cursor for the next page.
+
+    The pushed entries and the recent pulled tweets of every followed account
+    that has any are each read as a list already sorted newest first, then
+    combined with a k-way merge. Each list only needs `limit + 1` rows, so a
+    page costs one range read per source no matter how deep it is.
+    """
+    started = time.perf_counter()
+    dialect_name = db.engine.dialect.name
+
+    pushed = db.session.query(TimelineEntry.created_at, TimelineEntry.tweet_id) \
+        .filter(TimelineEntry.user_id == user_id)
+    if cursor:
+        pushed = pushed.filter(
+            keyset_condition(TimelineEntry.created_at, TimelineEntry.tweet_id, cursor, dialect_name))
+    sources = [
+        pushed.order_by(TimelineEntry.created_at.desc(), TimelineEntry.tweet_id.desc())
+        .limit(limit + 1).all()
+    ]
+
+    # One probe of ix_tweets_pulled_user_id_created_at per followed account
+    followed_pulled_ids = db.session.execute(
+        select(follows.c.following_id).where(
+            follows.c.follower_id == user_id,
+            exists().where(Tweet.user_id == follows.c.following_id).where(Tweet.pulled.is_(True))
+        )
+    ).scalars().all()
+    for author_id in followed_pulled_ids:
+        recent = db.session.query(Tweet.created_at, Tweet.id) \
+            .filter(Tweet.user_id == author_id, Tweet.pulled.is_(True))
+        if cursor:
+            recent = recent.filter(keyset_condition(Tweet.created_at, Tweet.id, cursor, dialect_name))
+        sources.append(
+            recent.order_by(Tweet.created_at.desc(), Tweet.id.desc()).limit(limit + 1).all()
+        )
+
+    page = []
+    rows_scanned = 0
+    # A tweet is either pushed or pulled, never both, so the sources don't
+    # overlap
+    for created_at, tweet_id in heapq.merge(*sources, key=lambda row: (row[0], row[1]), reverse=True):
+        rows_scanned += 1
+        page.append((created_at, tweet_id))
+        if len(page) > limit:
+            break
+
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(*page[-1])
+
+    timeline_metrics.incr('merges')
+    timeline_metrics.incr('merge_sources', len(sources))
+    timeline_metrics.incr('merge_rows_scanned', rows_scanned)
+    timeline_metrics.incr('merge_microseconds', int((time.perf_counter() - started) * 1_000_000))
+    return page, next_cursor
+
+
+def _timeline_metrics():
+    counters = timeline_metrics.snapshot()
+    merges = counters['merges'] or 1
+    return {
+        **counters,
+        'fanout_follower_threshold': FANOUT_FOLLOWER_THRESHOLD,
+        'avg_merge_sources': counters['merge_sources'] / merges,
+        'avg_merge_microseconds': counters['merge_microseconds'] / merges,
+    }
+
+
+register_metrics('timelines', _timeline_metrics)
@@ -0,0 +1,42 @@
+from flask import Blueprint, request
+from flask_login import login_required, current_user
+from .feed_queries import fetch_tag_page, serialize_tweets
+from .pagination import InvalidCursor, get_page_size
+from .trends import TRENDS_MAX, TRENDS_WINDOW_MINUTES, trending
+
+trend_routes = Blueprint('trends', __name__)
+
+
+@trend_routes.route('/trends/')
+@trend_routes.route('/trends')
+@login_required
+def trends():
+    """
+    The most used hashtags over the last TRENDS_WINDOW_MINUTES, served from
+    the in-memory trending index
+    """
+    limit = max(1, min(request.args.get('limit', 10, type=int), TRENDS_MAX))
+    return {'trends': trending.top(limit), 'window_minutes': TRENDS_WINDOW_MINUTES}
+
+
+@trend_routes.route('/tags/<tag>/')
+@trend_routes.route('/tags/<tag>')
+@login_required
+def tagged_tweets(tag):
+    """
+    One page of the tweets tagged #tag, most recently tagged first
+    """
+    tag = tag.lstrip('#').lower()
+    per_page = get_page_size(request.args)
+    try:
+        tweet_ids, next_cursor = fetch_tag_page(tag, request.args.get('cursor'), per_page)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    return {
+        'tag': tag,
+        'tweets': serialize_tweets(tweet_ids, current_user.id),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from threading import Lock, Thread
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models import db, TweetHashtag
+from .metrics import Counters, register_metrics
+
+# Trends are the most used hashtags over this many trailing minutes
+TRENDS_WINDOW_MINUTES = int(os.environ.get('TRENDS_WINDOW_MINUTES', 60))
+# Count-min sketch dimensions. Estimates never undercount, and with 98%
+# confidence (1 - e^-depth) overcount by at most e / width, about 0.07%, of
+# the tag uses in the window.
+TRENDS_SKETCH_WIDTH = int(os.environ.get('TRENDS_SKETCH_WIDTH', 4096))
+TRENDS_SKETCH_DEPTH = int(os.environ.get('TRENDS_SKETCH_DEPTH', 4))
+# How many of the heaviest tags are kept as trend candidates
+TRENDS_CANDIDATES = int(os.environ.get('TRENDS_CANDIDATES', 1000))
+# The ranking is recomputed at most this often and reads in between are
+# served straight from it
+TRENDS_RANK_SECONDS = float(os.environ.get('TRENDS_RANK_SECONDS', 1))
+# The counts are rebuilt from tweet_hashtags this often, in the background,
+# to pick up tags written through other worker processes
+TRENDS_REFRESH_SECONDS = int(os.environ.get('TRENDS_REFRESH_SECONDS', 60))
+TRENDS_MAX = 50
+
+
+def _minute(at):
+    """
+    Minutes since the epoch of a unix timestamp or a datetime. SQLite hands
+    back naive datetimes, which are UTC.
+    """
+    if isinstance(at, datetime):
+        at = (at if at.tzinfo else at.replace(tzinfo=timezone.utc)).timestamp()
+    return int(at // 60)
+
+
+class WindowedSketch:
+    """
+    A count-min sketch over a sliding window of per-minute buckets. Each
+    bucket is a sketch of its minute's counts and `window` is the running
+    sum of the buckets still in the window: adding to the current minute
+    adds to both, and a bucket sliding out is subtracted again.
+    """
+
+    def __init__(self, window_minutes=TRENDS_WINDOW_MINUTES, width=TRENDS_SKETCH_WIDTH,
+                 depth=TRENDS_SKETCH_DEPTH):
+        self.window_minutes = window_minutes
+        self.width = width
+        self.depth = depth
+        self.rows = np.arange(depth)
+        self.window = np.zeros((depth, width), dtype=np.int32)
+        # (minute, counts), oldest first
+        self.buckets = deque()
+
+    def columns(self, key):
+        """
+        The column `key` hashes to in each row of the sketch
+        """
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8 * self.depth).digest()
+        return (np.frombuffer(digest, dtype=np.uint64) % self.width).astype(np.intp)
+
+    def advance(self, minute):
+        """
+        Slides the window forward so it ends at `minute`
+        """
+        oldest = minute - self.window_minutes + 1
+        while self.buckets and self.buckets[0][0] < oldest:
+            _, counts = self.buckets.popleft()
+            self.window -= counts
+
+    def add(self, columns, minute, count=1):
+        # Counts arrive in time order, give or take a little clock skew, so
+        # anything older than the newest bucket is counted in it
+        if not self.buckets or self.buckets[-1][0] < minute:
+            self.advance(minute)
+            self.buckets.append((minute, np.zeros_like(self.window)))
+        self.buckets[-1][1][self.rows, columns] += count
+        self.window[self.rows, columns] += count
+
+    def estimate(self, columns):
+        """
+        Window counts for a (keys, depth) array of columns: the smallest of
+        each key's cells, since collisions only ever add
+        """
+        return self.window[self.rows, columns].min(axis=1)
+
+    @property
+    def nbytes(self):
+        return self.window.nbytes * (len(self.buckets) + 1)
+
+
+class TrendIndex:
+    """
+    Trending hashtags, answered from memory. Tag uses are counted in a
+    WindowedSketch and the heaviest tags are tracked as candidates, which
+    are ranked by their sketch estimate at most every TRENDS_RANK_SECONDS.
+
+    Tags written through this process are counted as they are committed,
+    and everything is rebuilt from the window's rows of tweet_hashtags every
+    TRENDS_REFRESH_SECONDS. Like the suggestion engine the index is per
+    process.
+    """
+
+    def __init__(self, window_minutes=TRENDS_WINDOW_MINUTES, max_candidates=TRENDS_CANDIDATES,
+                 rank_seconds=TRENDS_RANK_SECONDS, refresh_seconds=TRENDS_REFRESH_SECONDS):
+        self.window_minutes = window_minutes
+        self.max_candidates = max_candidates
+        self.rank_seconds = rank_seconds
+        self.refresh_seconds = refresh_seconds
+        self._lock = Lock()
+        self._sketch = None
+        # tag -> its sketch columns
+        self._candidates = {}
+        self._ranked = []
+        self._ranked_at = float('-inf')
+        self._loaded_at = 0
+        self._refreshing = False
+        self._counters = Counters('events', 'reads', 'rankings', 'loads')
+        self._load_seconds = 0.0
+
+    def record(self, tags, at=None):
+        """
+        Counts one use of each of `tags`, at `at` (a unix timestamp) or now
+        """
+        if not tags:
+            return
+        minute = _minute(time.time() if at is None else at)
+        with self._lock:
+            # Before the first load there is nothing to add to; the load
+            # reads these from the table
+            if self._sketch is not None:
+                for tag in tags:
+                    self._add(self._sketch, self._candidates, tag, minute)
+        self._counters.incr('events', len(tags))
+
+    def _add(self, sketch, candidates, tag, minute):
+        columns = candidates.get(tag)
+        if columns is None:
+            columns = candidates[tag] = sketch.columns(tag)
+            # Let the candidates overshoot so pruning runs once per batch
+            if len(candidates) > 2 * self.max_candidates:
+                self._prune(sketch, candidates)
+        sketch.add(columns, minute)
+
+    def _prune(self, sketch, candidates):
+        """
+        Keeps the max_candidates tags with the highest estimates and returns
+        them with their estimates, heaviest first
+        """
+        if not candidates:
+            return []
+        tags = list(candidates)
+        estimates = sketch.estimate(np.stack([candidates[tag] for tag in tags])).tolist()
+        ranked = sorted(
+            ((count, tag) for count, tag in zip(estimates, tags) if count > 0),
+            key=lambda item: (-item[0], item[1])
+        )[:self.max_candidates]
+        kept = {tag for _, tag in ranked}
+        for tag in tags:
+            if tag not in kept:
+                del candidates[tag]
+        return ranked
+
+    def top(self, limit=10):
+        """
+        Up to `limit` {'tag', 'count'} dicts, most used first
+        """
+        self._ensure_loaded()
+        self._counters.incr('reads')
+        with self._lock:
+            if time.monotonic() - self._ranked_at >= self.rank_seconds:
+                self._sketch.advance(_minute(time.time()))
+                ranked = self._prune(self._sketch, self._candidates)
+                self._ranked = [{'tag': tag, 'count': count} for count, tag in ranked[:TRENDS_MAX]]
+                self._ranked_at = time.monotonic()
+                self._counters.incr('rankings')
+            return self._ranked[:limit]
+
+    def _ensure_loaded(self):
+        """
+        Loads the counts on first use and starts a background reload once
+        they're stale
+        """
+        with self._lock:
+            loaded = self._sketch is not None
+            stale = time.monotonic() - self._loaded_at > self.refresh_seconds
+            if loaded and stale and not self._refreshing:
+                self._refreshing = True
+                Thread(target=self._reload, args=(db.get_app(),), daemon=True).start()
+        if not loaded:
+            self.reload()
+
+    def reload(self, batch_size=10000):
+        """
+        Rebuilds the counts from the tags attached within the window. Tags
+        committed by this process while it runs may be missed until the next
+        reload.
+        """
+        started = time.perf_counter()
+        try:
+            sketch = WindowedSketch(self.window_minutes)
+            candidates = {}
+            oldest = _minute(time.time()) - self.window_minutes + 1
+            rows = db.session.execute(
+                select(TweetHashtag.tag, TweetHashtag.created_at)
+                .where(TweetHashtag.created_at >= datetime.fromtimestamp(oldest * 60, timezone.utc))
+                .order_by(TweetHashtag.created_at)
+                .execution_options(stream_results=True, yield_per=batch_size)
+            )
+            for tag, created_at in rows:
+                self._add(sketch, candidates, tag, _minute(created_at))
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+            raise
+        with self._lock:
+            self._sketch = sketch
+            self._candidates = candidates
+            self._ranked_at = float('-inf')
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+        self._load_seconds = time.perf_counter() - started
+        self._counters.incr('loads')
+
+    def _reload(self, app):
+        with app.app_context():
+            try:
+                self.reload()
+            finally:
+                db.session.remove()
+
+    def stats(self):
+        stats = self._counters.snapshot()
+        with self._lock:
+            stats['candidates'] = len(self._candidates)
+            stats['buckets'] = len(self._sketch.buckets) if self._sketch is not None else 0
+            stats['sketch_bytes'] = self._sketch.nbytes if self._sketch is not None else 0
+        stats['load_seconds'] = self._load_seconds
+        return stats
+
+
+trending = TrendIndex()
+
+register_metrics('trends', trending.stats)
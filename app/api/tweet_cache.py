@@ -0,0 +1,87 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from .metrics import register_metrics
+
+TWEET_CACHE_SIZE = int(os.environ.get('TWEET_CACHE_SIZE', 5000))
+
+
+class TweetFragmentCache:
+    """
+    In-process LRU of serialized tweet fragments keyed by tweet id and
+    tagged with the tweets.version they were built at.
+
+    Every write that changes what a fragment holds bumps the tweet's
+    version in the same transaction (app/api/counters.py), and readers pass
+    the versions they just read, so an entry built at an older version is
+    never served, whichever process made the write. invalidate() only frees
+    the local entry early. Each gunicorn worker keeps its own cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = Lock()
+        # tweet id -> (version, fragment)
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_many(self, versions, loader):
+        """
+        Returns {tweet_id: fragment} for the tweets in `versions`, which maps
+        tweet id -> its current version, calling loader(missing_ids) once
+        for everything not cached at that version
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for tweet_id, version in versions.items():
+                entry = self._entries.get(tweet_id)
+                if entry is None or entry[0] != version:
+                    missing.append(tweet_id)
+                else:
+                    self._entries.move_to_end(tweet_id)
+                    found[tweet_id] = entry[1]
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += len(missing)
+
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                for tweet_id, fragment in loaded.items():
+                    # A write that lands during the load makes the fragment
+                    # newer than its tag, which only costs a later miss
+                    entry = self._entries.get(tweet_id)
+                    if entry is None or entry[0] <= versions[tweet_id]:
+                        self._entries[tweet_id] = (versions[tweet_id], fragment)
+                        self._entries.move_to_end(tweet_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+            found.update(loaded)
+        return found
+
+    def invalidate(self, tweet_id):
+        if tweet_id is None:
+            return
+        with self._lock:
+            self._entries.pop(tweet_id, None)
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['max_size'] = self.max_size
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+tweet_cache = TweetFragmentCache(TWEET_CACHE_SIZE)
+
+register_metrics('tweet_cache', tweet_cache.stats)
@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify, session, request
 from flask_login import login_required, current_user
-from app.models import Tweet, comments, db, User, Comment, Like
+from app.models import Tweet, comments, User, Comment, Like
 from .auth_routes import validation_errors_to_error_messages
+from .likes import set_like
 
 tweet_like_routes = Blueprint('likes', __name__)
 
@@ -12,8 +13,7 @@ def delete_like(id):
     if like is not None:
         like_dict = like.to_dict()
         if (like_dict['user_id'] == int(current_user.get_id())):
-            db.session.delete(like)
-            db.session.commit()
+            set_like(like_dict['user_id'], like_dict['tweet_id'], False)
             return {"message": "Like has been successfully deleted"}
         else:
             return {"message": "You are not the owner of this like."}
@@ -1,160 +1,220 @@
 from flask import Blueprint, jsonify, session, request
 from flask_login import login_required, current_user
-from app.models import Tweet, comments, db, User, Comment, Like
+from app.models import Tweet, comments, db, User, Comment, Image
 from app.forms import TweetForm
 from .auth_routes import validation_errors_to_error_messages
-from sqlalchemy.orm import joinedload, selectinload
+from .blobs import release_images
+from .counters import bump_tweet_version
+from .deletions import deletion_queue
+from .etags import make_etag, not_modified, profile_fingerprint, tweets_fingerprint, with_etag
+from .entities import remove_tweet_entities, save_tweet_entities
+from .image_pipeline import image_pipeline
+from .likes import set_like
+from .search import index_tweet, unindex_tweet
+from .storage import storage
+from .tweet_cache import tweet_cache
+from .feed_queries import (
+    fetch_comment_page,
+    fetch_user_tweet_page,
+    serialize_comments,
+    serialize_profile,
+    serialize_tweet_detail,
+    serialize_tweets,
+    stream_user_tweets,
+)
+from .pagination import InvalidCursor, get_page_size
+from .streaming import ndjson_response, wants_ndjson
+from .timelines import (
+    TIMELINE_MAX_LENGTH,
+    fan_out_tweet,
+    read_home_timeline,
+    remove_tweet_from_timelines,
+    retime_tweet_in_timelines,
+)
+from .trends import trending
+from .uploads import TWEET_MAX_IMAGES, UploadError, read_image_file, store_image_files
+from sqlalchemy import or_, select
 
 
 tweet_routes = Blueprint('tweets', __name__)
 
 
-def _serialize_user_basic(user):
-    if not user:
-        return None
-    return {
-        'id': user.id,
-        'username': user.username,
-        'firstName': user.first_name,
-        'lastName': user.last_name,
-        'profileImage': user.profile_image
-    }
-
-
 @tweet_routes.route('/<path:username>/')
 @tweet_routes.route('/<path:username>')
 @login_required
 def get_all_user_tweets(username):
-    user = User.query.filter(User.username == username).first()
-    if not user:
+    """
+    A user's profile and one page of their tweets, newest first, paginated
+    like the home feed. ?format=ndjson streams their whole history instead.
+    """
+    user_id = db.session.execute(select(User.id).where(User.username == username)).scalar()
+    if user_id is None:
         return {"error": "username not found"}, 404
 
-    tweets = (
-        Tweet.query.filter(Tweet.user_id == user.id)
-        .options(
-            selectinload(Tweet.tweet_comments).joinedload(Comment.user),
-            selectinload(Tweet.tweet_comments).selectinload(Comment.comment_images),
-            selectinload(Tweet.tweet_likes),
-            selectinload(Tweet.tweet_images),
+    if wants_ndjson(request.args):
+        return ndjson_response(stream_user_tweets(user_id, current_user.id))
+
+    per_page = get_page_size(request.args)
+    cursor = request.args.get('cursor')
+    try:
+        tweet_ids, next_cursor = fetch_user_tweet_page(user_id, cursor, per_page)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    etag = None
+    if not cursor:
+        etag = make_etag(
+            'user_tweets',
+            current_user.id,
+            tweet_ids,
+            next_cursor,
+            profile_fingerprint(user_id),
+            tweets_fingerprint(tweet_ids, current_user.id)
         )
-        .order_by(Tweet.created_at.desc())
-        .all()
-    )
-
-    tweets_details = []
-    for tweet in tweets or []:
-        tweet_dict = tweet.to_dict()
-        tweet_dict["user"] = _serialize_user_basic(tweet.user)
-        tweet_dict["tweet_comments"] = [
-            {
-                **comment.to_dict(),
-                "user": _serialize_user_basic(comment.user),
-            }
-            for comment in sorted(
-                tweet.tweet_comments,
-                key=lambda c: c.created_at,
-                reverse=True,
-            )
-        ]
-        tweets_details.append(tweet_dict)
+        cached = not_modified(etag)
+        if cached:
+            return cached
 
-    return {
-        "user": user.to_dict(),
-        "tweets": tweets_details,
+    payload = {
+        'user': serialize_profile(user_id, current_user.id),
+        'tweets': serialize_tweets(tweet_ids, current_user.id),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
     }
+    return with_etag(payload, etag) if etag else payload
 
 
 @tweet_routes.route('/home/')
 @tweet_routes.route('/home')
 @login_required
 def get_all_tweets():
-    # Get pagination parameters from query string
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
-
-    # Query with pagination, ordered by created_at descending
-    # Use eager loading to prevent N+1 queries
-    paginated_tweets = db.session.query(Tweet) \
-        .options(
-            joinedload(Tweet.user),  # Load user (one-to-one)
-            selectinload(Tweet.tweet_comments).joinedload(Comment.user),  # Load comments and their users
-            selectinload(Tweet.tweet_comments).selectinload(Comment.comment_images),  # Load comment images
-            selectinload(Tweet.tweet_likes),  # Load likes
-            selectinload(Tweet.tweet_images)  # Load images
-        ) \
-        .order_by(Tweet.created_at.desc()) \
-        .paginate(page=page, per_page=per_page, error_out=False)
-
-    tweets_details = []
-    if paginated_tweets.items:
-        for tweet in paginated_tweets.items:
-            tweet_dict = tweet.to_dict()
-            tweet_dict['user'] = _serialize_user_basic(tweet.user)
-            tweet_dict['tweet_comments'] = [
-                {
-                    **comment.to_dict(),
-                    'user': _serialize_user_basic(comment.user)
-                } for comment in sorted(
-                    tweet.tweet_comments,
-                    key=lambda c: c.created_at,
-                    reverse=True
-                )
-            ]
-            tweets_details.append(tweet_dict)
+    per_page = get_page_size(request.args)
 
-    return {
-        'tweets': tweets_details,
-        'has_more': paginated_tweets.has_next,
-        'page': page,
+    # Legacy offset pagination, kept for clients that still send ?page=.
+    # Every page reads all the ones before it, so it only reaches as deep as
+    # a pushed timeline is kept; next_cursor continues from there.
+    if 'page' in request.args:
+        page = max(request.args.get('page', 1, type=int), 1)
+        if (page - 1) * per_page >= TIMELINE_MAX_LENGTH:
+            return {'errors': f'page is limited to the first {TIMELINE_MAX_LENGTH} tweets, use cursor'}, 400
+        entries, next_cursor = read_home_timeline(current_user.id, limit=page * per_page)
+        page_entries = entries[(page - 1) * per_page:]
+        return {
+            'tweets': serialize_tweets([tweet_id for _, tweet_id in page_entries], current_user.id),
+            'has_more': next_cursor is not None,
+            'next_cursor': next_cursor,
+            'page': page,
+            'per_page': per_page
+        }
+
+    cursor = request.args.get('cursor')
+    try:
+        entries, next_cursor = read_home_timeline(current_user.id, cursor=cursor, limit=per_page)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+    tweet_ids = [tweet_id for _, tweet_id in entries]
+
+    etag = None
+    if not cursor:
+        # Clients poll the first page, so it is the one worth revalidating
+        etag = make_etag('home', tweet_ids, next_cursor, tweets_fingerprint(tweet_ids, current_user.id))
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+    payload = {
+        'tweets': serialize_tweets(tweet_ids, current_user.id),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
         'per_page': per_page
     }
+    return with_etag(payload, etag) if etag else payload
 
 
 @tweet_routes.route('/detail/<int:id>/', methods=['GET'])
 @tweet_routes.route('/detail/<int:id>', methods=['GET'])
 @login_required
 def get_single_tweet(id):
-    tweet = db.session.query(Tweet).options(
-        joinedload(Tweet.user),
-        selectinload(Tweet.tweet_comments).joinedload(Comment.user),
-        selectinload(Tweet.tweet_comments).selectinload(Comment.comment_images),
-        selectinload(Tweet.tweet_likes),
-        selectinload(Tweet.tweet_images)
-    ).filter(Tweet.id == id).one_or_none()
-
-    if tweet is None:
+    fingerprint = tweets_fingerprint([id], current_user.id)
+    if not fingerprint[0]:
         return {'errors': 'Tweet not found'}, 404
+    etag = make_etag('tweet', fingerprint)
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    tweet_dict = tweet.to_dict()
-    tweet_dict['user'] = _serialize_user_basic(tweet.user)
-    tweet_dict['tweet_comments'] = [
-        {
-            **comment.to_dict(),
-            'user': _serialize_user_basic(comment.user)
-        } for comment in sorted(
-            tweet.tweet_comments,
-            key=lambda c: c.created_at,
-            reverse=True
-        )
-    ]
+    # The first page of replies ships with the tweet, the rest are fetched
+    # from /api/tweets/<id>/comments
+    tweet_dict = serialize_tweet_detail(id, current_user.id)
+    if tweet_dict is None:
+        return {'errors': 'Tweet not found'}, 404
+    return with_etag(tweet_dict, etag)
+
+
+@tweet_routes.route('/<int:id>/comments/', methods=['GET'])
+@tweet_routes.route('/<int:id>/comments', methods=['GET'])
+@login_required
+def get_tweet_comments(id):
+    if db.session.query(Tweet.id).filter(Tweet.id == id).one_or_none() is None:
+        return {'errors': 'Tweet not found'}, 404
+
+    per_page = get_page_size(request.args)
+    try:
+        comment_rows, next_cursor = fetch_comment_page(id, request.args.get('cursor'), per_page)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
 
-    return tweet_dict
+    return {
+        'comments': serialize_comments(comment_rows),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
 
 
 @tweet_routes.route('/', methods=['POST'])
 @tweet_routes.route('', methods=['POST'])
 @login_required
 def post_new_tweet():
+    """
+    Posts a tweet. A multipart request can carry up to TWEET_MAX_IMAGES
+    files under `images`, which are validated up front, stored concurrently
+    and committed with the tweet, so a tweet with photos is one round trip.
+    """
     form = TweetForm()
     form['csrf_token'].data = request.cookies['csrf_token']
     if form.validate_on_submit():
+        files = [file for file in request.files.getlist('images') if file]
+        if len(files) > TWEET_MAX_IMAGES:
+            return {'errors': f'A tweet can have at most {TWEET_MAX_IMAGES} images'}, 400
+        try:
+            uploads = [read_image_file(file) for file in files]
+            keys = store_image_files(uploads)
+        except UploadError as error:
+            return {'errors': error.message}, error.status
+
+        user_id = int(current_user.get_id())
         new_tweet = Tweet(
             content=form.data['content'],
-            user_id=int(current_user.get_id())
+            user_id=user_id,
+            image_count=len(keys)
         )
         db.session.add(new_tweet)
+        db.session.flush()
+        images = [
+            Image(user_id=user_id, type='tweet', tweet_id=new_tweet.id, key=key, url=storage.url(key))
+            for key in keys
+        ]
+        db.session.add_all(images)
+        index_tweet(new_tweet.id, new_tweet.content)
+        tags = save_tweet_entities(new_tweet.id, new_tweet.content)
+        fan_out_tweet(new_tweet.id)
         db.session.commit()
-        return new_tweet.to_dict()
+        trending.record(tags)
+        for image, upload in zip(images, uploads):
+            image_pipeline.submit(image.id, upload.data)
+        return serialize_tweets([new_tweet.id], current_user.id)[0]
     return {'errors': validation_errors_to_error_messages(form.errors)}, 400
 
 
@@ -164,25 +224,21 @@ def post_new_tweet():
 def update_tweet(id):
     tweet = Tweet.query.get(id)
     if tweet is not None:
-        tweet_dict = tweet.to_dict()
-        if tweet_dict['user_id'] != int(current_user.get_id()):
+        if tweet.user_id != int(current_user.get_id()):
             return {'errors': 'You are unauthorized to update this tweet'}, 403
         else:
-            user = User.query.filter(User.id == tweet_dict["user_id"]).first()
-            comments = Comment.query.filter(Comment.tweet_id == tweet_dict["id"]).all()
             form = TweetForm()
             form['csrf_token'].data = request.cookies['csrf_token']
             if form.validate_on_submit():
                 tweet.content = form.data["content"]
-                result = tweet.to_dict()
-                result["user"] = user.to_dict()
-                if comments is not None and len(comments) > 0:
-                    comments_result = [comment.to_dict() for comment in comments]
-                    result["comments"] = comments_result
-                else:
-                    result["comments"] = []
+                index_tweet(tweet.id, tweet.content)
+                tags = save_tweet_entities(tweet.id, tweet.content)
+                bump_tweet_version(tweet.id)
+                retime_tweet_in_timelines(tweet.id)
                 db.session.commit()
-                return result
+                tweet_cache.invalidate(tweet.id)
+                trending.record(tags)
+                return serialize_tweets([tweet.id], current_user.id)[0]
             return {'errors': validation_errors_to_error_messages(form.errors)}, 400
     else:
         return {'errors': 'Tweet not found'}, 404
@@ -194,34 +250,46 @@ def update_tweet(id):
 def delete_tweet(id):
     tweet = Tweet.query.get(id)
     if tweet is not None:
-        tweet_dict = tweet.to_dict()
-        if tweet_dict['user_id'] != int(current_user.get_id()):
+        if tweet.user_id != int(current_user.get_id()):
             return {'errors': 'You are unauthorized to delete this tweet'}, 403
         else:
             form = TweetForm()
             form['csrf_token'].data = request.cookies['csrf_token']
+            remove_tweet_from_timelines(tweet.id)
+            unindex_tweet(tweet.id)
+            remove_tweet_entities(tweet.id)
+            # The images on the tweet and its replies go with it
+            images = Image.query.filter(or_(
+                Image.tweet_id == tweet.id,
+                Image.comment_id.in_(select(Comment.id).where(Comment.tweet_id == tweet.id))
+            )).all()
             db.session.delete(tweet)
+            db.session.flush()
+            released = release_images(images)
             db.session.commit()
+            deletion_queue.put(released)
+            tweet_cache.invalidate(id)
             return {"message": "Tweet successfully deleted"}
     return {'errors': 'Tweet not found'}, 404
 
 
-@tweet_routes.route('/<int:id>/like/', methods=['POST'])
-@tweet_routes.route('/<int:id>/like', methods=['POST'])
+# Liking is idempotent and keyed by (user, tweet), so double clicks and
+# retries are harmless. POST is kept for clients that predate PUT.
+@tweet_routes.route('/<int:id>/like/', methods=['PUT', 'POST'])
+@tweet_routes.route('/<int:id>/like', methods=['PUT', 'POST'])
+@login_required
 def like_tweet(id):
-    tweet = Tweet.query.get(id)
-    if tweet is not None:
-        tweet_dict = tweet.to_dict()
-        likes_list = tweet_dict["tweet_likes"]
-        user_likes = [x for x in likes_list if x["user_id"] == int(current_user.get_id())]
-        if len(user_likes) > 0:
-            return {"message": "Cannot like a tweet more than once"}, 400
-        new_like = Like(
-            user_id = int(current_user.get_id()),
-            tweet_id = id
-        )
-        db.session.add(new_like)
-        db.session.commit()
-        return new_like.to_dict()
-    else:
-        return {"message": "Tweet does not exist"}, 404
+    state = set_like(current_user.id, id, True)
+    if state is None:
+        return {'errors': 'Tweet not found'}, 404
+    return state
+
+
+@tweet_routes.route('/<int:id>/like/', methods=['DELETE'])
+@tweet_routes.route('/<int:id>/like', methods=['DELETE'])
+@login_required
+def unlike_tweet(id):
+    state = set_like(current_user.id, id, False)
+    if state is None:
+        return {'errors': 'Tweet not found'}, 404
+    return state
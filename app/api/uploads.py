@@ -0,0 +1,352 @@
+import hashlib
+import imghdr
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+
+from PIL import Image as PILImage
+from sqlalchemy import select, update
+
+from app.models import db, Comment, Image, IMAGE_PENDING, IMAGE_READY, Tweet, User
+from .blobs import acquire_blob
+from .counters import adjust_tweet_counters, bump_tweet_version, bump_user_versions
+from .deletions import deletion_queue
+from .image_pipeline import image_pipeline
+from .metrics import Counters, register_metrics
+from .s3_image_upload import (
+    ALLOWED_IMGHDR_TYPES,
+    ALLOWED_MIME_TYPES,
+    MAX_IMAGE_FILE_SIZE,
+    allowed_file,
+    get_content_filename,
+    get_unique_filename,
+    sanitize_filename,
+    validate_image_file,
+)
+from .storage import storage
+from .tweet_cache import tweet_cache
+
+# Direct uploads: the client asks for a presigned URL, which records a
+# pending Image, sends the file straight to storage, then calls the complete
+# route. Uploads whose client never calls back are finalized, or expired,
+# by sweep_pending_uploads. Either way the object is checked before the
+# image goes live, so nothing the browser sends is trusted. Uploads go to a
+# fresh key since their content isn't known up front; one that turns out to
+# duplicate a stored image is dropped for the stored copy once finalized.
+
+UPLOAD_URL_EXPIRES_SECONDS = int(os.environ.get('UPLOAD_URL_EXPIRES_SECONDS', 300))
+# Pending uploads younger than this are left to the client's completion call
+UPLOAD_VERIFY_AFTER_SECONDS = int(os.environ.get('UPLOAD_VERIFY_AFTER_SECONDS', 30))
+# How often the background verifier sweeps; 0 turns it off and leaves it to
+# `flask images finalize`, e.g. from cron
+UPLOAD_VERIFY_INTERVAL_SECONDS = int(os.environ.get('UPLOAD_VERIFY_INTERVAL_SECONDS', 0))
+
+# Images uploaded with a tweet through the API, which are stored
+# concurrently on a pool of IMAGE_UPLOAD_THREADS shared by all requests
+TWEET_MAX_IMAGES = int(os.environ.get('TWEET_MAX_IMAGES', 4))
+IMAGE_UPLOAD_THREADS = int(os.environ.get('IMAGE_UPLOAD_THREADS', 8))
+
+IMAGE_TYPES = ('tweet', 'comment', 'user')
+
+logger = logging.getLogger(__name__)
+
+upload_metrics = Counters('presigned', 'completed', 'invalid', 'expired', 'sweeps')
+
+register_metrics('uploads', upload_metrics.snapshot)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def attach_image(image):
+    """
+    Applies a newly ready image to what it belongs to: the tweet's image
+    count, the version of the tweet a comment is on, or the user's profile
+    image. Returns the id of the tweet whose cache entry to invalidate once
+    committed, if any.
+    """
+    if image.type == 'tweet':
+        adjust_tweet_counters(image.tweet_id, image_count=1)
+        return image.tweet_id
+    if image.type == 'comment':
+        tweet_id = db.session.execute(select(Comment.tweet_id).where(Comment.id == image.comment_id)).scalar()
+        bump_tweet_version(tweet_id)
+        return tweet_id
+    if image.type == 'user':
+        user = User.query.get(image.user_id)
+        if user:
+            user.profile_image = image.url
+            bump_user_versions(user.id)
+    return None
+
+
+ImageUpload = namedtuple('ImageUpload', ['data', 'filename', 'content_type', 'digest'])
+
+_upload_pool = None
+_upload_pool_lock = Lock()
+
+
+def read_image_file(file):
+    """
+    Validates an uploaded file and reads it into an ImageUpload without its
+    metadata, or raises UploadError. The digest is the stripped content's,
+    which is what gets stored.
+    """
+    is_valid, validation_result = validate_image_file(file)
+    if not is_valid:
+        raise UploadError(validation_result)
+    try:
+        data = image_pipeline.strip(file.stream.read())
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        raise UploadError('file content not recognized as an image')
+    finally:
+        file.stream.seek(0)
+    return ImageUpload(data, validation_result, file.mimetype, hashlib.sha256(data).hexdigest())
+
+
+def _get_upload_pool():
+    global _upload_pool
+    with _upload_pool_lock:
+        if _upload_pool is None:
+            _upload_pool = ThreadPoolExecutor(IMAGE_UPLOAD_THREADS, thread_name_prefix='image-upload')
+        return _upload_pool
+
+
+def store_image_files(uploads):
+    """
+    Takes a blob reference for each upload and stores the content that
+    isn't stored yet, concurrently. Returns the keys in the uploads' order.
+
+    The references are taken in digest order, so requests sharing images
+    lock their blob rows in the same order. If any put fails the
+    transaction is rolled back, whatever was stored is queued for deletion,
+    and UploadError is raised.
+    """
+    keys = {}
+    to_store = []
+    for upload in sorted(uploads, key=lambda upload: upload.digest):
+        if upload.digest in keys:
+            # The same file twice in one request
+            key, created = acquire_blob(upload.digest, keys[upload.digest], len(upload.data))
+        else:
+            key, created = acquire_blob(
+                upload.digest, get_content_filename(upload.filename, upload.digest), len(upload.data)
+            )
+            if created:
+                to_store.append((key, upload))
+        keys[upload.digest] = key
+
+    if len(to_store) == 1:
+        # Not worth a hand-off to the pool
+        key, upload = to_store[0]
+        try:
+            storage.put(key, upload.data, upload.content_type)
+        except Exception as error:
+            db.session.rollback()
+            logger.exception("Image upload failed")
+            raise UploadError(str(error))
+    elif to_store:
+        pool = _get_upload_pool()
+        futures = {
+            pool.submit(storage.put, key, upload.data, upload.content_type): key for key, upload in to_store
+        }
+        wait(futures)
+        failed = [future for future in futures if future.exception() is not None]
+        if failed:
+            db.session.rollback()
+            deletion_queue.put([(futures[future],) for future in futures if future.exception() is None])
+            logger.error("Storing %d of %d images failed", len(failed), len(futures), exc_info=failed[0].exception())
+            raise UploadError(str(failed[0].exception()))
+    return [keys[upload.digest] for upload in uploads]
+
+
+def _check_owner(user_id, image_type, owner_id):
+    if image_type == 'user':
+        return
+    model = Tweet if image_type == 'tweet' else Comment
+    author_id = db.session.execute(select(model.user_id).where(model.id == owner_id)).scalar()
+    if author_id is None:
+        raise UploadError(f'{image_type} not found', 404)
+    if author_id != user_id:
+        raise UploadError(f'You are unauthorized to add images to this {image_type}', 403)
+
+
+def create_pending_image(user_id, image_type, owner_id, filename, content_type, size):
+    """
+    Records a pending image and returns it with the presigned upload the
+    client should send the file to. The caller commits.
+    """
+    if image_type not in IMAGE_TYPES:
+        raise UploadError('invalid form type')
+    sanitized_name = sanitize_filename(filename)
+    if not sanitized_name or not allowed_file(sanitized_name):
+        raise UploadError('file type not permitted')
+    if content_type not in ALLOWED_MIME_TYPES:
+        raise UploadError('mimetype not permitted')
+    if not isinstance(size, int) or size < 1:
+        raise UploadError('size required')
+    if size > MAX_IMAGE_FILE_SIZE:
+        raise UploadError('file too large')
+    _check_owner(user_id, image_type, owner_id)
+
+    key = get_unique_filename(sanitized_name)
+    image = Image(
+        user_id=user_id,
+        type=image_type,
+        tweet_id=owner_id if image_type == 'tweet' else None,
+        comment_id=owner_id if image_type == 'comment' else None,
+        key=key,
+        url=storage.url(key),
+        status=IMAGE_PENDING
+    )
+    db.session.add(image)
+    db.session.flush()
+    upload = storage.presign_upload(key, content_type, MAX_IMAGE_FILE_SIZE, UPLOAD_URL_EXPIRES_SECONDS)
+    upload_metrics.incr('presigned')
+    upload_verifier.start()
+    return image, upload
+
+
+def finalize_upload(image):
+    """
+    Checks a pending image's object, replaces it with a copy without its
+    metadata if it has any, and makes the image live. Returns 'ready',
+    'missing' when nothing has been uploaded yet, or 'invalid' when the
+    object is too large or not an image, in which case the object and the
+    row are deleted. Commits.
+    """
+    if image.status == IMAGE_READY:
+        return 'ready'
+    head = storage.head(image.key)
+    if head is None:
+        return 'missing'
+    data = None
+    if head['size'] <= MAX_IMAGE_FILE_SIZE and \
+            imghdr.what(None, storage.read_prefix(image.key, 512)) in ALLOWED_IMGHDR_TYPES:
+        data = storage.read(image.key)
+    if data is not None and len(data) <= MAX_IMAGE_FILE_SIZE:
+        try:
+            stripped = image_pipeline.strip(data)
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            data = None
+        else:
+            if stripped is not data:
+                # Before the image goes live, so its URL never serves the
+                # metadata. A racing finalize writes the same bytes.
+                storage.put(image.key, stripped, head['content_type'])
+                data = stripped
+    if data is None or len(data) > MAX_IMAGE_FILE_SIZE:
+        db.session.delete(image)
+        db.session.commit()
+        deletion_queue.put([(image.key,)])
+        upload_metrics.incr('invalid')
+        return 'invalid'
+
+    # Claimed with a conditional update so a completion call racing the
+    # verifier attaches the image once
+    claimed = db.session.execute(
+        update(Image)
+        .where(Image.id == image.id, Image.status == IMAGE_PENDING)
+        .values(status=IMAGE_READY, created_at=Image.created_at)
+    ).rowcount
+    tweet_id = None
+    staged_key = None
+    if claimed:
+        key, created = acquire_blob(hashlib.sha256(data).hexdigest(), image.key, len(data))
+        if not created:
+            # The content is already stored, so the image points at that
+            # object and the upload is dropped
+            staged_key = image.key
+            db.session.execute(
+                update(Image)
+                .where(Image.id == image.id)
+                .values(key=key, url=storage.url(key), created_at=Image.created_at)
+            )
+        tweet_id = attach_image(image)
+    db.session.commit()
+    if claimed:
+        if staged_key is not None:
+            deletion_queue.put([(staged_key,)])
+        tweet_cache.invalidate(tweet_id)
+        upload_metrics.incr('completed')
+        image_pipeline.submit(image.id, data)
+    return 'ready'
+
+
+def sweep_pending_uploads(now=None):
+    """
+    Finalizes the pending uploads whose client never called back, and drops
+    those whose upload URL expired with nothing uploaded. Returns how many
+    ended up in each state.
+    """
+    now = now or datetime.now(timezone.utc)
+    settled = now - timedelta(seconds=UPLOAD_VERIFY_AFTER_SECONDS)
+    expired = now - timedelta(seconds=UPLOAD_URL_EXPIRES_SECONDS + UPLOAD_VERIFY_AFTER_SECONDS)
+    # Served by ix_images_status_created_at
+    rows = db.session.execute(
+        select(Image.id, Image.created_at < expired)
+        .where(Image.status == IMAGE_PENDING, Image.created_at < settled)
+        .order_by(Image.created_at)
+    ).all()
+
+    results = {'ready': 0, 'invalid': 0, 'missing': 0, 'expired': 0}
+    for image_id, is_expired in rows:
+        image = Image.query.get(image_id)
+        if image is None:
+            continue
+        result = finalize_upload(image)
+        if result == 'missing' and is_expired:
+            db.session.delete(image)
+            db.session.commit()
+            upload_metrics.incr('expired')
+            result = 'expired'
+        results[result] += 1
+    upload_metrics.incr('sweeps')
+    return results
+
+
+class UploadVerifier:
+    """
+    Background thread that runs sweep_pending_uploads every `interval`
+    seconds. Starts with the first presigned upload, and only when
+    UPLOAD_VERIFY_INTERVAL_SECONDS is set.
+    """
+
+    def __init__(self, interval=UPLOAD_VERIFY_INTERVAL_SECONDS):
+        self.interval = interval
+        self.app = None
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        if not self.interval or self.app is None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='upload-verifier', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    sweep_pending_uploads()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Sweeping pending uploads failed")
+                finally:
+                    db.session.remove()
+
+
+upload_verifier = UploadVerifier()
@@ -1,7 +1,20 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
-from app.models import User, Tweet
+from sqlalchemy import select
+from app.models import db, User, Tweet
 from .auth_routes import validation_errors_to_error_messages
+from .etags import make_etag, not_modified, profile_fingerprint, with_etag
+from .feed_queries import (
+    fetch_follow_page,
+    fetch_mention_page,
+    fetch_user_directory,
+    fetch_users,
+    serialize_profile,
+    serialize_tweets,
+    serialize_user,
+)
+from .pagination import InvalidCursor, get_page_size
+from .suggestions import SUGGESTIONS_MAX, suggestion_engine
 
 user_routes = Blueprint('users', __name__)
 
@@ -9,12 +22,121 @@ user_routes = Blueprint('users', __name__)
 @user_routes.route('/')
 @login_required
 def users():
-    users = User.query.all()
-    return {'users': [user.to_dict() for user in users]}
+    """
+    The user directory, ordered by username. ?q= narrows it to users whose
+    username, first or last name starts with the given text, for typeahead.
+    """
+    per_page = get_page_size(request.args)
+    try:
+        cards, next_cursor = fetch_user_directory(
+            current_user.id,
+            prefix=request.args.get('q', '').strip(),
+            cursor=request.args.get('cursor'),
+            limit=per_page
+        )
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    return {
+        'users': cards,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
+
+
+@user_routes.route('/suggestions/')
+@user_routes.route('/suggestions')
+@login_required
+def suggestions():
+    """
+    "Who to follow" for the current user, most mutual follows first.
+    `mutual_count` is how many of the accounts they follow follow that user.
+    """
+    limit = max(1, min(request.args.get('limit', 10, type=int), SUGGESTIONS_MAX))
+    ranked = suggestion_engine.suggest(current_user.id, limit)
+    users = fetch_users([user_id for user_id, _ in ranked])
+    return {
+        'users': [
+            {**serialize_user(users[user_id]), 'mutual_count': mutual_count}
+            for user_id, mutual_count in ranked
+            if user_id in users
+        ]
+    }
 
 
 @user_routes.route('/<int:id>')
 @login_required
 def user(id):
-    user = User.query.get(id)
-    return user.to_dict()
+    fingerprint = profile_fingerprint(id)
+    if fingerprint is None:
+        return {'errors': 'User not found'}, 404
+    # Every tweet, follower and following id is only embedded on request
+    include_history = request.args.get('include') == 'history'
+    etag = make_etag('user', current_user.id, include_history, fingerprint)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    if include_history:
+        return with_etag(User.query.get(id).to_dict(), etag)
+    return with_etag(serialize_profile(id, current_user.id), etag)
+
+
+def follow_list(user_id, direction):
+    """
+    One page of a user's followers or followed accounts along with the
+    cached total, newest account first
+    """
+    count_column = User.follower_count if direction == 'followers' else User.following_count
+    count = db.session.execute(select(count_column).where(User.id == user_id)).scalar()
+    if count is None:
+        return {'errors': 'User not found'}, 404
+    per_page = get_page_size(request.args)
+    try:
+        cards, next_cursor = fetch_follow_page(
+            user_id, direction, current_user.id, cursor=request.args.get('cursor'), limit=per_page
+        )
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    return {
+        'users': cards,
+        'count': count,
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
+
+
+@user_routes.route('/<int:id>/followers')
+@login_required
+def user_followers(id):
+    return follow_list(id, 'followers')
+
+
+@user_routes.route('/<int:id>/following')
+@login_required
+def user_following(id):
+    return follow_list(id, 'following')
+
+
+@user_routes.route('/<int:id>/mentions')
+@login_required
+def user_mentions(id):
+    """
+    One page of the tweets that @mention the user, newest mention first
+    """
+    if db.session.execute(select(User.id).where(User.id == id)).scalar() is None:
+        return {'errors': 'User not found'}, 404
+    per_page = get_page_size(request.args)
+    try:
+        tweet_ids, next_cursor = fetch_mention_page(id, request.args.get('cursor'), per_page)
+    except InvalidCursor:
+        return {'errors': 'Invalid cursor'}, 400
+
+    return {
+        'tweets': serialize_tweets(tweet_ids, current_user.id),
+        'has_more': next_cursor is not None,
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
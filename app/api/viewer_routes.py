@@ -0,0 +1,75 @@
+import base64
+
+from flask import Blueprint, request
+from flask_login import login_required, current_user
+from .feed_queries import fetch_viewer_comments, fetch_viewer_following, fetch_viewer_likes
+
+viewer_routes = Blueprint('viewer', __name__)
+
+# Upper bound on tweet_ids and on user_ids in one viewer state request
+MAX_VIEWER_STATE_IDS = 500
+
+
+def parse_ids(name):
+    """
+    Reads ids given as ?name=1,2,3 or ?name=1&name=2, keeping their first
+    occurrence order. Raises ValueError on anything that isn't an id.
+    """
+    ids = []
+    for value in request.args.getlist(name):
+        ids.extend(int(part) for part in value.split(',') if part.strip())
+    return list(dict.fromkeys(ids))
+
+
+def encode_bitmap(ids, matches):
+    """
+    Packs "is ids[i] in matches" into bit i (least significant bit first) of
+    a base64 string, one byte per eight ids
+    """
+    bits = bytearray((len(ids) + 7) // 8)
+    for index, id in enumerate(ids):
+        if id in matches:
+            bits[index // 8] |= 1 << (index % 8)
+    return base64.b64encode(bytes(bits)).decode('ascii')
+
+
+@viewer_routes.route('/state/')
+@viewer_routes.route('/state')
+@login_required
+def get_viewer_state():
+    """
+    Whether the current user liked or replied to each of ?tweet_ids and
+    follows each of ?user_ids, with one indexed query per relation. The flags
+    come back as id lists, or with ?encoding=bitmap as base64 bitmaps aligned
+    with the deduplicated ids echoed in the response.
+    """
+    try:
+        tweet_ids = parse_ids('tweet_ids')
+        user_ids = parse_ids('user_ids')
+    except ValueError:
+        return {'errors': 'tweet_ids and user_ids must be lists of ids'}, 400
+    if len(tweet_ids) > MAX_VIEWER_STATE_IDS or len(user_ids) > MAX_VIEWER_STATE_IDS:
+        return {'errors': f'At most {MAX_VIEWER_STATE_IDS} tweet_ids and user_ids per request'}, 400
+    encoding = request.args.get('encoding', 'ids')
+    if encoding not in ('ids', 'bitmap'):
+        return {'errors': 'encoding must be ids or bitmap'}, 400
+
+    liked = fetch_viewer_likes(current_user.id, tweet_ids)
+    commented = fetch_viewer_comments(current_user.id, tweet_ids)
+    following = fetch_viewer_following(current_user.id, user_ids)
+
+    if encoding == 'bitmap':
+        return {
+            'encoding': 'bitmap',
+            'tweet_ids': tweet_ids,
+            'user_ids': user_ids,
+            'liked': encode_bitmap(tweet_ids, liked),
+            'commented': encode_bitmap(tweet_ids, commented),
+            'following': encode_bitmap(user_ids, following)
+        }
+    return {
+        'encoding': 'ids',
+        'liked': [id for id in tweet_ids if id in liked],
+        'commented': [id for id in tweet_ids if id in commented],
+        'following': [id for id in user_ids if id in following]
+    }
@@ -0,0 +1,121 @@
+import sys
+
+import click
+
+from flask.cli import AppGroup
+from app.api.blobs import reconcile_blob_refs
+from app.api.counters import reconcile_tweet_counters, reconcile_user_counters
+from app.api.deletions import sweep_orphans
+from app.api.entities import backfill_entities
+from app.api.query_plans import check_query_plans
+from app.api.search import reindex as reindex_search
+from app.api.timelines import backfill_timelines, trim_all_timelines
+from app.api.uploads import sweep_pending_uploads
+
+# Maintenance commands for derived data that can be rebuilt from the
+# source tables, e.g. `flask timelines backfill`
+timeline_commands = AppGroup('timelines')
+
+
+# Creates the `flask timelines backfill` command
+@timeline_commands.command('backfill')
+def backfill():
+    count = backfill_timelines()
+    print(f"Rebuilt home timelines for {count} users")
+
+
+# Creates the `flask timelines trim` command, which cuts the home timelines
+# that outgrew TIMELINE_MAX_LENGTH back to it. Meant to run periodically.
+@timeline_commands.command('trim')
+def trim():
+    count = trim_all_timelines()
+    print(f"Trimmed {count} home timelines")
+
+
+counter_commands = AppGroup('counters')
+
+
+# Creates the `flask counters reconcile` command
+@counter_commands.command('reconcile')
+def reconcile():
+    count = reconcile_tweet_counters()
+    print(f"Repaired counters on {count} tweets")
+    count = reconcile_user_counters()
+    print(f"Repaired follow counters on {count} users")
+    count = reconcile_blob_refs()
+    print(f"Repaired reference counts on {count} stored images")
+
+
+index_commands = AppGroup('indexes')
+
+
+# Creates the `flask indexes check` command, which exits non zero when a hot
+# query stops using its index, e.g. after a migration drops or renames one
+@index_commands.command('check')
+def check():
+    failures = 0
+    for name, indexes, plan, ok in check_query_plans():
+        print(f"{'ok' if ok else 'FAIL':<6}{name}")
+        if not ok:
+            failures += 1
+            print(f"      expected one of: {', '.join(indexes)}")
+            for line in plan.splitlines():
+                print(f"      | {line}")
+    if failures:
+        print(f"{failures} queries are not using their indexes")
+        sys.exit(1)
+
+
+search_commands = AppGroup('search')
+
+
+# Creates the `flask search reindex` command, which rebuilds the full-text
+# search indexes from the tweets, comments and users tables
+@search_commands.command('reindex')
+def reindex():
+    counts = reindex_search()
+    print(f"Indexed {counts['tweets']} tweets, {counts['comments']} comments and {counts['users']} users")
+
+
+tag_commands = AppGroup('tags')
+
+
+# Creates the `flask tags backfill` command, which extracts the hashtags and
+# mentions of tweets written before they were extracted on write
+@tag_commands.command('backfill')
+def backfill_tags():
+    count = backfill_entities()
+    print(f"Extracted hashtags and mentions from {count} tweets")
+
+
+image_commands = AppGroup('images')
+
+
+# Creates the `flask images finalize` command, which finalizes direct uploads
+# whose client never called back and drops those that expired unused
+@image_commands.command('finalize')
+def finalize():
+    results = sweep_pending_uploads()
+    print(f"Finalized {results['ready']} uploads, rejected {results['invalid']}, "
+          f"expired {results['expired']}, {results['missing']} still pending")
+
+
+# Creates the `flask images sweep` command, which deletes the stored objects
+# no image references, a page of the bucket listing at a time. Long sweeps
+# can be resumed with --start-after from the last key it printed.
+@image_commands.command('sweep')
+@click.option('--start-after', default='', help='Key to continue the listing after')
+@click.option('--pages', default=0, help='Stop after this many pages; 0 sweeps the whole bucket')
+@click.option('--page-size', default=1000, help='Objects per page, at most 1000')
+def sweep(start_after, pages, page_size):
+    listed = deleted = swept = 0
+    key = start_after
+    while key is not None and (not pages or swept < pages):
+        result = sweep_orphans(key, min(page_size, 1000))
+        listed += result['listed']
+        deleted += result['deleted']
+        swept += 1
+        key = result['next']
+        if key is not None:
+            print(f"Swept up to {key}")
+    print(f"Deleted {deleted} orphaned objects out of {listed}")
@@ -3,4 +3,7 @@ from .user import User
 from .tweets import Tweet
 from .comments import Comment
 from .likes import Like
-from .images import Image
+from .images import Image, ImageBlob, IMAGE_PENDING, IMAGE_READY
+from .timelines import TimelineEntry
+from .entities import TweetHashtag, TweetMention
+from . import search
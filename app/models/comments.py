@@ -8,6 +8,10 @@ from app.models import User
 
 class Comment(db.Model, UserMixin):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_tweet_id_created_at', 'tweet_id', 'created_at', 'id'),
+        db.Index('ix_comments_user_id_created_at', 'user_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(280), nullable=False)
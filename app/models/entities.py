@@ -0,0 +1,31 @@
+from .db import db
+
+
+# Hashtags and @mentions parsed out of a tweet's content when it is posted
+# or edited, see app/api/entities.py. created_at is when the entity was
+# attached, so a tag's tweets page newest first off one range scan and the
+# trending counter can be rebuilt from a window of recent rows.
+class TweetHashtag(db.Model):
+    __tablename__ = 'tweet_hashtags'
+
+    tweet_id = db.Column(db.Integer, db.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True)
+    # Lowercased, without the leading '#'
+    tag = db.Column(db.String(100), primary_key=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_tweet_hashtags_tag_created_at', 'tag', 'created_at', 'tweet_id'),
+        db.Index('ix_tweet_hashtags_created_at', 'created_at'),
+    )
+
+
+class TweetMention(db.Model):
+    __tablename__ = 'tweet_mentions'
+
+    tweet_id = db.Column(db.Integer, db.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_tweet_mentions_user_id_created_at', 'user_id', 'created_at', 'tweet_id'),
+    )
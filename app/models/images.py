@@ -3,8 +3,20 @@ from sqlalchemy.sql import func
 
 # should only be three types of images for now. User, tweet, and comment
 
+# Images uploaded straight to storage with a presigned URL stay pending, and
+# out of every feed and count, until the upload is verified
+IMAGE_PENDING = 'pending'
+IMAGE_READY = 'ready'
+
 class Image(db.Model):
     __tablename__ = 'images'
+    __table_args__ = (
+        db.Index('ix_images_tweet_id', 'tweet_id'),
+        db.Index('ix_images_comment_id', 'comment_id'),
+        db.Index('ix_images_user_id_type', 'user_id', 'type'),
+        db.Index('ix_images_status_created_at', 'status', 'created_at'),
+        db.Index('ix_images_key', 'key'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(40), nullable=False)
@@ -13,6 +25,14 @@ class Image(db.Model):
     tweet_id = db.Column(db.Integer, db.ForeignKey('tweets.id'))
     comment_id = db.Column(db.Integer, db.ForeignKey('comments.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    status = db.Column(db.String(20), nullable=False, default=IMAGE_READY, server_default=IMAGE_READY)
+    # Filled in by the image pipeline (app/api/image_pipeline.py) shortly
+    # after upload: the displayed size, a BlurHash placeholder and a list of
+    # {key, url, width, height, content_type} resized WebP variants
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    placeholder = db.Column(db.String(64))
+    variants = db.Column(db.JSON)
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now())
 
     user = db.relationship(
@@ -33,5 +53,32 @@ class Image(db.Model):
             'id': self.id,
             'url': self.url,
             'key': self.key,
-            'user_id': self.user_id
+            'user_id': self.user_id,
+            'status': self.status,
+            'width': self.width,
+            'height': self.height,
+            'placeholder': self.placeholder,
+            'variants': [
+                {name: variant[name] for name in ('url', 'width', 'height', 'content_type')}
+                for variant in self.variants or []
+            ]
         }
+
+
+# A stored object and how many ready images point at it. Uploads are
+# deduplicated by content: an image whose digest is already stored takes a
+# reference to that object instead of storing another copy, and the object
+# is only deleted with its last reference, see app/api/blobs.py.
+class ImageBlob(db.Model):
+    __tablename__ = 'image_blobs'
+    __table_args__ = (
+        db.Index('ix_image_blobs_digest', 'digest', unique=True),
+    )
+
+    key = db.Column(db.String(255), primary_key=True)
+    # sha256 of the uploaded content; null for objects stored before uploads
+    # were deduplicated
+    digest = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
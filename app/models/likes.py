@@ -3,6 +3,10 @@ from flask_login import UserMixin
 
 class Like(db.Model, UserMixin):
   __tablename__ = 'likes'
+  __table_args__ = (
+      db.Index('uq_likes_user_id_tweet_id', 'user_id', 'tweet_id', unique=True),
+      db.Index('ix_likes_tweet_id', 'tweet_id'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -0,0 +1,40 @@
+from sqlalchemy import DDL, event
+
+from .user import User
+from .tweets import Tweet
+from .comments import Comment
+
+# Full-text search structures, see app/api/search.py for the queries.
+#
+# Postgres matches the GIN expression indexes below, which the database keeps
+# up to date itself. The search queries must use exactly these expressions
+# or the planner won't pick the indexes.
+#
+# SQLite has no tsvector, so each table gets an FTS5 shadow table keyed by
+# the row id, which the write routes keep in step.
+TWEET_DOCUMENT = "to_tsvector('english', content)"
+COMMENT_DOCUMENT = "to_tsvector('english', content)"
+USER_DOCUMENT = "to_tsvector('simple', username || ' ' || first_name || ' ' || last_name)"
+
+POSTGRES_INDEXES = [
+    (Tweet.__table__, 'ix_tweets_content_search', TWEET_DOCUMENT),
+    (Comment.__table__, 'ix_comments_content_search', COMMENT_DOCUMENT),
+    (User.__table__, 'ix_users_name_search', USER_DOCUMENT),
+]
+
+SQLITE_FTS_TABLES = [
+    (Tweet.__table__, 'tweets_fts', "content, tokenize = 'porter unicode61'"),
+    (Comment.__table__, 'comments_fts', "content, tokenize = 'porter unicode61'"),
+    (User.__table__, 'users_fts', "username, first_name, last_name, tokenize = 'unicode61'"),
+]
+
+for table, name, document in POSTGRES_INDEXES:
+    event.listen(table, 'after_create', DDL(
+        f'CREATE INDEX IF NOT EXISTS {name} ON {table.name} USING gin ({document})'
+    ).execute_if(dialect='postgresql'))
+
+for table, name, columns in SQLITE_FTS_TABLES:
+    event.listen(table, 'after_create', DDL(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({columns})'
+    ).execute_if(dialect='sqlite'))
+    event.listen(table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {name}').execute_if(dialect='sqlite'))
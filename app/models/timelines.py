@@ -0,0 +1,28 @@
+from .db import db
+
+
+# One row per tweet in a user's materialized home timeline. Rows are written
+# when a tweet is posted (fan-out on write) so reading a timeline is a single
+# range scan over (user_id, created_at, tweet_id).
+class TimelineEntry(db.Model):
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tweet_id = db.Column(db.Integer, db.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_created_at', 'user_id', 'created_at', 'tweet_id'),
+        db.Index('ix_timeline_entries_tweet_id', 'tweet_id'),
+    )
+
+    tweet = db.relationship('Tweet', foreign_keys=[tweet_id])
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'tweet_id': self.tweet_id,
+            'author_id': self.author_id,
+            'created_at': self.created_at
+        }
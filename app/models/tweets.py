@@ -9,12 +9,30 @@ from app.models import User
 
 class Tweet(db.Model, UserMixin):
     __tablename__ = 'tweets'
+    __table_args__ = (
+        db.Index('ix_tweets_user_id_created_at', 'user_id', 'created_at', 'id'),
+        # Only the pulled tweets, which home timelines read per author
+        db.Index('ix_tweets_pulled_user_id_created_at', 'user_id', 'created_at', 'id',
+                 sqlite_where=db.text('pulled IS 1'), postgresql_where=db.text('pulled IS true')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(280), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now())
 
+    # Denormalized child counts, kept in step by the like, comment and image
+    # routes so feeds don't have to load the child rows just to count them
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    image_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every write that changes this tweet's payload, see
+    # app/api/counters.py. Feeds the ETags of the read endpoints.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set when the tweet wasn't fanned out on write because its author was a
+    # high-follower account at the time. Home timelines merge these in at
+    # read time instead, see app/api/timelines.py.
+    pulled = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     user = db.relationship(
         'User', back_populates='user_tweets', foreign_keys=[user_id])
@@ -30,13 +48,19 @@ class Tweet(db.Model, UserMixin):
     def tweet_details(self):
         return self.to_dict()
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_likes=True, include_comments=True):
+        tweet_dict = {
             'id': self.id,
             'content': self.content,
             'user_id': self.user_id,
             'created_at': self.created_at,
-            'tweet_comments': [x.to_dict() for x in self.tweet_comments],
-            'tweet_likes': [like.to_dict() for like in self.tweet_likes],
+            'like_count': self.like_count,
+            'comment_count': self.comment_count,
+            'image_count': self.image_count,
             'tweet_images': [image.to_dict() for image in self.tweet_images]
         }
+        if include_comments:
+            tweet_dict['tweet_comments'] = [x.to_dict() for x in self.tweet_comments]
+        if include_likes:
+            tweet_dict['tweet_likes'] = [like.to_dict() for like in self.tweet_likes]
+        return tweet_dict
@@ -5,21 +5,41 @@ from flask_login import UserMixin
 
 follows = db.Table(
     'follows',
-    db.Column('follower_id', db.Integer, db.ForeignKey('users.id')),
-    db.Column('following_id', db.Integer, db.ForeignKey('users.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    db.Column('following_id', db.Integer, db.ForeignKey('users.id'), primary_key=True),
+    # The primary key serves "who does X follow", this serves "who follows X"
+    db.Index('ix_follows_following_id', 'following_id', 'follower_id')
 )
 
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
+    # Prefix search on the user directory is a range scan over lower(column),
+    # or lower(column) LIKE 'abc%' on Postgres, which needs text_pattern_ops
+    # to use an index for LIKE. See user_prefix_statement in feed_queries.
+    __table_args__ = (
+        db.Index('ix_users_lower_username', db.func.lower(db.literal_column('username')).label('lower_username'),
+                 postgresql_ops={'lower_username': 'text_pattern_ops'}),
+        db.Index('ix_users_lower_first_name', db.func.lower(db.literal_column('first_name')).label('lower_first_name'),
+                 postgresql_ops={'lower_first_name': 'text_pattern_ops'}),
+        db.Index('ix_users_lower_last_name', db.func.lower(db.literal_column('last_name')).label('lower_last_name'),
+                 postgresql_ops={'lower_last_name': 'text_pattern_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(40), nullable=False, unique=True)
     first_name = db.Column(db.String(40), nullable=False)
     last_name = db.Column(db.String(40), nullable=False)
+
     email = db.Column(db.String(255), nullable=False, unique=True)
     profile_image = db.Column(db.String(255), nullable=False)
     hashed_password = db.Column(db.String(255), nullable=False)
+    # Bumped when the profile or follow lists change, see app/api/counters.py
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Denormalized follow edge counts, kept in step by app/api/follows.py so
+    # profiles of accounts with millions of followers don't count them
+    follower_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     user_tweets = db.relationship(
         'Tweet', back_populates='user', cascade='all, delete')
@@ -45,6 +65,12 @@ class User(db.Model, UserMixin):
         return check_password_hash(self.password, password)
 
     def to_dict(self):
+        """
+        The full profile, embedding every tweet with its comments and likes
+        and the complete follower and following id lists. Routes return
+        app.api.feed_queries.serialize_profile instead and only serve this
+        on an explicit ?include=history.
+        """
         banner_image = next(
             (image.url for image in self.user_images if getattr(image, 'type', None) == 'user_header'),
             None
@@ -2,6 +2,9 @@ from flask.cli import AppGroup
 from .users import seed_users, undo_users
 from .tweets import seed_tweets, undo_tweets
 from .comments import seed_comments, undo_comments
+from .timelines import seed_timelines, undo_timelines
+from .search import seed_search
+from .tags import seed_tags
 
 # Creates a seed group to hold our commands
 # So we can type `flask seed --help`
@@ -14,12 +17,16 @@ def seed():
     seed_users()
     seed_tweets()
     seed_comments()
+    seed_timelines()
+    seed_search()
+    seed_tags()
     # Add other seed functions here
 
 
 # Creates the `flask seed undo` command
 @seed_commands.command('undo')
 def undo():
+    undo_timelines()
     undo_users()
     undo_tweets()
     undo_comments()
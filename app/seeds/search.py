@@ -0,0 +1,9 @@
+from app.api.search import reindex
+
+
+# The search indexes are derived from the seeded rows. Postgres maintains its
+# own, but on SQLite the FTS5 tables only see rows written through the routes.
+def seed_search():
+    counts = reindex()
+    print(f"Successfully indexed {counts['tweets']} tweets, {counts['comments']} comments "
+          f"and {counts['users']} users for search!")
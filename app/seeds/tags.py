@@ -0,0 +1,7 @@
+from app.api.entities import backfill_entities
+
+
+# Hashtags and mentions are extracted from the seeded tweets' content
+def seed_tags():
+    count = backfill_entities()
+    print(f"Successfully extracted hashtags and mentions from {count} tweets!")
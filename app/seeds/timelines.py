@@ -0,0 +1,14 @@
+from app.models import db
+from app.api.timelines import backfill_timelines
+
+
+# Home timelines are derived from tweets and follows, so seeding them is just
+# a backfill over whatever the other seeders created
+def seed_timelines():
+    count = backfill_timelines()
+    print(f"Successfully built home timelines for {count} users!")
+
+
+def undo_timelines():
+    db.session.execute('TRUNCATE timeline_entries;')
+    db.session.commit()
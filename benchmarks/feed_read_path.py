@@ -0,0 +1,175 @@
+"""
+Compares the ORM feed read path with the Core read path in app/api/feed_queries.py.
+
+Builds a throwaway in-memory SQLite database, then serializes the same pages
+of tweets both ways and reports latency and peak Python memory per page. The
+Core path is measured with a cold tweet cache and again with a warm one.
+
+    python benchmarks/feed_read_path.py [--tweets 2000] [--page-size 20] [--rounds 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.orm import joinedload, selectinload  # noqa: E402
+
+from app import app  # noqa: E402
+from app.models import db, User, Tweet, Comment, Like, Image  # noqa: E402
+from app.api.feed_queries import COMMENT_PREVIEW_LIMIT, serialize_tweets  # noqa: E402
+from app.api.tweet_cache import tweet_cache  # noqa: E402
+
+
+def seed(n_users, n_tweets, comments_per_tweet, likes_per_tweet):
+    random.seed(7)
+    users = [
+        User(username=f'cat{i}', first_name='Cat', last_name=str(i), email=f'cat{i}@litter.io',
+             profile_image='', hashed_password='x')
+        for i in range(n_users)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+
+    start = datetime(2022, 10, 4)
+    tweets = [
+        Tweet(content=f'meow {i}', user_id=random.choice(users).id, created_at=start + timedelta(minutes=i))
+        for i in range(n_tweets)
+    ]
+    db.session.add_all(tweets)
+    db.session.flush()
+
+    for tweet in tweets:
+        db.session.add(Image(type='tweet', key=f'{tweet.id}.png', url=f'https://x/{tweet.id}.png',
+                             tweet_id=tweet.id, user_id=tweet.user_id))
+        for j in range(comments_per_tweet):
+            db.session.add(Comment(content=f'purr {j}', tweet_id=tweet.id, user_id=random.choice(users).id,
+                                   created_at=tweet.created_at + timedelta(seconds=j)))
+        for user in random.sample(users, likes_per_tweet):
+            db.session.add(Like(user_id=user.id, tweet_id=tweet.id))
+        tweet.comment_count = comments_per_tweet
+        tweet.like_count = likes_per_tweet
+        tweet.image_count = 1
+    db.session.commit()
+    return [tweet.id for tweet in tweets]
+
+
+def orm_serialize(tweet_ids, viewer_id):
+    """
+    The read path the routes used before feed_queries: hydrate ORM instances
+    with eager loading, then call to_dict()
+    """
+    tweets = db.session.query(Tweet) \
+        .options(joinedload(Tweet.user), selectinload(Tweet.tweet_images)) \
+        .filter(Tweet.id.in_(tweet_ids)).all()
+
+    ranked = db.session.query(
+        Comment.id.label('id'),
+        func.row_number().over(
+            partition_by=Comment.tweet_id,
+            order_by=(Comment.created_at.desc(), Comment.id.desc())
+        ).label('position')
+    ).filter(Comment.tweet_id.in_(tweet_ids)).subquery()
+    previews = {}
+    for comment in db.session.query(Comment) \
+            .join(ranked, ranked.c.id == Comment.id) \
+            .filter(ranked.c.position <= COMMENT_PREVIEW_LIMIT) \
+            .options(joinedload(Comment.user), selectinload(Comment.comment_images)) \
+            .order_by(Comment.tweet_id, ranked.c.position):
+        previews.setdefault(comment.tweet_id, []).append(comment)
+
+    viewer_likes = dict(db.session.query(Like.tweet_id, Like.id)
+                        .filter(Like.user_id == viewer_id, Like.tweet_id.in_(tweet_ids)))
+
+    def basic(user):
+        return {'id': user.id, 'username': user.username, 'firstName': user.first_name,
+                'lastName': user.last_name, 'profileImage': user.profile_image}
+
+    by_id = {tweet.id: tweet for tweet in tweets}
+    payloads = []
+    for tweet_id in tweet_ids:
+        tweet = by_id[tweet_id]
+        tweet_dict = tweet.to_dict(include_likes=False, include_comments=False)
+        tweet_dict['viewer_has_liked'] = tweet.id in viewer_likes
+        tweet_dict['viewer_like_id'] = viewer_likes.get(tweet.id)
+        tweet_dict['user'] = basic(tweet.user)
+        tweet_dict['tweet_comments'] = [
+            {**comment.to_dict(), 'user': basic(comment.user)} for comment in previews.get(tweet.id, [])
+        ]
+        payloads.append(tweet_dict)
+    return payloads
+
+
+def core_uncached(tweet_ids, viewer_id):
+    tweet_cache.clear()
+    return serialize_tweets(tweet_ids, viewer_id)
+
+
+def measure(name, serialize, pages, viewer_id):
+    # Each page starts from an empty session, like a fresh request
+    timings = []
+    peaks = []
+    for page in pages:
+        db.session.remove()
+        tracemalloc.start()
+        started = time.perf_counter()
+        serialize(page, viewer_id)
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'name': name,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95) - 1] * 1000,
+        'peak_kib': sum(peaks) / len(peaks) / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--tweets', type=int, default=2000)
+    parser.add_argument('--comments', type=int, default=15, help='comments per tweet')
+    parser.add_argument('--likes', type=int, default=30, help='likes per tweet')
+    parser.add_argument('--page-size', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    with app.app_context():
+        db.create_all()
+        tweet_ids = seed(args.users, args.tweets, args.comments, args.likes)
+        random.seed(11)
+        pages = [random.sample(tweet_ids, args.page_size) for _ in range(args.rounds)]
+
+        assert orm_serialize(pages[0], 1) == core_uncached(pages[0], 1), 'payloads differ'
+        assert orm_serialize(pages[0], 1) == serialize_tweets(pages[0], 1), 'cached payloads differ'
+
+        # Warm up both paths so import and compile costs are excluded
+        orm_serialize(pages[0], 1)
+        core_uncached(pages[0], 1)
+
+        results = [
+            measure('orm', orm_serialize, pages, 1),
+            measure('core', core_uncached, pages, 1),
+        ]
+        for page in pages:
+            serialize_tweets(page, 1)
+        results.append(measure('cached', serialize_tweets, pages, 1))
+
+    print(f"{args.rounds} pages of {args.page_size} tweets, {args.comments} comments and "
+          f"{args.likes} likes per tweet")
+    print(f"{'path':<8}{'p50 ms':>10}{'p95 ms':>10}{'peak KiB':>12}")
+    for result in results:
+        print(f"{result['name']:<8}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['peak_kib']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
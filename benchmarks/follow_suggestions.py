@@ -0,0 +1,103 @@
+"""
+Measures the "who to follow" engine in app/api/suggestions.py on a large
+synthetic follow graph.
+
+Builds a throwaway SQLite database file with --edges follow edges whose
+targets follow a Zipf distribution, like real audiences, then reports how
+long loading the CSR graph from the follows table takes and the latency of
+ranking suggestions for random users with a cold and a warm result cache.
+
+    python benchmarks/follow_suggestions.py [--users 100000] [--edges 1000000] [--queries 1000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_db_dir, "follows.db")}'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np  # noqa: E402
+
+from app import app  # noqa: E402
+from app.models import db  # noqa: E402
+from app.models.user import follows  # noqa: E402
+from app.api.suggestions import SuggestionEngine  # noqa: E402
+
+
+def synthetic_edges(n_users, n_edges, seed=3):
+    """
+    Unique (follower, following) pairs between user ids 1..n_users without
+    self follows. Followers are uniform, followings Zipf distributed.
+    """
+    rng = np.random.default_rng(seed)
+    # Draw extra so enough survive deduplication
+    draw = n_edges * 3
+    followers = rng.integers(1, n_users + 1, draw)
+    followings = (rng.zipf(1.3, draw) - 1) % n_users + 1
+    # Shuffle ids so the popular accounts aren't just the smallest ids
+    followings = rng.permutation(n_users)[followings - 1] + 1
+    keep = followers != followings
+    pairs = rng.permutation(np.unique(followers[keep] * (n_users + 1) + followings[keep]))[:n_edges]
+    return pairs // (n_users + 1), pairs % (n_users + 1)
+
+
+def seed(followers, followings):
+    # Users are not inserted; the graph only reads the follows table
+    db.session.execute(follows.insert(), [
+        {'follower_id': follower_id, 'following_id': following_id}
+        for follower_id, following_id in zip(followers.tolist(), followings.tolist())
+    ])
+    db.session.commit()
+
+
+def percentile(timings, share):
+    return timings[min(len(timings) - 1, int(len(timings) * share))] * 1000
+
+
+def measure(engine, user_ids):
+    timings = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        engine.suggest(user_id, 10)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return percentile(timings, 0.5), percentile(timings, 0.95), percentile(timings, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--edges', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    with app.app_context():
+        db.create_all()
+        followers, followings = synthetic_edges(args.users, args.edges)
+        started = time.perf_counter()
+        seed(followers, followings)
+        seed_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        engine = SuggestionEngine()
+        graph = engine.reload()
+        load_seconds = time.perf_counter() - started
+
+        user_ids = np.random.default_rng(9).integers(1, args.users + 1, args.queries).tolist()
+        cold = measure(engine, user_ids)
+        warm = measure(engine, user_ids)
+
+    print(f"{graph.edge_count} edges between {args.users} users "
+          f"(inserted in {seed_seconds:.1f}s, CSR arrays {(graph.offsets.nbytes + graph.targets.nbytes) / 2**20:.1f} MiB)")
+    print(f"graph load from the follows table: {load_seconds:.2f}s")
+    print(f"{'cache':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, (p50, p95, p99) in (('cold', cold), ('warm', warm)):
+        print(f"{name:<8}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
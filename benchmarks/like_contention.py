@@ -0,0 +1,165 @@
+"""
+Measures like throughput on a viral tweet with and without the like write
+buffer in app/api/likes.py.
+
+Builds a throwaway SQLite database file, then has concurrent threads like the
+same few tweets as fast as they can. The direct path commits every like on
+its own; the buffered path queues intents and flushes them in batches. Reports
+throughput, per like latency and how long the buffer took to make everything
+durable, then checks that both paths agree with the likes table.
+
+    python benchmarks/like_contention.py [--threads 8] [--likes 2000] [--hot-tweets 1]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+_db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_db_dir, "likes.db")}'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import delete, func, select, update  # noqa: E402
+
+from app import app  # noqa: E402
+from app.models import db, User, Tweet, Like  # noqa: E402
+from app.api.likes import like_buffer, set_like  # noqa: E402
+
+
+def seed(n_users, n_tweets):
+    users = [
+        User(username=f'cat{i}', first_name='Cat', last_name=str(i), email=f'cat{i}@litter.io',
+             profile_image='', hashed_password='x')
+        for i in range(n_users)
+    ]
+    db.session.add_all(users)
+    db.session.flush()
+    tweets = [Tweet(content=f'meow {i}', user_id=users[0].id) for i in range(n_tweets)]
+    db.session.add_all(tweets)
+    db.session.commit()
+    return [user.id for user in users], [tweet.id for tweet in tweets]
+
+
+def reset():
+    db.session.execute(delete(Like.__table__))
+    db.session.execute(update(Tweet.__table__).values(like_count=0, created_at=Tweet.__table__.c.created_at))
+    db.session.commit()
+
+
+def workload(user_ids, tweet_ids, n_likes, double_click_ratio):
+    """
+    (user id, tweet id, liked) intents: distinct users liking the hot tweets,
+    some of them clicking twice, and a few unlikes
+    """
+    random.seed(5)
+    ops = []
+    for user_id in random.sample(user_ids, n_likes):
+        tweet_id = random.choice(tweet_ids)
+        ops.append((user_id, tweet_id, True))
+        if random.random() < double_click_ratio:
+            ops.append((user_id, tweet_id, True))
+        if random.random() < 0.05:
+            ops.append((user_id, tweet_id, False))
+    return ops
+
+
+def run(ops, n_threads):
+    """
+    Splits `ops` across threads, each with its own app context and session,
+    and returns (elapsed seconds, sorted per like latencies). A user's clicks
+    stay on one thread so they land in order.
+    """
+    chunks = [[op for op in ops if op[0] % n_threads == i] for i in range(n_threads)]
+    latencies = []
+    lock = threading.Lock()
+    start = threading.Barrier(n_threads + 1)
+
+    def worker(chunk):
+        timings = []
+        with app.app_context():
+            start.wait()
+            for user_id, tweet_id, liked in chunk:
+                started = time.perf_counter()
+                set_like(user_id, tweet_id, liked)
+                timings.append(time.perf_counter() - started)
+            db.session.remove()
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, sorted(latencies)
+
+
+def check(tweet_ids):
+    db.session.remove()
+    counts = dict(db.session.execute(
+        select(Like.tweet_id, func.count(Like.id)).where(Like.tweet_id.in_(tweet_ids)).group_by(Like.tweet_id)
+    ).all())
+    stored = dict(db.session.execute(select(Tweet.id, Tweet.like_count).where(Tweet.id.in_(tweet_ids))).all())
+    assert all(stored[tweet_id] == counts.get(tweet_id, 0) for tweet_id in tweet_ids), 'like_count drifted'
+    return counts
+
+
+def summarize(name, ops, elapsed, latencies, durable):
+    return {
+        'name': name,
+        'ops_per_s': len(ops) / durable,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'request_s': elapsed,
+        'durable_s': durable,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--likes', type=int, default=2000, help='distinct users liking')
+    parser.add_argument('--hot-tweets', type=int, default=1)
+    parser.add_argument('--double-clicks', type=float, default=0.2, help='share of likes sent twice')
+    parser.add_argument('--interval-ms', type=float, default=5)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_ECHO'] = False
+    with app.app_context():
+        db.create_all()
+        user_ids, tweet_ids = seed(args.likes, args.hot_tweets)
+        ops = workload(user_ids, tweet_ids, args.likes, args.double_clicks)
+
+        like_buffer.enabled = False
+        elapsed, latencies = run(ops, args.threads)
+        results = [summarize('direct', ops, elapsed, latencies, elapsed)]
+        expected = check(tweet_ids)
+
+        reset()
+        like_buffer.enabled = True
+        like_buffer.interval = args.interval_ms / 1000
+        like_buffer.batch_size = args.batch_size
+        started = time.perf_counter()
+        elapsed, latencies = run(ops, args.threads)
+        like_buffer.close()
+        durable = time.perf_counter() - started
+        results.append(summarize('buffered', ops, elapsed, latencies, durable))
+        assert check(tweet_ids) == expected, 'buffered likes differ from direct likes'
+        stats = like_buffer.stats()
+
+    print(f"{len(ops)} like requests from {args.threads} threads on {args.hot_tweets} hot tweet(s)")
+    print(f"{'path':<10}{'likes/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'requests s':>12}{'durable s':>11}")
+    for result in results:
+        print(f"{result['name']:<10}{result['ops_per_s']:>10.0f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['request_s']:>12.2f}{result['durable_s']:>11.2f}")
+    print(f"buffer: {stats['flushes']} flushes, {stats['coalesced']} intents coalesced")
+
+
+if __name__ == '__main__':
+    main()
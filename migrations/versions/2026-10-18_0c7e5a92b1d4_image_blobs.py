@@ -0,0 +1,41 @@
+"""content addressed image blobs with reference counts
+
+Revision ID: 0c7e5a92b1d4
+Revises: f2b8d61c4e73
+Create Date: 2026-10-18 20:51:06.283517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c7e5a92b1d4'
+down_revision = 'f2b8d61c4e73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_blobs',
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('digest', sa.String(length=64), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('ix_image_blobs_digest', 'image_blobs', ['digest'], unique=True)
+    op.create_index('ix_images_key', 'images', ['key'], unique=False)
+    # Objects stored so far weren't hashed, so they are tracked without a
+    # digest and never deduplicated against
+    op.execute(
+        "INSERT INTO image_blobs (key, ref_count, created_at) "
+        "SELECT key, COUNT(*), COALESCE(MIN(created_at), CURRENT_TIMESTAMP) FROM images WHERE status = 'ready' GROUP BY key"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_images_key', table_name='images')
+    op.drop_index('ix_image_blobs_digest', table_name='image_blobs')
+    op.drop_table('image_blobs')
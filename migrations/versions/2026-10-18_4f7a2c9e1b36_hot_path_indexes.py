@@ -0,0 +1,100 @@
+"""indexes for the hot read paths, unique likes and a primary key on follows
+
+Revision ID: 4f7a2c9e1b36
+Revises: e81b4a6fd2c9
+Create Date: 2026-10-18 15:21:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f7a2c9e1b36'
+down_revision = 'e81b4a6fd2c9'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, unique)
+INDEXES = [
+    ('ix_tweets_user_id_created_at', 'tweets', ['user_id', 'created_at', 'id'], False),
+    ('ix_comments_tweet_id_created_at', 'comments', ['tweet_id', 'created_at', 'id'], False),
+    ('ix_comments_user_id_created_at', 'comments', ['user_id', 'created_at', 'id'], False),
+    ('uq_likes_user_id_tweet_id', 'likes', ['user_id', 'tweet_id'], True),
+    ('ix_likes_tweet_id', 'likes', ['tweet_id'], False),
+    ('ix_images_tweet_id', 'images', ['tweet_id'], False),
+    ('ix_images_comment_id', 'images', ['comment_id'], False),
+    ('ix_images_user_id_type', 'images', ['user_id', 'type'], False),
+    ('ix_follows_following_id', 'follows', ['following_id', 'follower_id'], False),
+]
+
+
+def _follows_table(with_primary_key):
+    return sa.Table(
+        'follows',
+        sa.MetaData(),
+        sa.Column('follower_id', sa.Integer(), sa.ForeignKey('users.id'),
+                  primary_key=with_primary_key, nullable=not with_primary_key),
+        sa.Column('following_id', sa.Integer(), sa.ForeignKey('users.id'),
+                  primary_key=with_primary_key, nullable=not with_primary_key),
+    )
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    # Duplicate likes and follow edges would break the new unique keys. Keep
+    # the oldest copy and recount the likes of tweets that lost some.
+    op.execute("DELETE FROM likes WHERE id NOT IN (SELECT MIN(id) FROM likes GROUP BY user_id, tweet_id)")
+    op.execute("""
+        UPDATE tweets SET
+            like_count = (SELECT COUNT(*) FROM likes WHERE likes.tweet_id = tweets.id),
+            created_at = created_at
+        WHERE like_count != (SELECT COUNT(*) FROM likes WHERE likes.tweet_id = tweets.id)
+    """)
+    op.execute("DELETE FROM follows WHERE follower_id IS NULL OR following_id IS NULL")
+    if is_postgres:
+        op.execute("""
+            DELETE FROM follows a USING follows b
+            WHERE a.ctid > b.ctid
+                AND a.follower_id = b.follower_id
+                AND a.following_id = b.following_id
+        """)
+    else:
+        op.execute("""
+            DELETE FROM follows WHERE rowid NOT IN
+                (SELECT MIN(rowid) FROM follows GROUP BY follower_id, following_id)
+        """)
+
+    if is_postgres:
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction, and the
+        # primary key is attached to an index built the same way so writes
+        # to follows are never blocked for the length of a build
+        with op.get_context().autocommit_block():
+            for name, table, columns, unique in INDEXES:
+                op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+            op.create_index('follows_pkey', 'follows', ['follower_id', 'following_id'],
+                            unique=True, postgresql_concurrently=True)
+        op.execute('ALTER TABLE follows ADD CONSTRAINT follows_pkey PRIMARY KEY USING INDEX follows_pkey')
+    else:
+        with op.batch_alter_table('follows', copy_from=_follows_table(True), recreate='always'):
+            pass
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique)
+
+
+def downgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    if is_postgres:
+        op.drop_constraint('follows_pkey', 'follows', type_='primary')
+        op.alter_column('follows', 'follower_id', existing_type=sa.Integer(), nullable=True)
+        op.alter_column('follows', 'following_id', existing_type=sa.Integer(), nullable=True)
+        with op.get_context().autocommit_block():
+            for name, table, _, _ in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    else:
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
+        with op.batch_alter_table('follows', copy_from=_follows_table(False), recreate='always'):
+            pass
@@ -0,0 +1,29 @@
+"""pending status for images uploaded directly to storage
+
+Revision ID: 6a3f1c8e5d20
+Revises: d47b0e3f8a19
+Create Date: 2026-10-18 19:40:51.632094
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f1c8e5d20'
+down_revision = 'd47b0e3f8a19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('images', sa.Column('status', sa.String(length=20), server_default='ready', nullable=False))
+    op.create_index('ix_images_status_created_at', 'images', ['status', 'created_at'], unique=False)
+
+
+def downgrade():
+    # Rows for uploads that never finished have nothing to fall back to
+    op.execute("DELETE FROM images WHERE status != 'ready'")
+    op.drop_index('ix_images_status_created_at', table_name='images')
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('status')
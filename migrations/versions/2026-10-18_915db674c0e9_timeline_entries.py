@@ -0,0 +1,37 @@
+"""materialized home timelines
+
+Revision ID: 915db674c0e9
+Revises: 07fe34b1c285
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '915db674c0e9'
+down_revision = '07fe34b1c285'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('timeline_entries',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'tweet_id')
+    )
+    op.create_index('ix_timeline_entries_user_id_created_at', 'timeline_entries', ['user_id', 'created_at', 'tweet_id'], unique=False)
+    op.create_index('ix_timeline_entries_tweet_id', 'timeline_entries', ['tweet_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_timeline_entries_tweet_id', table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_user_id_created_at', table_name='timeline_entries')
+    op.drop_table('timeline_entries')
@@ -0,0 +1,52 @@
+"""full-text search indexes on tweets, comments and users
+
+Revision ID: 9c2e7a51d4f8
+Revises: b3d91f6c2a57
+Create Date: 2026-10-18 17:03:12.541870
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9c2e7a51d4f8'
+down_revision = 'b3d91f6c2a57'
+branch_labels = None
+depends_on = None
+
+# These must match app/models/search.py
+# (name, table, indexed document)
+POSTGRES_INDEXES = [
+    ('ix_tweets_content_search', 'tweets', "to_tsvector('english', content)"),
+    ('ix_comments_content_search', 'comments', "to_tsvector('english', content)"),
+    ('ix_users_name_search', 'users', "to_tsvector('simple', username || ' ' || first_name || ' ' || last_name)"),
+]
+
+# (name, table, FTS5 columns and options, source columns)
+SQLITE_FTS_TABLES = [
+    ('tweets_fts', 'tweets', "content, tokenize = 'porter unicode61'", 'content'),
+    ('comments_fts', 'comments', "content, tokenize = 'porter unicode61'", 'content'),
+    ('users_fts', 'users', "username, first_name, last_name, tokenize = 'unicode61'",
+     'username, first_name, last_name'),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, document in POSTGRES_INDEXES:
+                op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING gin ({document})')
+    else:
+        for name, table, definition, columns in SQLITE_FTS_TABLES:
+            op.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5({definition})')
+            op.execute(f'INSERT INTO {name} (rowid, {columns}) SELECT id, {columns} FROM {table}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, _, _ in reversed(POSTGRES_INDEXES):
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    else:
+        for name, _, _, _ in reversed(SQLITE_FTS_TABLES):
+            op.execute(f'DROP TABLE IF EXISTS {name}')
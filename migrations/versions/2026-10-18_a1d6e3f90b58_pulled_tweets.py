@@ -0,0 +1,42 @@
+"""pulled flag on tweets that weren't fanned out on write
+
+Revision ID: a1d6e3f90b58
+Revises: 0c7e5a92b1d4
+Create Date: 2026-10-18 22:14:37.518204
+
+"""
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a1d6e3f90b58'
+down_revision = '0c7e5a92b1d4'
+branch_labels = None
+depends_on = None
+
+FANOUT_FOLLOWER_THRESHOLD = int(os.environ.get('FANOUT_FOLLOWER_THRESHOLD', 10000))
+
+
+def upgrade():
+    op.add_column('tweets', sa.Column('pulled', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.create_index('ix_tweets_pulled_user_id_created_at', 'tweets', ['user_id', 'created_at', 'id'],
+                    sqlite_where=sa.text('pulled IS 1'), postgresql_where=sa.text('pulled IS true'))
+    # Until now the tweets of the accounts above the threshold were pulled
+    # without being marked. Those that reached no follower's timeline are
+    # the ones that were.
+    op.execute(sa.text("""
+        UPDATE tweets SET pulled = true
+        WHERE user_id IN (SELECT id FROM users WHERE follower_count >= :threshold)
+          AND NOT EXISTS (
+              SELECT 1 FROM timeline_entries
+              WHERE timeline_entries.tweet_id = tweets.id AND timeline_entries.user_id != tweets.user_id
+          )
+    """).bindparams(threshold=FANOUT_FOLLOWER_THRESHOLD))
+
+
+def downgrade():
+    op.drop_index('ix_tweets_pulled_user_id_created_at', table_name='tweets')
+    op.drop_column('tweets', 'pulled')
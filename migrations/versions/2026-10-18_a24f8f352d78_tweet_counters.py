@@ -0,0 +1,39 @@
+"""denormalized like, comment and image counters on tweets
+
+Revision ID: a24f8f352d78
+Revises: 915db674c0e9
+Create Date: 2026-10-18 11:40:07.281954
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a24f8f352d78'
+down_revision = '915db674c0e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('tweets', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tweets', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tweets', sa.Column('image_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from the child tables. created_at is assigned to itself so
+    # databases with an ON UPDATE trigger don't reorder every tweet.
+    op.execute("""
+        UPDATE tweets SET
+            like_count = (SELECT COUNT(*) FROM likes WHERE likes.tweet_id = tweets.id),
+            comment_count = (SELECT COUNT(*) FROM comments WHERE comments.tweet_id = tweets.id),
+            image_count = (SELECT COUNT(*) FROM images WHERE images.tweet_id = tweets.id),
+            created_at = created_at
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('tweets') as batch_op:
+        batch_op.drop_column('image_count')
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('like_count')
@@ -0,0 +1,37 @@
+"""denormalized follower and following counters on users
+
+Revision ID: b3d91f6c2a57
+Revises: 4f7a2c9e1b36
+Create Date: 2026-10-18 16:12:45.903117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3d91f6c2a57'
+down_revision = '4f7a2c9e1b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from the follow edges. Both subqueries are index only scans,
+    # on ix_follows_following_id and the primary key respectively.
+    op.execute("""
+        UPDATE users SET
+            follower_count = (SELECT COUNT(*) FROM follows WHERE follows.following_id = users.id),
+            following_count = (SELECT COUNT(*) FROM follows WHERE follows.follower_id = users.id)
+    """)
+
+
+def downgrade():
+    # Not a batch: rebuilding users on SQLite would silently lose the
+    # lower() expression indexes, which can't be reflected. SQLite supports
+    # DROP COLUMN since 3.35.
+    op.drop_column('users', 'following_count')
+    op.drop_column('users', 'follower_count')
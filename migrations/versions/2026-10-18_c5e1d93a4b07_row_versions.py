@@ -0,0 +1,28 @@
+"""row version counters on tweets and users for ETags
+
+Revision ID: c5e1d93a4b07
+Revises: a24f8f352d78
+Create Date: 2026-10-18 14:02:51.730415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1d93a4b07'
+down_revision = 'a24f8f352d78'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('tweets', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('version')
+    with op.batch_alter_table('tweets') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,45 @@
+"""hashtags and mentions extracted from tweets
+
+Revision ID: d47b0e3f8a19
+Revises: 9c2e7a51d4f8
+Create Date: 2026-10-18 18:24:05.217604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd47b0e3f8a19'
+down_revision = '9c2e7a51d4f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tweet_hashtags',
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.Column('tag', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tweet_id', 'tag')
+    )
+    op.create_index('ix_tweet_hashtags_tag_created_at', 'tweet_hashtags', ['tag', 'created_at', 'tweet_id'], unique=False)
+    op.create_index('ix_tweet_hashtags_created_at', 'tweet_hashtags', ['created_at'], unique=False)
+    op.create_table('tweet_mentions',
+    sa.Column('tweet_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['tweet_id'], ['tweets.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('tweet_id', 'user_id')
+    )
+    op.create_index('ix_tweet_mentions_user_id_created_at', 'tweet_mentions', ['user_id', 'created_at', 'tweet_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tweet_mentions_user_id_created_at', table_name='tweet_mentions')
+    op.drop_table('tweet_mentions')
+    op.drop_index('ix_tweet_hashtags_created_at', table_name='tweet_hashtags')
+    op.drop_index('ix_tweet_hashtags_tag_created_at', table_name='tweet_hashtags')
+    op.drop_table('tweet_hashtags')
@@ -0,0 +1,31 @@
+"""lower() indexes on user names for directory prefix search
+
+Revision ID: e81b4a6fd2c9
+Revises: c5e1d93a4b07
+Create Date: 2026-10-18 14:48:13.402687
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b4a6fd2c9'
+down_revision = 'c5e1d93a4b07'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['username', 'first_name', 'last_name']
+
+
+def upgrade():
+    # text_pattern_ops lets Postgres answer lower(column) LIKE 'abc%' from the
+    # index regardless of the database collation
+    ops = ' text_pattern_ops' if op.get_bind().dialect.name == 'postgresql' else ''
+    for column in COLUMNS:
+        op.execute(f'CREATE INDEX ix_users_lower_{column} ON users (lower({column}){ops})')
+
+
+def downgrade():
+    # IF EXISTS since a batch rebuild of users on SQLite drops them unnoticed
+    for column in COLUMNS:
+        op.execute(f'DROP INDEX IF EXISTS ix_users_lower_{column}')
@@ -0,0 +1,31 @@
+"""dimensions, placeholder and resized variants of images
+
+Revision ID: f2b8d61c4e73
+Revises: 6a3f1c8e5d20
+Create Date: 2026-10-18 20:12:37.418265
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d61c4e73'
+down_revision = '6a3f1c8e5d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('images', sa.Column('width', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('height', sa.Integer(), nullable=True))
+    op.add_column('images', sa.Column('placeholder', sa.String(length=64), nullable=True))
+    op.add_column('images', sa.Column('variants', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('images') as batch_op:
+        batch_op.drop_column('variants')
+        batch_op.drop_column('placeholder')
+        batch_op.drop_column('height')
+        batch_op.drop_column('width')
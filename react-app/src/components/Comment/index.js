@@ -5,6 +5,7 @@ import litter from '../../assets/images/threeDots.svg'
 import stretch from '../../assets/images/stretch.png'
 import stretch2 from '../../assets/images/stretch2.png'
 import { Modal } from '../../context/Modal'
+import imageSources from '../../utils/imageSources'
 import './Comment.css'
 
 const Comment = ({ tweet, comment, sessionUser, tweetOwner, setCommentToUpdate, setShowUpdateCommentForm, setShowDeleteComment }) => {
@@ -102,7 +103,7 @@ const Comment = ({ tweet, comment, sessionUser, tweetOwner, setCommentToUpdate,
               <img
                 key={image.id}
                 className='tweet-image'
-                src={image.url}
+                {...imageSources(image)}
                 alt=""
                 onClick={(e) => {
                   e.stopPropagation()
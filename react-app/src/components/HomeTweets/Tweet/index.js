@@ -7,17 +7,15 @@ import fullHeartIcon from '../../../assets/images/FullHeart.svg'
 import litter from '../../../assets/images/threeDots.svg'
 import stretch from '../../../assets/images/stretch.png'
 import stretch2 from '../../../assets/images/stretch2.png'
-import { likeTweetThunk } from '../../../store/tweets'
+import { likeTweetThunk, unlikeTweetThunk } from '../../../store/tweets'
 import { useDispatch } from 'react-redux'
+import imageSources from '../../../utils/imageSources'
 import './Tweet.css'
 
 const Tweet = ({ setTweet, tweet, sessionUser, setShowDeleteTweet, setShowUpdateTweetForm }) => {
   const [showDropDown, setShowDropDown] = useState(false)
-  const [isLikedByUser, setIsLikedByUser] = useState(false)
-  const [likeCounter, setLikeCounter] = useState(tweet.tweet_likes.length)
-  const [likedTweet, setLikedTweet] = useState(() =>
-    tweet.tweet_likes.find(like => like.user_id === sessionUser?.id) || null
-  )
+  const [isLikedByUser, setIsLikedByUser] = useState(Boolean(tweet.viewer_has_liked))
+  const [likeCounter, setLikeCounter] = useState(tweet.like_count)
   const newDate = Date.parse(tweet.created_at);
   const formattedDate = intlFormatDistance(new Date(newDate), new Date())
   const history = useHistory()
@@ -36,28 +34,17 @@ const Tweet = ({ setTweet, tweet, sessionUser, setShowDeleteTweet, setShowUpdate
   }, [showDropDown]);
 
   useEffect(() => {
-    setIsLikedByUser(Boolean(likedTweet))
-  }, [likedTweet])
-
-  useEffect(() => {
-    setLikeCounter(tweet.tweet_likes.length)
-    setLikedTweet(tweet.tweet_likes.find(like => like.user_id === sessionUser?.id) || null)
-  }, [sessionUser?.id, tweet.tweet_likes])
+    setLikeCounter(tweet.like_count)
+    setIsLikedByUser(Boolean(tweet.viewer_has_liked))
+  }, [sessionUser?.id, tweet.like_count, tweet.viewer_has_liked])
 
   const handleLike = async (e) => {
     e.stopPropagation()
-    if (isLikedByUser && likedTweet) {
-      await fetch(`/api/likes/${likedTweet.id}`, {
-        method: 'DELETE'
-      })
-      setIsLikedByUser(false)
-      setLikeCounter((prev) => prev - 1)
-      setLikedTweet(null)
-    } else {
-      const like = await dispatch(likeTweetThunk(tweet.id))
-      setIsLikedByUser(true)
-      setLikedTweet(like)
-      setLikeCounter((prev) => prev + 1)
+    const toggle = isLikedByUser ? unlikeTweetThunk : likeTweetThunk
+    const likeState = await dispatch(toggle(tweet.id))
+    if (likeState && likeState.like_count !== undefined) {
+      setIsLikedByUser(likeState.viewer_has_liked)
+      setLikeCounter(likeState.like_count)
     }
   }
   return (
@@ -120,7 +107,7 @@ const Tweet = ({ setTweet, tweet, sessionUser, setShowDeleteTweet, setShowUpdate
           </div>
           {tweet.tweet_images.length > 0 && <div className='tweet-image-container'>
               {tweet.tweet_images.map(image => (
-                <img key={image.id} className='tweet-image' src={image.url} alt="Tweet attachment" />
+                <img key={image.id} className='tweet-image' {...imageSources(image)} alt="Tweet attachment" />
               ))}
           </div>}
         </div>
@@ -133,12 +120,12 @@ const Tweet = ({ setTweet, tweet, sessionUser, setShowDeleteTweet, setShowUpdate
               <img className='tweet icon comment' src={commentIcon} alt="comment-icon" />
             </div >
             <div className='comment-counter'>
-              <span>{tweet.tweet_comments.length}</span>
+              <span>{tweet.comment_count}</span>
             </div>
           </div>
           <div onClick={handleLike} className={`heart-info-container`}>
             <div className='heart-icon-container'>
-              <img className={`tweet icon heart ${likedTweet ? 'liked' : 'not-liked'}`} src={likedTweet ? fullHeartIcon : heartIcon} alt="heart-icon" />
+              <img className={`tweet icon heart ${isLikedByUser ? 'liked' : 'not-liked'}`} src={isLikedByUser ? fullHeartIcon : heartIcon} alt="heart-icon" />
             </div>
             <div className='comment-counter'>
               <span>{likeCounter}</span>
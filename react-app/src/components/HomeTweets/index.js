@@ -22,7 +22,7 @@ const HomeTweets = ({ sessionUser }) => {
     // Default to true if undefined (we don't know yet), false only if explicitly false
     return hasMoreValue !== false
   })
-  const currentPage = useSelector(state => state.tweets.currentPage || 1)
+  const nextCursor = useSelector(state => state.tweets.nextCursor || null)
   const observerTarget = useRef(null)
   const lastLoadTimeRef = useRef(0)
 
@@ -44,7 +44,7 @@ const HomeTweets = ({ sessionUser }) => {
       setTweetsLoaded(false)
       setInitialLoadComplete(false)
       setHasUserScrolled(false)
-      dispatch(getAllTweetsThunk(1, 20)).then(() => {
+      dispatch(getAllTweetsThunk(null, 20)).then(() => {
         setTweetsLoaded(true)
         // Wait a bit before allowing infinite scroll to prevent immediate triggering
         setTimeout(() => {
@@ -67,15 +67,14 @@ const HomeTweets = ({ sessionUser }) => {
     
     setLoadingMore(true)
     lastLoadTimeRef.current = now
-    const nextPage = currentPage + 1
     try {
-      await dispatch(getAllTweetsThunk(nextPage, 20))
+      await dispatch(getAllTweetsThunk(nextCursor, 20))
     } catch (error) {
       console.error('Error loading more tweets:', error)
     } finally {
       setLoadingMore(false)
     }
-  }, [dispatch, currentPage, hasMore, loadingMore])
+  }, [dispatch, nextCursor, hasMore, loadingMore])
 
   // Intersection Observer for infinite scroll
   useEffect(() => {
@@ -90,7 +89,7 @@ const HomeTweets = ({ sessionUser }) => {
         const entry = entries[0]
         // Only trigger if user has scrolled (not immediately visible on page load)
         if (entry.isIntersecting && !loadingMore && hasMore && hasUserScrolled) {
-          console.log('Triggering load more tweets, page:', currentPage + 1, 'hasMore:', hasMore)
+          console.log('Triggering load more tweets, cursor:', nextCursor, 'hasMore:', hasMore)
           loadMoreTweets()
         }
       },
@@ -105,7 +104,7 @@ const HomeTweets = ({ sessionUser }) => {
     return () => {
       observer.unobserve(currentTarget)
     }
-  }, [tweetsLoaded, initialLoadComplete, loadMoreTweets, loadingMore, hasMore, currentPage, hasUserScrolled])
+  }, [tweetsLoaded, initialLoadComplete, loadMoreTweets, loadingMore, hasMore, nextCursor, hasUserScrolled])
 
   return tweetsLoaded ? (
     <div className='tweets-container'>
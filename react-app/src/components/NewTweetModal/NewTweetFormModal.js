@@ -51,22 +51,11 @@ const NewTweetFormModal = ({ sessionUser, setShowNewTweetFormModal, showNewTweet
 
   const handleSubmit = async (e) => {
     e.preventDefault()
-    const data = await dispatch(createNewTweetThunk(content.trim()))
+    const data = await dispatch(createNewTweetThunk(content.trim(), image ? [image] : []))
     if (Array.isArray(data)) {
       setHasSubmittedModal(true)
     } else {
       setIsSubmitting(true)
-      if (image) {
-        const formData = new FormData();
-        formData.append("image", image);
-        formData.append("type", "tweet");
-        formData.append("tweet_id", data.id)
-        formData.append("user_id", sessionUser.id)
-        await fetch('/api/images', {
-          method: "POST",
-          body: formData,
-        });
-      }
       setImage(null);
       setPreviewImageModal(null)
       setImageError(null)
@@ -16,7 +16,8 @@ import Comment from '../Comment'
 import NewCommentForm from '../NewCommentForm'
 import UpdateCommentForm from '../UpdateCommentForm'
 import DeleteComment from '../DeleteComment'
-import { likeTweetThunk } from '../../store/tweets'
+import { likeTweetThunk, unlikeTweetThunk, getTweetCommentsThunk } from '../../store/tweets'
+import imageSources from '../../utils/imageSources'
 import './SingleTweet.css'
 import LoadingAnimation from '../LoadingAnimation'
 
@@ -36,9 +37,6 @@ const SingleTweet = ({ sessionUser }) => {
   const history = useHistory()
   const tweet = useSelector(state => state.tweets[Number(tweetId)])
 
-  const likesArray = tweet?.tweet_likes
-  const likedTweet = likesArray?.find(like => like.user_id === sessionUser?.id)
-
   useEffect(() => {
     if (!tweetId) return
     setIsLoaded(false)
@@ -58,8 +56,8 @@ const SingleTweet = ({ sessionUser }) => {
   }, [showDropDown]);
 
   useEffect(() => {
-    setIsLikedByUser(!!likedTweet)
-  }, [likedTweet, tweet?.tweet_likes?.length])
+    setIsLikedByUser(!!tweet?.viewer_has_liked)
+  }, [tweet?.viewer_has_liked])
 
   let newDate;
   let formattedDate;
@@ -75,16 +73,8 @@ const SingleTweet = ({ sessionUser }) => {
   const handleLike = async (e) => {
     e.stopPropagation()
     if (!tweet) return
-    if (isLikedByUser && likedTweet) {
-      await fetch(`/api/likes/${likedTweet.id}`, {
-        method: 'DELETE'
-      })
-      setIsLikedByUser(false)
-      await dispatch(getSingleTweetThunk(tweet.id))
-    } else {
-      await dispatch(likeTweetThunk(tweet.id))
-      await dispatch(getSingleTweetThunk(tweet.id))
-    }
+    const toggle = isLikedByUser ? unlikeTweetThunk : likeTweetThunk
+    await dispatch(toggle(tweet.id))
   }
   return isLoaded ? (
     <>
@@ -187,7 +177,7 @@ const SingleTweet = ({ sessionUser }) => {
                 <img
                   key={image.id}
                   className='tweet-image single'
-                  src={image.url}
+                  {...imageSources(image)}
                   alt="Tweet attachment"
                   onClick={(e) => {
                     e.stopPropagation()
@@ -209,15 +199,15 @@ const SingleTweet = ({ sessionUser }) => {
               <img className='tweet icon comment' src={commentIcon} alt="comment-icon" />
             </div >
             <div className='comment-counter'>
-              <span>{tweet.tweet_comments.length}</span>
+              <span>{tweet.comment_count}</span>
             </div>
           </div>
           <div onClick={handleLike} className='heart-info-container'>
             <div className='heart-icon-container'>
-              <img className={`tweet icon heart ${likedTweet ? 'liked' : 'not-liked'}`} src={likedTweet ? fullHeartIcon : heartIcon} alt="heart-icon" />
+              <img className={`tweet icon heart ${isLikedByUser ? 'liked' : 'not-liked'}`} src={isLikedByUser ? fullHeartIcon : heartIcon} alt="heart-icon" />
             </div>
             <div className='comment-counter'>
-              <span>{tweet.tweet_likes.length}</span>
+              <span>{tweet.like_count}</span>
             </div>
           </div>
         </div>
@@ -227,6 +217,15 @@ const SingleTweet = ({ sessionUser }) => {
         {tweet.tweet_comments.length > 0 && tweet.tweet_comments.map(comment => (
           <Comment tweet={tweet} tweetOwner={user} key={comment.id} sessionUser={sessionUser} comment={comment} setShowDeleteComment={setShowDeleteComment} setShowNewCommentForm={setShowNewCommentForm} setCommentToUpdate={setCommentToUpdate} setShowUpdateCommentForm={setShowUpdateCommentForm} />
         ))}
+        {tweet.comments_next_cursor && (
+          <button
+            type='button'
+            className='tweet-action-button'
+            onClick={() => dispatch(getTweetCommentsThunk(tweet.id, tweet.comments_next_cursor))}
+          >
+            Show more replies
+          </button>
+        )}
       </div>
     </>
   ) : (
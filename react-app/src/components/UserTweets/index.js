@@ -17,8 +17,9 @@ const extractSafeUser = (user) => {
   if (!user) return null;
   return {
     ...user,
-    followers: Array.isArray(user.followers) ? [...user.followers] : [],
-    following: Array.isArray(user.following) ? [...user.following] : [],
+    follower_count: user.follower_count ?? 0,
+    following_count: user.following_count ?? 0,
+    viewer_is_following: Boolean(user.viewer_is_following),
   };
 };
 
@@ -38,17 +39,21 @@ const UserTweets = ({ sessionUser, onProfileUpdate }) => {
   const tweetList = useSelector(
     (state) => state.tweets.userTweets?.userTweetsList ?? []
   );
+  const nextCursor = useSelector(
+    (state) => state.tweets.userTweetsNextCursor ?? null
+  );
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   const isViewingOwnProfile = profile && sessionUser?.id === profile.id;
 
   const isFollowing = useMemo(() => {
     if (!profile || !sessionUser) return false;
-    return profile.followers?.includes(sessionUser.id) ?? false;
+    return profile.viewer_is_following;
   }, [profile, sessionUser]);
 
-  const followerCount = profile?.followers?.length ?? 0;
-  const followingCount = profile?.following?.length ?? 0;
-  const tweetCount = tweetList.length;
+  const followerCount = profile?.follower_count ?? 0;
+  const followingCount = profile?.following_count ?? 0;
+  const tweetCount = profile?.tweet_count ?? tweetList.length;
 
   const profileUpdateRef = useRef(onProfileUpdate);
 
@@ -134,6 +139,13 @@ const UserTweets = ({ sessionUser, onProfileUpdate }) => {
     }
   };
 
+  const loadMoreTweets = async () => {
+    if (!nextCursor || isLoadingMore) return;
+    setIsLoadingMore(true);
+    await dispatch(getUserTweetsThunk(username, nextCursor));
+    setIsLoadingMore(false);
+  };
+
   const shouldShowLoading = !isLoaded || !profile;
 
   if (error && !profile) {
@@ -276,6 +288,16 @@ const UserTweets = ({ sessionUser, onProfileUpdate }) => {
                 <p>Once they start tweeting, their updates will live here.</p>
               </div>
             )}
+            {nextCursor && (
+              <button
+                type="button"
+                className="tweet-action-button"
+                onClick={loadMoreTweets}
+                disabled={isLoadingMore}
+              >
+                {isLoadingMore ? "..." : "Show more tweets"}
+              </button>
+            )}
           </section>
         </div>
       )}
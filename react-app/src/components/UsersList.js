@@ -15,16 +15,20 @@ function UsersList({ sessionUser }) {
   useEffect(() => {
     async function fetchData() {
       if (sessionUser) {
-        const response = await fetch('/api/users/');
-        const responseData = await response.json();
+        // Friends of friends first; brand new sites have no follows to
+        // suggest from, so fall back to the directory
+        let response = await fetch('/api/users/suggestions?limit=6');
+        let responseData = await response.json();
+        if (!responseData.users || !responseData.users.length) {
+          response = await fetch('/api/users/?per_page=6');
+          responseData = await response.json();
+        }
         setUsers(responseData.users);
         
         // Initialize following status
         const status = {};
         responseData.users.forEach(user => {
-          if (currentUser && currentUser.following) {
-            status[user.id] = currentUser.following.includes(user.id);
-          }
+          status[user.id] = Boolean(user.viewer_is_following);
         });
         setFollowingStatus(status);
       }
@@ -165,12 +165,10 @@ export default function reducer(state = initialState, action) {
       return { user: null }
     case FOLLOW_USER: {
       if (!state.user) return state;
-      const following = new Set(state.user.following || []);
-      following.add(action.id);
       return {
         user: {
           ...state.user,
-          following: Array.from(following)
+          following_count: (state.user.following_count || 0) + 1
         }
       };
     }
@@ -179,9 +177,7 @@ export default function reducer(state = initialState, action) {
       return {
         user: {
           ...state.user,
-          following: (state.user.following || []).filter(
-            (followedId) => followedId !== action.id
-          )
+          following_count: Math.max((state.user.following_count || 0) - 1, 0)
         }
       };
     }
@@ -5,6 +5,7 @@ const CREATE_NEW_TWEET = 'tweets/CREATE_NEW_TWEET';
 const UPDATE_TWEET = 'tweets/UPDATE_TWEET';
 const DELETE_TWEET = 'tweets/DELETE_TWEET';
 const LIKE_TWEET = 'tweets/LIKE_TWEET';
+const GET_TWEET_COMMENTS = 'tweets/GET_TWEET_COMMENTS';
 
 
 const getAllTweetsAction = (data, replace = false) => ({
@@ -18,9 +19,10 @@ const getSingleTweetAction = (tweet) => ({
   tweet
 });
 
-const getUserTweetsAction = (tweets) => ({
+const getUserTweetsAction = (tweets, append = false) => ({
   type: GET_USER_TWEETS,
-  tweets
+  tweets,
+  append
 });
 
 const createNewTweetAction = (tweet) => ({
@@ -38,18 +40,27 @@ const deleteTweetAction = (id) => ({
   id
 });
 
-const likeTweetAction = (like) => ({
+const likeTweetAction = (likeState) => ({
   type: LIKE_TWEET,
-  like
+  likeState
+})
+
+const getTweetCommentsAction = (tweetId, data) => ({
+  type: GET_TWEET_COMMENTS,
+  tweetId,
+  comments: data.comments,
+  nextCursor: data.next_cursor
 })
 
 
-export const getAllTweetsThunk = (page = 1, perPage = 20) => async (dispatch) => {
-  const response = await fetch(`/api/tweets/home?page=${page}&per_page=${perPage}`);
+export const getAllTweetsThunk = (cursor = null, perPage = 20) => async (dispatch) => {
+  const params = new URLSearchParams({ per_page: perPage });
+  if (cursor) params.set('cursor', cursor);
+  const response = await fetch(`/api/tweets/home?${params}`);
 
   if (response.ok) {
     const data = await response.json();
-    await dispatch(getAllTweetsAction(data, page === 1))
+    await dispatch(getAllTweetsAction(data, !cursor))
     return data;
   } else if (response.status < 500) {
     const data = await response.json();
@@ -78,12 +89,33 @@ export const getSingleTweetThunk = (tweetId) => async (dispatch) => {
   }
 }
 
-export const getUserTweetsThunk = (username) => async (dispatch) => {
-  const response = await fetch(`/api/tweets/${username}`);
+export const getTweetCommentsThunk = (tweetId, cursor) => async (dispatch) => {
+  const params = new URLSearchParams();
+  if (cursor) params.set('cursor', cursor);
+  const response = await fetch(`/api/tweets/${tweetId}/comments?${params}`);
+
+  if (response.ok) {
+    const data = await response.json();
+    await dispatch(getTweetCommentsAction(tweetId, data))
+    return data;
+  } else if (response.status < 500) {
+    const data = await response.json();
+    if (data.errors) {
+      return data.errors;
+    }
+  } else {
+    return ['An error occurred. Please try again.']
+  }
+}
+
+export const getUserTweetsThunk = (username, cursor = null, perPage = 20) => async (dispatch) => {
+  const params = new URLSearchParams({ per_page: perPage });
+  if (cursor) params.set('cursor', cursor);
+  const response = await fetch(`/api/tweets/${username}?${params}`);
 
   if (response.ok) {
     const tweets = await response.json();
-    await dispatch(getUserTweetsAction(tweets))
+    await dispatch(getUserTweetsAction(tweets, Boolean(cursor)))
     return tweets;
   } else if (response.status < 500) {
     const data = await response.json();
@@ -96,14 +128,24 @@ export const getUserTweetsThunk = (username) => async (dispatch) => {
   }
 }
 
-export const createNewTweetThunk = (content) => async (dispatch) => {
-  const response = await fetch('/api/tweets', {
-    method: "POST",
-    headers: {
-      'Content-type': 'application/json'
-    },
-    body: JSON.stringify({ content })
-  });
+// Images are sent in the same request as the tweet, as multipart form data
+export const createNewTweetThunk = (content, images = []) => async (dispatch) => {
+  let request
+  if (images.length) {
+    const formData = new FormData()
+    formData.append('content', content)
+    images.forEach(image => formData.append('images', image))
+    request = { method: "POST", body: formData }
+  } else {
+    request = {
+      method: "POST",
+      headers: {
+        'Content-type': 'application/json'
+      },
+      body: JSON.stringify({ content })
+    }
+  }
+  const response = await fetch('/api/tweets', request);
 
   if (response.ok) {
     const tweet = await response.json();
@@ -142,14 +184,34 @@ export const updateTweetThunk = (id, content) => async (dispatch) => {
   }
 }
 
+// Both return { tweet_id, viewer_has_liked, viewer_like_id, like_count } and
+// are safe to repeat, so a double click can't like a tweet twice
 export const likeTweetThunk = (id) => async (dispatch) => {
   const response = await fetch(`/api/tweets/${id}/like`, {
-    method: "POST"
+    method: "PUT"
+  });
+  if (response.ok) {
+    const likeState = await response.json();
+    await dispatch(likeTweetAction(likeState))
+    return likeState;
+  } else if (response.status < 500) {
+    const data = await response.json();
+    if (data.errors) {
+      return data.errors;
+    }
+  } else {
+    return ['An error occurred. Please try again.']
+  }
+}
+
+export const unlikeTweetThunk = (id) => async (dispatch) => {
+  const response = await fetch(`/api/tweets/${id}/like`, {
+    method: "DELETE"
   });
   if (response.ok) {
-    const like = await response.json();
-    await dispatch(likeTweetAction(like))
-    return like;
+    const likeState = await response.json();
+    await dispatch(likeTweetAction(likeState))
+    return likeState;
   } else if (response.status < 500) {
     const data = await response.json();
     if (data.errors) {
@@ -220,19 +282,26 @@ export default function tweetsReducer(state = {}, action) {
       
       // Store pagination info
       newState.hasMore = action.tweets.has_more === true || action.tweets.has_more === 'true'
-      newState.currentPage = action.tweets.page || 1;
+      newState.nextCursor = action.tweets.next_cursor || null;
       
       return newState;
     }
     case GET_USER_TWEETS: {
       const newState = { ...state }
+      const previousTweets = action.append ? (state.userTweets?.userTweetsList ?? []) : []
+      const loadedIds = new Set(action.tweets.tweets.map(tweet => tweet.id))
+      const tweets = [
+        ...previousTweets.filter(tweet => !loadedIds.has(tweet.id)),
+        ...action.tweets.tweets
+      ]
       newState.userTweets = {}
-      action.tweets.tweets.forEach(tweet => {
+      tweets.forEach(tweet => {
         newState.userTweets[tweet.id] = tweet
       })
-      newState.userTweets.userTweetsList = [...action.tweets.tweets].sort(function (a, b) {
+      newState.userTweets.userTweetsList = [...tweets].sort(function (a, b) {
         return new Date(b.created_at) - new Date(a.created_at);
       })
+      newState.userTweetsNextCursor = action.tweets.next_cursor || null
       newState.userTweets.userTweetsList.forEach(tweet => {
         tweet.tweet_comments.sort(function (a, b) {
           return new Date(b.created_at) - new Date(a.created_at);
@@ -260,8 +329,28 @@ export default function tweetsReducer(state = {}, action) {
       delete newState[action.id]
       return newState
     }
+    case GET_TWEET_COMMENTS: {
+      const tweet = state[action.tweetId];
+      if (!tweet) return state;
+      const existingIds = new Set((tweet.tweet_comments || []).map(c => c.id));
+      return {
+        ...state,
+        [action.tweetId]: {
+          ...tweet,
+          tweet_comments: [
+            ...(tweet.tweet_comments || []),
+            ...action.comments.filter(c => !existingIds.has(c.id))
+          ],
+          comments_next_cursor: action.nextCursor
+        }
+      };
+    }
     case LIKE_TWEET: {
+      const { tweet_id, ...likeState } = action.likeState
       const newState = { ...state }
+      if (newState[tweet_id]) {
+        newState[tweet_id] = { ...newState[tweet_id], ...likeState }
+      }
       return newState;
     }
     default:
@@ -0,0 +1,18 @@
+// <img> attributes for an uploaded image: the resized WebP variants as a
+// srcSet, so the browser downloads the smallest one that fills the slot,
+// and the stored dimensions, so the layout doesn't jump when it loads.
+// Images whose variants haven't been rendered yet fall back to the original.
+const imageSources = (image, sizes = '(max-width: 600px) 100vw, 600px') => {
+  const props = { src: image.url, loading: 'lazy' }
+  if (image.width && image.height) {
+    props.width = image.width
+    props.height = image.height
+  }
+  if (image.variants?.length) {
+    props.srcSet = image.variants.map(variant => `${variant.url} ${variant.width}w`).join(', ')
+    props.sizes = sizes
+  }
+  return props
+}
+
+export default imageSources